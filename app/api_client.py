@@ -0,0 +1,156 @@
+# app/api_client.py
+
+import socket
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.util.request import ACCEPT_ENCODING
+
+from app import compression, serialization
+
+
+DEFAULT_BASE_URL = "http://localhost:8000"
+# これ以上の大きさのリクエスト本文を圧縮する（バイト）
+DEFAULT_COMPRESS_MIN_BYTES = 1024
+
+
+class _UnixHTTPConnection(HTTPConnection):
+	"""TCPの代わりにUnixドメインソケットに接続するHTTP接続"""
+
+	def __init__(self, *args, socket_path: str, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.socket_path = socket_path
+
+	def _new_conn(self) -> socket.socket:
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		if isinstance(self.timeout, int | float):
+			sock.settimeout(self.timeout)
+		try:
+			sock.connect(self.socket_path)
+		except OSError:
+			sock.close()
+			raise
+		return sock
+
+
+class _UnixHTTPConnectionPool(HTTPConnectionPool):
+	ConnectionCls = _UnixHTTPConnection
+
+
+class UnixSocketAdapter(HTTPAdapter):
+	"""
+	すべてのリクエストを1つのUnixドメインソケットに送るrequestsのアダプター
+
+	URLのホスト名とポートは無視されます（Hostヘッダーにのみ使われます）。
+	"""
+
+	def __init__(self, socket_path: str, pool_maxsize: int = 10):
+		super().__init__(pool_maxsize=pool_maxsize)
+		self.socket_path = socket_path
+		self._pool = _UnixHTTPConnectionPool(
+			"localhost", maxsize=pool_maxsize, socket_path=socket_path
+		)
+
+	def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+		return self._pool
+
+	def get_connection(self, url, proxies=None):
+		return self._pool
+
+	def close(self):
+		super().close()
+		self._pool.close()
+
+
+class MaskingAPIError(Exception):
+	"""マスキングAPIがエラーを返した場合の例外"""
+
+	def __init__(self, status_code: int, detail: str):
+		super().__init__(f"{status_code} - {detail}")
+		self.status_code = status_code
+		self.detail = detail
+
+
+class MaskingClient:
+	"""
+	マスキングAPIのクライアント
+
+	binary=Trueの場合はリクエストとレスポンスをmsgpackでやり取りします
+	（サーバーとクライアントの両方にmsgpackが必要です）。接続はセッションで
+	再利用されます。
+
+	compress_min_bytes以上のリクエスト本文はrequest_encoding（gzipまたはzstd）で
+	圧縮して送り、圧縮されたレスポンスは自動で展開します。
+	compress_min_bytesにNoneを指定するとリクエストを圧縮しません。
+
+	socket_pathを指定すると、同じホストで動いているサーバーにTCPではなく
+	Unixドメインソケットで接続します（base_urlのホスト名は無視されます）。
+	"""
+
+	def __init__(
+		self,
+		base_url: str = DEFAULT_BASE_URL,
+		binary: bool = False,
+		timeout: float | None = None,
+		session: requests.Session | None = None,
+		compress_min_bytes: int | None = DEFAULT_COMPRESS_MIN_BYTES,
+		request_encoding: str = "gzip",
+		socket_path: str | None = None,
+	):
+		if binary and serialization.msgpack is None:
+			raise RuntimeError("binary=Trueにはmsgpackのインストールが必要です。")
+		if request_encoding not in compression.SUPPORTED_ENCODINGS:
+			raise ValueError(f"未対応の圧縮方式です: {request_encoding}")
+		self.base_url = base_url.rstrip("/")
+		self.binary = binary
+		self.timeout = timeout
+		self.session = session or requests.Session()
+		if socket_path:
+			self.session.mount(self.base_url + "/", UnixSocketAdapter(socket_path))
+		self.compress_min_bytes = compress_min_bytes
+		self.request_encoding = request_encoding
+
+	def post(self, path: str, payload: dict) -> dict:
+		"""pathにpayloadを送信し、レスポンスを辞書として返す"""
+		if self.binary:
+			body = serialization.packb(payload)
+			headers = {
+				"Content-Type": serialization.MSGPACK_MEDIA_TYPE,
+				"Accept": serialization.MSGPACK_MEDIA_TYPE,
+			}
+		else:
+			body = serialization.dumps(payload)
+			headers = {"Content-Type": serialization.JSON_MEDIA_TYPE}
+		# レスポンスはrequests（urllib3）が展開できる方式で受け取る
+		headers["Accept-Encoding"] = ACCEPT_ENCODING
+		if self.compress_min_bytes is not None and len(body) >= self.compress_min_bytes:
+			body = compression.compress(body, self.request_encoding)
+			headers["Content-Encoding"] = self.request_encoding
+		response = self.session.post(
+			self.base_url + path, data=body, headers=headers, timeout=self.timeout
+		)
+		if response.status_code != 200:
+			raise MaskingAPIError(response.status_code, response.text)
+		if serialization.is_msgpack(response.headers.get("Content-Type")):
+			return serialization.unpackb(response.content)
+		return serialization.loads(response.content)
+
+	def mask_text(self, text: str, **options) -> dict:
+		"""テキストをマスキング（optionsはEnhancedMaskingRequestのフィールド）"""
+		return self.post("/mask_text", {"text": text, **options})
+
+	def decode_text(self, masked_text: str, **source) -> str:
+		"""
+		マスキングされたテキストを復元
+
+		sourceにはentity_mapping、mapping_handle、session_idのいずれかを指定します。
+		"""
+		return self.post("/decode_text", {"masked_text": masked_text, **source})[
+			"decoded_text"
+		]
+
+	def decode_batch(self, items: list[dict], **source) -> list[str]:
+		"""複数のテキストをまとめて復元（sourceは全項目に共通のマッピング）"""
+		return self.post("/decode_batch", {"items": items, **source})["decoded_texts"]
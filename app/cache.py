@@ -0,0 +1,58 @@
+# app/cache.py
+
+import threading
+from collections import OrderedDict
+from typing import Any
+
+
+class LRUCache:
+	"""ヒット・ミス・追い出し回数を記録するスレッドセーフなLRUキャッシュ"""
+
+	def __init__(self, maxsize: int = 1024):
+		self.maxsize = maxsize
+		self._data: OrderedDict[Any, Any] = OrderedDict()
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, key, default=None):
+		"""キーに対応する値を取得（最近使用したものとして扱う）"""
+		with self._lock:
+			try:
+				value = self._data[key]
+			except KeyError:
+				self.misses += 1
+				return default
+			self._data.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def put(self, key, value) -> None:
+		"""値を格納し、上限を超えた分を古い順に追い出す"""
+		if self.maxsize <= 0:
+			return
+		with self._lock:
+			self._data[key] = value
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+				self.evictions += 1
+
+	def clear(self) -> None:
+		"""キャッシュを空にする（カウンタは保持）"""
+		with self._lock:
+			self._data.clear()
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+	def stats(self) -> dict[str, int]:
+		"""キャッシュの統計情報"""
+		return {
+			"size": len(self._data),
+			"maxsize": self.maxsize,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+		}
@@ -0,0 +1,112 @@
+# app/compression.py
+
+import zlib
+
+from app.serialization import header_weights
+
+
+try:
+	import zstandard
+except ImportError:  # zstandardは任意の依存関係（未インストール時はgzipのみ）
+	zstandard = None
+
+
+# サーバーが優先する順のContent-Encoding
+SUPPORTED_ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+class UnsupportedEncodingError(ValueError):
+	"""対応していないContent-Encodingが指定された場合の例外"""
+
+
+class DecompressedSizeError(ValueError):
+	"""展開後のサイズが上限を超えた場合の例外"""
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+	"""dataをencoding（zstdまたはgzip）で圧縮"""
+	if encoding == "zstd" and zstandard is not None:
+		return zstandard.ZstdCompressor(level=3).compress(data)
+	if encoding == "gzip":
+		# gzip.compressと同じ形式（wbits=31）をzlibで直接作成
+		compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+		return compressor.compress(data) + compressor.flush()
+	raise UnsupportedEncodingError(encoding)
+
+
+class _SizeLimit:
+	"""書き込まれたバイト数を数えるだけの出力先（上限を超えると例外）"""
+
+	def __init__(self, max_size: int):
+		self.max_size = max_size
+		self.size = 0
+
+	def write(self, data: bytes) -> int:
+		self.size += len(data)
+		if self.size > self.max_size:
+			raise DecompressedSizeError("展開後のサイズが上限を超えました。")
+		return len(data)
+
+
+class Decompressor:
+	"""チャンク単位で受け取った圧縮データを展開（max_sizeを超えるとValueError）"""
+
+	def __init__(self, encoding: str, max_size: int | None = None):
+		encoding = encoding.strip().lower()
+		# zlibは出力の上限を指定できるため、展開しきる前に上限超過を検出できる
+		self._bounded = encoding in ("gzip", "x-gzip")
+		self._size_guard = None
+		if encoding == "zstd" and zstandard is not None:
+			self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+			if max_size is not None:
+				# decompressobjは出力の上限を指定できないため、先に出力を捨てる
+				# stream_writerに通し、write_size単位でサイズを確かめる
+				self._size_guard = zstandard.ZstdDecompressor().stream_writer(
+					_SizeLimit(max_size)
+				)
+		elif self._bounded:
+			self._decompressor = zlib.decompressobj(31)
+		else:
+			raise UnsupportedEncodingError(encoding)
+		self.max_size = max_size
+		self.size = 0
+
+	def decompress(self, chunk: bytes) -> bytes:
+		if self._size_guard is not None:
+			self._size_guard.write(chunk)
+		if self.max_size is not None and self._bounded:
+			# 上限を1バイト超える分までに出力を抑える
+			data = self._decompressor.decompress(chunk, self.max_size - self.size + 1)
+		else:
+			data = self._decompressor.decompress(chunk)
+		self.size += len(data)
+		if self.max_size is not None and self.size > self.max_size:
+			raise DecompressedSizeError("展開後のサイズが上限を超えました。")
+		return data
+
+	def finish(self) -> None:
+		"""圧縮データが最後まで揃っているかを確認（途中で終わっていればValueError）"""
+		if not self._decompressor.eof:
+			raise ValueError("圧縮データが途中で終わっています。")
+
+
+def decompress(data: bytes, encoding: str, max_size: int | None = None) -> bytes:
+	"""dataをencodingで展開"""
+	decompressor = Decompressor(encoding, max_size)
+	result = decompressor.decompress(data)
+	decompressor.finish()
+	return result
+
+
+def choose_encoding(accept_encoding: str | None) -> str | None:
+	"""Accept-Encodingから応答に使う圧縮方式を選択（対応するものがなければNone）"""
+	if not accept_encoding:
+		return None
+	weights = header_weights(accept_encoding)
+	wildcard = weights.get("*", 0.0)
+	candidates = [
+		(weights.get(encoding, wildcard), -rank, encoding)
+		for rank, encoding in enumerate(SUPPORTED_ENCODINGS)
+	]
+	quality, _, encoding = max(candidates)
+	return encoding if quality > 0 else None
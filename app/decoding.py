@@ -4,31 +4,142 @@ import re
 
 import structlog
 
+from app.cache import LRUCache
+
 
 logger = structlog.getLogger(__name__)
 
 
-class EnhancedTextDecoder:
-	"""マスキングされたテキストを元に戻すデコーダークラス"""
+class CompiledMapping:
+	"""
+	entity_mappingの全マスクトークンを1つの正規表現にまとめたデコーダー
 
-	def decode_text(
-		self, masked_text: str, entity_mapping: dict[str, dict[str, str]]
-	) -> str:
-		"""マスキングされたテキストを元のテキストに復元します"""
+	選択肢を長い順に並べることで、同じ位置では最長のトークンが優先されます。
+	"""
+
+	__slots__ = ("pattern", "replacements", "_prefixes", "_max_prefix")
+
+	def __init__(self, entity_mapping: dict[str, dict[str, str]]):
 		# マスキングトークンの長さで降順ソートして、誤置換を防ぎます
 		sorted_entities = sorted(
 			entity_mapping.values(), key=lambda x: len(x["masked_text"]), reverse=True
 		)
+		self.replacements: dict[str, str] = {}
+		for entity in sorted_entities:
+			if entity["masked_text"]:
+				self.replacements.setdefault(
+					entity["masked_text"], entity["original_text"]
+				)
+		self.pattern = (
+			re.compile("|".join(map(re.escape, self.replacements)))
+			if self.replacements
+			else None
+		)
+		self._prefixes: frozenset[str] | None = None
+		self._max_prefix = 0
 
-		decoded_text = masked_text
+	def prefixes(self) -> frozenset[str]:
+		"""
+		トークンの真の接頭辞の集合（ストリーミングで保留が必要な末尾の判定用）
 
-		for entity in sorted_entities:
-			masked = entity["masked_text"]
-			original = entity["original_text"]
-			# マスキングトークンが変形する可能性に備えて、正規表現を使用
-			pattern = re.escape(masked)
-			decoded_text = re.sub(pattern, original, decoded_text)
+		他のトークンの接頭辞になっているトークン自体も含まれます。
+		"""
+		if self._prefixes is None:
+			self._prefixes = frozenset(
+				token[:i] for token in self.replacements for i in range(1, len(token))
+			)
+			self._max_prefix = max(map(len, self._prefixes), default=0)
+		return self._prefixes
+
+	def holdback(self, text: str) -> int:
+		"""textの末尾のうち、後続のチャンクでトークンになり得る最長の長さ"""
+		prefixes = self.prefixes()
+		for length in range(min(self._max_prefix, len(text)), 0, -1):
+			if text[-length:] in prefixes:
+				return length
+		return 0
+
+	def streaming(self) -> "StreamingDecoder":
+		"""このマッピングを使うストリーミングデコーダーを作成"""
+		return StreamingDecoder(self)
+
+	def decode(self, masked_text: str) -> str:
+		"""1回の走査でトークンを元のテキストに置換"""
+		if self.pattern is None:
+			return masked_text
+		replacements = self.replacements
+		return self.pattern.sub(lambda m: replacements[m.group()], masked_text)
+
+
+class StreamingDecoder:
+	"""
+	チャンク単位で受け取ったテキストを逐次デコードするデコーダー
 
-			logger.debug(f"デコード適用: {masked} -> {original}")
+	チャンクの境界で分割されたトークンに備え、トークンの先頭になり得る
+	末尾だけを保留し、それ以外は確定した時点で返します。最後にflushを
+	呼び出して保留分を出力してください。
+	"""
 
+	def __init__(self, compiled: CompiledMapping):
+		self.compiled = compiled
+		self._buffer = ""
+
+	def feed(self, chunk: str) -> str:
+		"""チャンクを追加し、確定したデコード済みテキストを返す"""
+		buffer = self._buffer + chunk
+		compiled = self.compiled
+		if compiled.pattern is None:
+			self._buffer = ""
+			return buffer
+
+		# 保留位置より前に始まるマッチは、より長いトークンに伸びることがないので確定
+		cut = len(buffer) - compiled.holdback(buffer)
+		parts = []
+		pos = 0
+		for match in compiled.pattern.finditer(buffer):
+			if match.start() >= cut:
+				break
+			parts.append(buffer[pos : match.start()])
+			parts.append(compiled.replacements[match.group()])
+			pos = match.end()
+		end = max(cut, pos)
+		parts.append(buffer[pos:end])
+		self._buffer = buffer[end:]
+		return "".join(parts)
+
+	def flush(self) -> str:
+		"""保留中のテキストをデコードして返す"""
+		buffer, self._buffer = self._buffer, ""
+		return self.compiled.decode(buffer)
+
+
+def _mapping_key(entity_mapping: dict[str, dict[str, str]]) -> tuple:
+	return tuple(
+		(entity["masked_text"], entity["original_text"])
+		for entity in entity_mapping.values()
+	)
+
+
+class EnhancedTextDecoder:
+	"""マスキングされたテキストを元に戻すデコーダークラス"""
+
+	def __init__(self, cache_size: int = 256):
+		# 同じマッピングで繰り返しデコードする場合のためにコンパイル結果を保持
+		self.compiled_cache = LRUCache(cache_size)
+
+	def compile(self, entity_mapping: dict[str, dict[str, str]]) -> CompiledMapping:
+		"""マッピングをコンパイル（同じ内容のマッピングはキャッシュを再利用）"""
+		key = _mapping_key(entity_mapping)
+		compiled = self.compiled_cache.get(key)
+		if compiled is None:
+			compiled = CompiledMapping(entity_mapping)
+			self.compiled_cache.put(key, compiled)
+		return compiled
+
+	def decode_text(
+		self, masked_text: str, entity_mapping: dict[str, dict[str, str]]
+	) -> str:
+		"""マスキングされたテキストを元のテキストに復元します"""
+		decoded_text = self.compile(entity_mapping).decode(masked_text)
+		logger.debug("デコード適用", tokens=len(entity_mapping))
 		return decoded_text
@@ -1,35 +1,111 @@
 # app/logger_config.py
 
+import atexit
 import json
 import logging
+import os
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 import structlog
 
 
+class _StructlogQueueHandler(QueueHandler):
+	"""
+	structlogのevent_dictを保ったままキューに積むハンドラー
+
+	標準のQueueHandlerは積む前にメッセージを文字列化しますが、ここでは
+	整形（JSON化）を書き込みスレッドのProcessorFormatterに任せます。
+	"""
+
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		return record
+
+
+def sample_events(rate: float):
+	"""
+	DEBUG・INFOのイベントをrateの割合だけ残すプロセッサー
+
+	WARNING以上は常に残します。
+	"""
+
+	def processor(logger, method_name, event_dict):
+		if method_name in ("debug", "info") and random.random() >= rate:
+			raise structlog.DropEvent
+		return event_dict
+
+	return processor
+
+
+def truncate_fields(max_chars: int):
+	"""max_charsより長い文字列の値を切り詰めるプロセッサー（eventは対象外）"""
+
+	def processor(logger, method_name, event_dict):
+		for key, value in event_dict.items():
+			if key != "event" and isinstance(value, str) and len(value) > max_chars:
+				event_dict[key] = (
+					f"{value[:max_chars]}...(+{len(value) - max_chars}文字)"
+				)
+		return event_dict
+
+	return processor
+
+
+_listener: QueueListener | None = None
+
+
 def configure_logging():
 	"""
 	ロギング設定を構成します。
 	コンソールには読みやすい形式で、ファイルにはJSON形式でログを出力します。
+
+	ファイルへの書き込みはキュー経由でバックグラウンドスレッドが行うため、
+	リクエストを処理するスレッドはディスクI/Oやローテーションを待ちません。
+	以下の環境変数で調整できます。
+
+	- MASKING_LOG_LEVEL: ログレベル（既定はINFO）
+	- MASKING_LOG_SAMPLE_RATE: DEBUG・INFOのイベントを残す割合（既定は1）
+	- MASKING_LOG_MAX_FIELD_CHARS: 値の最大文字数（既定は500、0で無制限）
+	- MASKING_LOG_FILE: ログファイルのパス（既定はlog/app.log）
+	- MASKING_LOG_MAX_BYTES: ログファイル1つの最大サイズ（既定は50MB）
 	"""
+	global _listener
+
 	# ログレベルの設定（デフォルトはINFO）
-	LOG_LEVEL = logging.INFO
+	LOG_LEVEL = logging.getLevelName(
+		os.environ.get("MASKING_LOG_LEVEL", "INFO").upper()
+	)
+	SAMPLE_RATE = float(os.environ.get("MASKING_LOG_SAMPLE_RATE", "1"))
+	MAX_FIELD_CHARS = int(os.environ.get("MASKING_LOG_MAX_FIELD_CHARS", "500"))
 
 	# ログファイルの設定
-	LOG_FILE = "log/app.log"
+	LOG_FILE = os.environ.get("MASKING_LOG_FILE", "log/app.log")
+	LOG_MAX_BYTES = int(os.environ.get("MASKING_LOG_MAX_BYTES", str(50 * 2**20)))
 	LOG_ROTATION = 5  # ログファイルのバックアップ数
 
-	# 既存のハンドラーをクリア
+	# 既存のハンドラーと書き込みスレッドをクリア
+	flush_logging()
 	root_logger = logging.getLogger()
 	for handler in root_logger.handlers[:]:
 		root_logger.removeHandler(handler)
-	root_logger.setLevel(logging.NOTSET)
+	# ルートロガーにレベルを設定し、無効なレベルのイベントは
+	# filter_by_levelの時点で破棄する（is_enabled_forもこの設定に従う）
+	root_logger.setLevel(LOG_LEVEL)
+
+	processors = [
+		structlog.stdlib.filter_by_level,  # ログレベルでフィルタリング
+	]
+	if SAMPLE_RATE < 1:
+		processors.append(sample_events(SAMPLE_RATE))
+	if MAX_FIELD_CHARS > 0:
+		processors.append(truncate_fields(MAX_FIELD_CHARS))
 
 	# structlogの設定
 	structlog.configure(
 		processors=[
-			structlog.stdlib.filter_by_level,  # ログレベルでフィルタリング
+			*processors,
 			structlog.stdlib.add_logger_name,  # ロガー名を追加
 			structlog.stdlib.add_log_level,  # ログレベルを追加
 			structlog.processors.TimeStamper(
@@ -59,7 +135,7 @@ def configure_logging():
 	# ファイルハンドラーの設定（JSON形式、ensure_ascii=False）
 	formatter_file = structlog.stdlib.ProcessorFormatter(
 		processor=lambda logger, name, event_dict: json.dumps(
-			event_dict, ensure_ascii=False
+			event_dict, ensure_ascii=False, default=str
 		),
 		foreign_pre_chain=[
 			structlog.processors.TimeStamper(fmt="iso"),
@@ -67,15 +143,31 @@ def configure_logging():
 	)
 
 	file_handler = RotatingFileHandler(
-		LOG_FILE, maxBytes=10**6, backupCount=LOG_ROTATION, encoding="utf-8"
+		LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_ROTATION, encoding="utf-8"
 	)
 	file_handler.setLevel(LOG_LEVEL)
 	file_handler.setFormatter(formatter_file)
 
+	# ファイルへの書き込みはバックグラウンドスレッドで行う
+	log_queue: queue.SimpleQueue = queue.SimpleQueue()
+	_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+	_listener.start()
+
 	# ルートロガーにハンドラーを追加
 	root_logger.addHandler(console_handler)
-	root_logger.addHandler(file_handler)
+	root_logger.addHandler(_StructlogQueueHandler(log_queue))
+
+
+def flush_logging():
+	"""キューに残っているログを書き出して書き込みスレッドを停止"""
+	global _listener
+	if _listener is not None:
+		_listener.stop()
+		for handler in _listener.handlers:
+			handler.close()
+		_listener = None
 
 
 # ロギング設定を実行
 configure_logging()
+atexit.register(flush_logging)
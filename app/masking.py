@@ -1,38 +1,96 @@
 # app/masking.py
 
+import difflib
+import hashlib
+import hmac
 import json
+import logging
 import os
 import re
+import threading
+import unicodedata
 import uuid
-from collections import defaultdict
 
-import spacy
 import structlog
 
+from app.cache import LRUCache
 from app.models import Entity
+from app.postprocessing import merge_adjacent_entities, remove_overlapping_entities
 from app.rules_loader import RuleBasedMasker
+from app.sentence_cache import SentenceEntityCache
+from app.sentences import split_sentences
+from app.singleflight import SingleFlight
+from app.timing import StageTimer
+from app.tracing import current_span, span
 
 
 # ロガーの取得
 logger = structlog.get_logger(__name__)
 
+# GiNZAが検出したエンティティ範囲 (テキスト, ラベル, 開始位置, 終了位置)
+NerSpan = tuple[str, str, int, int]
+
+# 鍵付きトークンIDの桁数（リクエストをまたいで共有されるため衝突しにくい長さにする）
+KEYED_TOKEN_LENGTH = 16
+
 
 class EnhancedTextMasker:
-	"""ルールベースと機械学習を組み合わせたマスキング処理クラス"""
+	"""
+	ルールベースと機械学習を組み合わせたマスキング処理クラス
+
+	spaCy/GiNZA（およびtorch）はenable_ner=Trueの場合にのみ初期化時に
+	インポートされます。enable_ner=Falseではルールベースの検出のみを行い、
+	NERスタックを一切読み込みません。
+	"""
 
-	def __init__(self, rules_file: str | None = None):
-		"""初期化"""
+	def __init__(
+		self,
+		rules_file: str | None = None,
+		regex_engine: str = "re",
+		match_timeout: float | None = None,
+		enable_ner: bool = True,
+		ner_cache_size: int = 1024,
+		sentence_cache_path: str | None = None,
+		sentence_cache_max_bytes: int = 64 * 2**20,
+		token_secret: str | bytes | None = None,
+	):
+		"""
+		初期化
+
+		token_secretを指定すると、マスクトークンを(カテゴリ, 正規化テキスト)の
+		HMACから決定的に生成します。同じ秘密鍵を持つワーカー間では、
+		同じエンティティが常に同じトークンになります。
+		"""
 		rules_file = rules_file or "masking_rules.json"  # デフォルトのルールファイル名
-		self.rule_masker = RuleBasedMasker(rules_file)
+		self.rule_masker = RuleBasedMasker(
+			rules_file, regex_engine=regex_engine, match_timeout=match_timeout
+		)
 
-		try:
-			# GiNZAモデルをロード
-			self.nlp = spacy.load("ja_ginza_bert_large")
-			# カスタムエンティティをロード
-			self._load_custom_entities()
-		except Exception as e:
-			logger.error("Spacyモデルのロードに失敗しました", error=str(e))
-			raise
+		if isinstance(token_secret, str):
+			token_secret = token_secret.encode("utf-8")
+		self.token_secret = token_secret or None
+
+		self.enable_ner = enable_ner
+		self.nlp = None
+		# spaCyのパイプラインはスレッドセーフではないため推論を直列化する
+		self._nlp_lock = threading.Lock()
+		self.model_version = "none"
+		if enable_ner:
+			self._load_nlp()
+
+		# NER結果のキャッシュ（ランダムなトークンではなく検出範囲のみを保持）
+		self.ner_cache = LRUCache(ner_cache_size)
+		# 同じテキストの同時リクエストは推論を1回にまとめる
+		self.ner_flight = SingleFlight()
+
+		# 文単位の永続キャッシュ（任意、複数ワーカーで共有）
+		self.sentence_cache = None
+		if sentence_cache_path and self.nlp is not None:
+			self.sentence_cache = SentenceEntityCache(
+				sentence_cache_path,
+				fingerprint=f"{self.model_version}:{self.rule_masker.rules_version}",
+				max_bytes=sentence_cache_max_bytes,
+			)
 
 		# GiNZAのカテゴリマッピング
 		self.ginza_category_map = {
@@ -80,6 +138,23 @@ class EnhancedTextMasker:
 			"マスキング除外単語をロードしました", masks_to_ignore=self.masks_to_ignore
 		)
 
+	def _load_nlp(self):
+		"""GiNZAモデルをロード（spaCyはここで初めてインポートする）"""
+		try:
+			import spacy
+
+			# GiNZAモデルをロード
+			# custom_entitiesはRuleBasedMaskerで照合するため、
+			# entity_rulerには登録しない（二重照合を避ける）
+			self.nlp = spacy.load("ja_ginza_bert_large")
+			meta = self.nlp.meta
+			self.model_version = (
+				f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}"
+			)
+		except Exception as e:
+			logger.error("Spacyモデルのロードに失敗しました", error=str(e))
+			raise
+
 	def _load_masks_to_ignore(self) -> set:
 		"""マスキング除外単語をロード"""
 		try:
@@ -98,20 +173,6 @@ class EnhancedTextMasker:
 		"""マスキング除外単語かどうかを判定"""
 		return text in self.masks_to_ignore
 
-	def _load_custom_entities(self):
-		"""カスタムエンティティをロード"""
-		ruler = self.nlp.add_pipe("entity_ruler", before="ner")
-		patterns = []
-
-		# ルールファイルからカスタムエンティティをロード
-		custom_entities = self.rule_masker.rules.get("custom_entities", {})
-		for label, terms in custom_entities.items():
-			for term in terms:
-				patterns.append({"label": label, "pattern": term})
-
-		ruler.add_patterns(patterns)
-		logger.debug("カスタムエンティティパターンをロードしました", patterns=patterns)
-
 	def _load_mask_formats(self) -> dict[str, dict[str, str]]:
 		"""マスキングフォーマットをロード"""
 		try:
@@ -196,227 +257,269 @@ class EnhancedTextMasker:
 		self, entities: list[Entity], text: str
 	) -> list[Entity]:
 		"""隣接するエンティティを結合"""
-		if not entities:
-			return []
-
-		# カテゴリごとにグループ化
-		category_groups = defaultdict(list)
-		for entity in sorted(entities, key=lambda x: x.start):
-			category_groups[entity.category].append(entity)
-
-		merged = []
-		for category, group in category_groups.items():
-			i = 0
-			while i < len(group):
-				current = group[i]
-				start_pos = current.start
-				end_pos = current.end
-				current_priority = current.priority
-				current_source = current.source
-
-				# 隣接エンティティとの結合チェック
-				while i + 1 < len(group):
-					next_entity = group[i + 1]
-					between_text = text[end_pos : next_entity.start]
-
-					# 結合条件チェック
-					if len(between_text.strip()) <= 2 and re.match(
-						r"^[・\s]*$", between_text
-					):
-						end_pos = next_entity.end
-						# ルールベースの優先度を保持
-						if current_source == "rule" or next_entity.source == "rule":
-							current_priority = min(
-								current_priority, next_entity.priority
-							)
-							current_source = "rule"
-						i += 1
-					else:
-						break
-
-				# 新しいエンティティを作成
-				merged_entity = Entity(
-					text=text[start_pos:end_pos],
-					category=category,
-					start=start_pos,
-					end=end_pos,
-					priority=current_priority,
-					source=current_source,
-				)
-				merged.append(merged_entity)
-				i += 1
-
-		return sorted(merged, key=lambda x: x.start)
+		return merge_adjacent_entities(entities, text)
 
 	def _remove_overlapping_entities(self, entities: list[Entity]) -> list[Entity]:
 		"""重複するエンティティを削除"""
-		if not entities:
-			return []
-
-		# 優先順位とカバー範囲でソート（ルールベースを優先）
-		sorted_entities = sorted(
-			entities,
-			key=lambda x: (x.source != "rule", x.priority, -len(x.text), x.start),
-		)
-
-		result = []
-		covered_ranges = set()
-
-		for entity in sorted_entities:
-			entity_range = set(range(entity.start, entity.end))
-			overlap = entity_range & covered_ranges
-			if not overlap:  # 重複なし
-				result.append(entity)
-				covered_ranges.update(entity_range)
-			else:
-				# 既存のエンティティとの優先順位比較
-				overlapping_entities = [
-					e for e in result if set(range(e.start, e.end)) & entity_range
-				]
-				# ルールベースのエンティティを優先
-				if entity.source == "rule" and all(
-					e.source != "rule" for e in overlapping_entities
-				):
-					# 既存エンティティを削除
-					for e in overlapping_entities:
-						covered_ranges.difference_update(range(e.start, e.end))
-						result.remove(e)
-					result.append(entity)
-					covered_ranges.update(entity_range)
-				elif entity.priority < min(e.priority for e in overlapping_entities):
-					# 優先順位が高い場合も同様に処理
-					for e in overlapping_entities:
-						covered_ranges.difference_update(range(e.start, e.end))
-						result.remove(e)
-					result.append(entity)
-					covered_ranges.update(entity_range)
-
-		return sorted(result, key=lambda x: x.start)
+		return remove_overlapping_entities(entities)
 
 	def generate_mask_token(self) -> str:
 		"""一意の8文字マスクトークンを生成する関数"""
 		unique_id = uuid.uuid4().hex[:8]  # 例: j23b1ksd
 		return unique_id
 
-	def mask_text(
-		self,
-		text: str,
-		categories: list[str] | None = None,
-		mask_style: str = "descriptive",
-		key_values_to_mask: dict[str, str] | None = None,
-		values_to_mask: list[str] | None = None,
-	) -> tuple[str, dict, list[dict]]:
-		"""テキストにマスキングを適用する"""
-		logger.debug(
-			"マスキング処理開始", mask_style=mask_style, mask_formats=self.mask_formats
-		)
-
-		# テキストの前処理
+	@staticmethod
+	def _normalize_token_text(text: str) -> str:
+		"""トークン導出用にテキストを正規化（全角半角の統一と前後の空白除去）"""
+		return unicodedata.normalize("NFKC", text).strip()
+
+	def _keyed_digest(self, category: str, text: str) -> str:
+		"""(カテゴリ, 正規化テキスト)の鍵付きHMAC（16進数）"""
+		message = f"{category}\0{self._normalize_token_text(text)}".encode()
+		return hmac.new(self.token_secret, message, hashlib.sha256).hexdigest()
+
+	def _value_uuid(self, value: str) -> str:
+		"""values_to_maskの値を置き換えるUUID（鍵付きモードでは決定的）"""
+		if self.token_secret is None:
+			return f"{uuid.uuid4()}"
+		return str(uuid.UUID(self._keyed_digest("CUSTOM", value)[:32]))
+
+	def _mask_token_id(
+		self, category: str, text: str, length: int = KEYED_TOKEN_LENGTH
+	) -> str:
+		"""エンティティに割り当てるトークンID（鍵付きの場合は既定で16文字）"""
+		if self.token_secret is None:
+			return self.generate_mask_token()
+		return self._keyed_digest(category, text)[:length]
+
+	def _assign_token_id(
+		self, category: str, text: str, assigned: dict[str, str]
+	) -> str:
+		"""
+		別のテキストと重ならないトークンIDを割り当てる
+
+		assignedは割り当て済みの{トークンID: テキスト}（鍵付きモードでは正規化後）。
+		衝突した場合、鍵付きモードではHMACから取り出す桁数を延ばし、
+		ランダムなIDでは生成し直します（16文字の鍵付きIDでは念のための処理です）。
+		"""
+		owner = self._token_owner(text)
+		length = KEYED_TOKEN_LENGTH
+		while True:
+			token_id = self._mask_token_id(category, text, length)
+			if assigned.setdefault(token_id, owner) == owner:
+				return token_id
+			logger.warning("トークンIDの衝突を検出したため再割り当てします")
+			length += 8
+
+	def _token_owner(self, text: str) -> str:
+		"""同じトークンIDを共有できるテキストの代表（鍵付きモードでは正規化後）"""
+		if self.token_secret is None:
+			return text
+		return self._normalize_token_text(text)
+
+	def _preprocess(self, text: str) -> str:
+		"""不要なテキストパターンを除去"""
 		processed_text = text
 		for pattern, replacement in self.remove_patterns:
 			processed_text = re.sub(pattern, replacement, processed_text)
 		logger.debug("テキストの前処理完了", processed_text=processed_text)
+		return processed_text
 
-		# エンティティ検出の開始
-		entities = []
-
-		# 1. ルールベースのエンティティ検出（優先度を最高に設定）
+	def _detect_rule_entities(self, processed_text: str) -> list[Entity]:
+		"""ルールベースのエンティティ検出（優先度を最高に設定）"""
 		rule_entities = self.rule_masker._find_matches(processed_text)
 		for entity in rule_entities:
 			entity.priority = -1  # 最優先にする
-		entities.extend(rule_entities)
+		if logger.is_enabled_for(logging.DEBUG):
+			logger.debug(
+				"ルールベース検出エンティティ",
+				rule_entities=[e.__dict__ for e in rule_entities],
+			)
+		return rule_entities
+
+	def _ner_cache_key(self, processed_text: str) -> str:
+		"""前処理済みテキストとモデル・ルールのバージョンからキャッシュキーを生成"""
+		return hashlib.sha256(
+			"\0".join(
+				(self.model_version, self.rule_masker.rules_version, processed_text)
+			).encode("utf-8")
+		).hexdigest()
+
+	def _run_ner(self, processed_text: str) -> tuple[NerSpan, ...]:
+		"""GiNZAでエンティティ範囲を検出"""
+		with span("ner.inference", text_length=len(processed_text)), self._nlp_lock:
+			doc = self.nlp(processed_text)
+		return tuple(
+			(ent.text, ent.label_, ent.start_char, ent.end_char) for ent in doc.ents
+		)
 
-		# ルールベースで検出された範囲を記録
-		rule_spans = set((e.start, e.end) for e in rule_entities)
+	def _run_ner_by_sentence(self, processed_text: str) -> tuple[NerSpan, ...]:
+		"""
+		文単位のキャッシュを使ってエンティティ範囲を検出
+
+		キャッシュにない文だけをモデルに渡し、文内の位置を文書内の位置に
+		ずらして結合します。
+		"""
+		sentence_spans = split_sentences(processed_text)
+		sentences = [processed_text[start:end] for start, end in sentence_spans]
+		results = self.sentence_cache.get_many([s for s in sentences if s.strip()])
+
+		missing = list(
+			dict.fromkeys(s for s in sentences if s.strip() and s not in results)
+		)
+		if missing:
+			with self._nlp_lock:
+				docs = list(self.nlp.pipe(missing))
+			computed = {
+				sentence: [
+					(ent.text, ent.label_, ent.start_char, ent.end_char)
+					for ent in doc.ents
+				]
+				for sentence, doc in zip(missing, docs, strict=True)
+			}
+			self.sentence_cache.put_many(computed)
+			results.update(computed)
 		logger.debug(
-			"ルールベース検出エンティティ",
-			rule_entities=[e.__dict__ for e in rule_entities],
+			"文キャッシュ参照",
+			sentences=len(sentences),
+			computed=len(missing),
 		)
 
-		# 2. GiNZAによるエンティティ検出
-		doc = self.nlp(processed_text)
+		return tuple(
+			(ent_text, label, offset + start, offset + end)
+			for (offset, _), sentence in zip(sentence_spans, sentences, strict=True)
+			for ent_text, label, start, end in results.get(sentence, ())
+		)
 
-		# カテゴリフィルタリングの設定
-		if categories:
-			expanded_categories = set()
-			for category in categories:
-				if category in self.ginza_category_map:
-					expanded_categories.update(self.ginza_category_map[category])
+	def _detect_ner_spans(self, processed_text: str) -> tuple[NerSpan, ...]:
+		"""GiNZAによるエンティティ検出（キャッシュ付き）"""
+		if self.nlp is None:
+			return ()
+
+		key = self._ner_cache_key(processed_text)
+		spans = self.ner_cache.get(key)
+		shared = False
+		if spans is None:
+			spans, shared = self.ner_flight.do(
+				key, lambda: self._compute_ner_spans(key, processed_text)
+			)
+			if shared:
+				logger.debug("実行中の同一リクエストの検出結果を共有しました")
+		elif (parent := current_span()) is not None:
+			parent.set_attribute("ner_cache_hit", True)
+		if shared and (parent := current_span()) is not None:
+			parent.set_attribute("ner_coalesced", True)
+		return spans
+
+	def _compute_ner_spans(self, key: str, processed_text: str) -> tuple[NerSpan, ...]:
+		"""キャッシュにないテキストの推論を実行して結果をキャッシュに格納"""
+		# 待機中に他のリクエストが格納している可能性がある
+		spans = self.ner_cache.get(key)
+		if spans is not None:
+			return spans
+		if self.sentence_cache is not None:
+			spans = self._run_ner_by_sentence(processed_text)
 		else:
-			expanded_categories = None
+			spans = self._run_ner(processed_text)
+		self.ner_cache.put(key, spans)
+		return spans
 
-		# GiNZAのエンティティ処理（ルールベースと重複しない部分のみ）
-		for ent in doc.ents:
-			if self.is_mask_to_ignore(ent.text):
-				logger.debug("マスキング除外対象のためスキップ", text=ent.text)
+	def _filter_ner_entities(
+		self,
+		ner_spans: tuple[NerSpan, ...],
+		rule_entities: list[Entity],
+		categories: list[str] | None,
+	) -> list[Entity]:
+		"""GiNZAのエンティティ処理（ルールベースと重複しない部分のみ）"""
+		# ルールベースで検出された範囲を記録
+		rule_spans = set((e.start, e.end) for e in rule_entities)
+
+		entities = []
+		for ent_text, label, start_char, end_char in ner_spans:
+			if self.is_mask_to_ignore(ent_text):
+				logger.debug("マスキング除外対象のためスキップ", text=ent_text)
 				continue  # マスキング除外対象のためスキップ
 
 			# ルールベースの検出範囲と重複チェック - より厳密な範囲チェック
 			if not any(
 				(
-					(start <= ent.start_char and ent.end_char <= end)  # 完全に含まれる
-					or (start <= ent.start_char < end)  # 先頭が重なる
-					or (start < ent.end_char <= end)
+					(start <= start_char and end_char <= end)  # 完全に含まれる
+					or (start <= start_char < end)  # 先頭が重なる
+					or (start < end_char <= end)
 				)  # 末尾が重なる
 				for start, end in rule_spans
 			):
 				# カテゴリの正規化とフィルタリング
-				norm_category = self._normalize_category(ent.label_)
+				norm_category = self._normalize_category(label)
 				if not categories or norm_category in categories:
 					priority = self.ginza_priority_map.get(norm_category, 99)
 					entities.append(
 						Entity(
-							text=ent.text,
+							text=ent_text,
 							category=norm_category,
-							start=ent.start_char,
-							end=ent.end_char,
+							start=start_char,
+							end=end_char,
 							priority=priority,
 							source="ginza",
 						)
 					)
-		logger.debug(
-			"GiNZA検出エンティティ",
-			ginza_entities=[e.__dict__ for e in entities if e.source == "ginza"],
-		)
+		if logger.is_enabled_for(logging.DEBUG):
+			logger.debug(
+				"GiNZA検出エンティティ", ginza_entities=[e.__dict__ for e in entities]
+			)
+		return entities
 
-		# 3. values_to_maskに指定された値をエンティティとして追加
-		if values_to_mask:
-			for value in values_to_mask:
-				for match in re.finditer(re.escape(value), processed_text):
-					entities.append(
-						Entity(
-							text=match.group(),
-							category="CUSTOM",
-							start=match.start(),
-							end=match.end(),
-							priority=-1,  # 最優先
-							source="custom",
-						)
+	def _find_value_entities(
+		self, processed_text: str, values_to_mask: list[str] | None
+	) -> list[Entity]:
+		"""values_to_maskに指定された値をエンティティとして検出"""
+		entities = []
+		for value in values_to_mask or []:
+			for match in re.finditer(re.escape(value), processed_text):
+				entities.append(
+					Entity(
+						text=match.group(),
+						category="CUSTOM",
+						start=match.start(),
+						end=match.end(),
+						priority=-1,  # 最優先
+						source="custom",
 					)
+				)
+		return entities
 
-		# 4. エンティティの後処理
-		merged_entities = self._merge_adjacent_entities(entities, processed_text)
-		final_entities = self._remove_overlapping_entities(merged_entities)
-		logger.debug(
-			"最終エンティティ", final_entities=[e.__dict__ for e in final_entities]
-		)
-
-		# 5. マスキングの適用
+	def _apply_masks(
+		self,
+		processed_text: str,
+		final_entities: list[Entity],
+		mask_style: str,
+		key_values_to_mask: dict[str, str] | None,
+		values_to_mask: list[str] | None,
+		token_table: dict[str, str] | None = None,
+	) -> tuple[str, dict, list[dict]]:
+		"""検出済みエンティティにマスクトークンを割り当ててテキストを置換"""
 		entity_mapping = {}
 		debug_info = []
 		offset = 0
 		masked_text = processed_text
 
 		# 同じテキストに対して同じUUIDを使用するためのマッピング
-		text_to_uuid = {}
+		# （token_tableを渡すと呼び出しをまたいで共有し、新しい割り当てを追記）
+		text_to_uuid = {} if token_table is None else token_table
+		assigned = {
+			token_id: self._token_owner(text) for text, token_id in text_to_uuid.items()
+		}
 
 		# 各エンティティに対してマスキングを実行
+		debug_enabled = logger.is_enabled_for(logging.DEBUG)
 		for _idx, entity in enumerate(final_entities, 1):
 			category = self._normalize_category(entity.category)
 
 			# 同じテキストには同じUUIDを使用
 			if entity.text not in text_to_uuid:
-				text_to_uuid[entity.text] = self.generate_mask_token()
+				text_to_uuid[entity.text] = self._assign_token_id(
+					category, entity.text, assigned
+				)
 
 			masked_uuid = text_to_uuid[entity.text]
 			mask_token = (
@@ -431,12 +534,14 @@ class EnhancedTextMasker:
 			offset += len(mask_token) - (end - start)
 
 			# entity_mappingにoriginal_textとmasked_textを保持
-			entity_mapping[mask_token] = {
-				"original_text": entity.text,
-				"masked_text": mask_token,
-				"category": category,
-				"source": entity.source,
-			}
+			# （鍵付きトークンで正規化後に同一となる場合は最初の原文を保持）
+			if self.token_secret is None or mask_token not in entity_mapping:
+				entity_mapping[mask_token] = {
+					"original_text": entity.text,
+					"masked_text": mask_token,
+					"category": category,
+					"source": entity.source,
+				}
 
 			debug_info.append(
 				{
@@ -448,14 +553,15 @@ class EnhancedTextMasker:
 				}
 			)
 
-			logger.debug(
-				"マスキング適用",
-				original=entity.text,
-				mask_token=mask_token,
-				category=category,
-			)
+			if debug_enabled:
+				logger.debug(
+					"マスキング適用",
+					original=entity.text,
+					mask_token=mask_token,
+					category=category,
+				)
 
-		# 6. キー・バリュー指定による置換
+		# キー・バリュー指定による置換
 		if key_values_to_mask:
 			for mask_token, entity in entity_mapping.items():
 				original_text = entity["original_text"]
@@ -469,12 +575,12 @@ class EnhancedTextMasker:
 						new_value=new_value,
 					)
 
-		# 7. 値のUUID置換
+		# 値のUUID置換
 		if values_to_mask:
 			for mask_token, entity in entity_mapping.items():
 				original_text = entity["original_text"]
 				if original_text in values_to_mask:
-					new_uuid = f"{uuid.uuid4()}"
+					new_uuid = self._value_uuid(original_text)
 					masked_text = masked_text.replace(mask_token, new_uuid)
 					entity["masked_text"] = new_uuid  # masked_textを更新
 					logger.debug(
@@ -484,3 +590,239 @@ class EnhancedTextMasker:
 					)
 
 		return masked_text, entity_mapping, debug_info
+
+	def mask_text(
+		self,
+		text: str,
+		categories: list[str] | None = None,
+		mask_style: str = "descriptive",
+		key_values_to_mask: dict[str, str] | None = None,
+		values_to_mask: list[str] | None = None,
+		token_table: dict[str, str] | None = None,
+		timer: StageTimer | None = None,
+	) -> tuple[str, dict, list[dict]]:
+		"""
+		テキストにマスキングを適用する
+
+		token_tableにはテキストからトークンIDへの対応表を渡せます。
+		表にあるテキストは同じトークンを再利用し、新しく割り当てたものは表に追加されます。
+		timerを渡すと処理段階ごとの所要時間を記録します。
+		"""
+		with span("mask_text", text_length=len(text)) as mask_span:
+			result = self._mask_text(
+				text,
+				categories,
+				mask_style,
+				key_values_to_mask,
+				values_to_mask,
+				token_table,
+				timer or StageTimer(),
+			)
+			if mask_span is not None:
+				mask_span.set_attribute("entities", len(result[2]))
+			return result
+
+	def _mask_text(
+		self,
+		text: str,
+		categories: list[str] | None,
+		mask_style: str,
+		key_values_to_mask: dict[str, str] | None,
+		values_to_mask: list[str] | None,
+		token_table: dict[str, str] | None,
+		timer: StageTimer,
+	) -> tuple[str, dict, list[dict]]:
+		logger.debug(
+			"マスキング処理開始", mask_style=mask_style, mask_formats=self.mask_formats
+		)
+
+		# テキストの前処理
+		with timer.stage("preprocess"):
+			processed_text = self._preprocess(text)
+
+		# 1-4. エンティティの検出と後処理
+		final_entities = self._detect_entities(
+			processed_text, categories, values_to_mask, timer
+		)
+
+		# 5. マスキングの適用（キー・バリュー置換、値のUUID置換を含む）
+		with timer.stage("assemble"):
+			return self._apply_masks(
+				processed_text,
+				final_entities,
+				mask_style,
+				key_values_to_mask,
+				values_to_mask,
+				token_table,
+			)
+
+	def _detect_entities(
+		self,
+		processed_text: str,
+		categories: list[str] | None,
+		values_to_mask: list[str] | None,
+		timer: StageTimer,
+	) -> list[Entity]:
+		"""前処理済みテキストからマスキング対象の最終エンティティを検出"""
+		# 1. ルールベースのエンティティ検出
+		with timer.stage("rules"):
+			rule_entities = self._detect_rule_entities(processed_text)
+
+		# 2. GiNZAによるエンティティ検出（ルールのみのモードではスキップ）
+		with timer.stage("ner"):
+			ner_spans = self._detect_ner_spans(processed_text)
+			ginza_entities = self._filter_ner_entities(
+				ner_spans, rule_entities, categories
+			)
+
+		# 3. values_to_maskに指定された値をエンティティとして追加
+		with timer.stage("rules"):
+			value_entities = self._find_value_entities(processed_text, values_to_mask)
+
+		# 4. エンティティの後処理
+		entities = rule_entities + ginza_entities + value_entities
+		timer.count("rule_entities", len(rule_entities))
+		timer.count("ner_entities", len(ginza_entities))
+		timer.count("candidates", len(entities))
+		with timer.stage("merge"):
+			merged_entities = self._merge_adjacent_entities(entities, processed_text)
+		with timer.stage("overlap"):
+			final_entities = self._remove_overlapping_entities(merged_entities)
+		if logger.is_enabled_for(logging.DEBUG):
+			logger.debug(
+				"最終エンティティ", final_entities=[e.__dict__ for e in final_entities]
+			)
+		return final_entities
+
+	def _token_table_from_mapping(
+		self, entity_mapping: dict[str, dict[str, str]], mask_style: str
+	) -> dict[str, str]:
+		"""マスクトークンの書式からトークンIDを取り出し、テキストとの対応表を作成"""
+		formats = self.mask_formats.get(mask_style, {})
+		table = {}
+		for mask_token, entry in entity_mapping.items():
+			fmt = formats.get(entry.get("category"), "UNKNOWN_{0}")
+			prefix, _, suffix = fmt.partition("{0}")
+			if (
+				len(mask_token) > len(prefix) + len(suffix)
+				and mask_token.startswith(prefix)
+				and mask_token.endswith(suffix)
+			):
+				token_id = mask_token[len(prefix) : len(mask_token) - len(suffix)]
+				table.setdefault(entry["original_text"], token_id)
+		return table
+
+	def remask_text(
+		self,
+		previous_text: str,
+		previous_entities: list[dict],
+		previous_mapping: dict[str, dict[str, str]],
+		text: str,
+		categories: list[str] | None = None,
+		mask_style: str = "descriptive",
+		key_values_to_mask: dict[str, str] | None = None,
+		values_to_mask: list[str] | None = None,
+		token_table: dict[str, str] | None = None,
+		timer: StageTimer | None = None,
+	) -> tuple[str, dict, list[dict]]:
+		"""
+		前回のマスキング結果を再利用して編集後のテキストをマスキングする
+
+		前回のテキストと文単位で差分を取り、変更のない文は前回の検出結果
+		（previous_entitiesはmask_textのdebug_info）をそのまま使い、変更された
+		文だけを再検出します。トークンはprevious_mappingから引き継ぎます。
+		オプションは前回と同じものを指定してください。
+
+		文をまたぐ文脈はNERに渡らないため、全体をmask_textし直した結果とは
+		異なる場合があります。
+		"""
+		timer = timer or StageTimer()
+		with timer.stage("preprocess"):
+			old_processed = self._preprocess(previous_text)
+			processed_text = self._preprocess(text)
+			old_spans = split_sentences(old_processed)
+			new_spans = split_sentences(processed_text)
+
+		table = {} if token_table is None else token_table
+		for entity_text, token_id in self._token_table_from_mapping(
+			previous_mapping, mask_style
+		).items():
+			table.setdefault(entity_text, token_id)
+			table.setdefault(entity_text.lstrip(), token_id)
+
+		# ルールの一致範囲は直前の空白や改行を含み、前の文にまたがることがあるため、
+		# 再利用するエンティティは先頭の空白を除いた範囲で扱う
+		previous = []
+		for e in previous_entities:
+			start = e["position"]["start"]
+			stripped = len(e["original"]) - len(e["original"].lstrip())
+			previous.append(
+				Entity(
+					text=e["original"][stripped:],
+					category=e["category"],
+					start=start + stripped,
+					end=e["position"]["end"],
+					source=e["source"],
+				)
+			)
+		if any(old_processed[e.start : e.end] != e.text for e in previous):
+			logger.warning("前回の検出結果がテキストと一致しないため全体を再処理します")
+			return self.mask_text(
+				text,
+				categories,
+				mask_style,
+				key_values_to_mask,
+				values_to_mask,
+				token_table=table,
+				timer=timer,
+			)
+
+		matcher = difflib.SequenceMatcher(
+			None,
+			[old_processed[start:end] for start, end in old_spans],
+			[processed_text[start:end] for start, end in new_spans],
+			autojunk=False,
+		)
+		entities = []
+		reused = recomputed = 0
+		for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+			if tag == "equal":
+				# 変更のない文の範囲にある前回のエンティティを位置だけずらして再利用
+				old_start, old_end = old_spans[i1][0], old_spans[i2 - 1][1]
+				shift = new_spans[j1][0] - old_start
+				for e in previous:
+					if old_start <= e.start and e.end <= old_end:
+						entities.append(
+							Entity(
+								text=e.text,
+								category=e.category,
+								start=e.start + shift,
+								end=e.end + shift,
+								source=e.source,
+							)
+						)
+				reused += i2 - i1
+			elif j2 > j1:
+				# 連続する変更文はまとめて再検出
+				start, end = new_spans[j1][0], new_spans[j2 - 1][1]
+				for e in self._detect_entities(
+					processed_text[start:end], categories, values_to_mask, timer
+				):
+					e.start += start
+					e.end += start
+					entities.append(e)
+				recomputed += j2 - j1
+		entities.sort(key=lambda e: e.start)
+		logger.debug(
+			"差分マスキング", reused_sentences=reused, recomputed_sentences=recomputed
+		)
+
+		with timer.stage("assemble"):
+			return self._apply_masks(
+				processed_text,
+				entities,
+				mask_style,
+				key_values_to_mask,
+				values_to_mask,
+				table,
+			)
@@ -0,0 +1,220 @@
+# app/metrics.py
+
+import bisect
+import math
+import threading
+from collections.abc import Callable
+
+
+# Prometheusのデフォルトと同じレイテンシのバケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+	if not names:
+		return ""
+	pairs = ",".join(
+		'{}="{}"'.format(
+			name,
+			str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+		)
+		for name, value in zip(names, values, strict=True)
+	)
+	return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+	if value == math.inf:
+		return "+Inf"
+	if float(value).is_integer():
+		return str(int(value))
+	return repr(float(value))
+
+
+class _Metric:
+	type_name = ""
+
+	def __init__(self, name: str, documentation: str, labelnames=()):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self._lock = threading.Lock()
+
+	def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+		return tuple(str(labels[name]) for name in self.labelnames)
+
+	def render(self) -> list[str]:
+		lines = [
+			f"# HELP {self.name} {self.documentation}",
+			f"# TYPE {self.name} {self.type_name}",
+		]
+		lines.extend(self._samples())
+		return lines
+
+	def _samples(self) -> list[str]:
+		raise NotImplementedError
+
+
+class Counter(_Metric):
+	"""単調増加するカウンタ"""
+
+	type_name = "counter"
+
+	def __init__(self, name: str, documentation: str, labelnames=()):
+		super().__init__(name, documentation, labelnames)
+		self._values: dict[tuple[str, ...], float] = {}
+
+	def inc(self, amount: float = 1, **labels) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def value(self, **labels) -> float:
+		return self._values.get(self._key(labels), 0)
+
+	def _samples(self) -> list[str]:
+		with self._lock:
+			items = sorted(self._values.items())
+		return [
+			f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+			for key, v in items
+		]
+
+
+class Gauge(_Metric):
+	"""増減する値"""
+
+	type_name = "gauge"
+
+	def __init__(self, name: str, documentation: str, labelnames=()):
+		super().__init__(name, documentation, labelnames)
+		self._values: dict[tuple[str, ...], float] = {}
+
+	def inc(self, amount: float = 1, **labels) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def dec(self, amount: float = 1, **labels) -> None:
+		self.inc(-amount, **labels)
+
+	def set(self, value: float, **labels) -> None:
+		with self._lock:
+			self._values[self._key(labels)] = value
+
+	def value(self, **labels) -> float:
+		return self._values.get(self._key(labels), 0)
+
+	def _samples(self) -> list[str]:
+		with self._lock:
+			items = sorted(self._values.items())
+		return [
+			f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+			for key, v in items
+		]
+
+
+class Histogram(_Metric):
+	"""バケットごとの累積件数と合計を記録するヒストグラム"""
+
+	type_name = "histogram"
+
+	def __init__(
+		self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+	):
+		super().__init__(name, documentation, labelnames)
+		self.buckets = tuple(sorted(buckets))
+		# ラベルごとに [各バケットの件数..., +Infの件数], 合計
+		self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+	def observe(self, value: float, **labels) -> None:
+		key = self._key(labels)
+		index = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			counts, total = self._values.setdefault(
+				key, ([0] * (len(self.buckets) + 1), [0.0])
+			)
+			counts[index] += 1
+			total[0] += value
+
+	def count(self, **labels) -> int:
+		item = self._values.get(self._key(labels))
+		return sum(item[0]) if item else 0
+
+	def _samples(self) -> list[str]:
+		lines = []
+		with self._lock:
+			items = sorted(
+				(key, (list(counts), total[0]))
+				for key, (counts, total) in self._values.items()
+			)
+		names = self.labelnames + ("le",)
+		for key, (counts, total) in items:
+			cumulative = 0
+			for bound, count in zip(self.buckets + (math.inf,), counts, strict=True):
+				cumulative += count
+				labels = _format_labels(names, key + (_format_value(bound),))
+				lines.append(f"{self.name}_bucket{labels} {cumulative}")
+			labels = _format_labels(self.labelnames, key)
+			lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+			lines.append(f"{self.name}_count{labels} {cumulative}")
+		return lines
+
+
+class CallbackGauge(_Metric):
+	"""収集時に関数を呼び出して値を取得するゲージ（他モジュールの統計値の公開用）"""
+
+	type_name = "gauge"
+
+	def __init__(
+		self,
+		name: str,
+		documentation: str,
+		callback: Callable[[], float],
+		type_name: str = "gauge",
+	):
+		super().__init__(name, documentation)
+		self.callback = callback
+		self.type_name = type_name
+
+	def _samples(self) -> list[str]:
+		return [f"{self.name} {_format_value(self.callback())}"]
+
+
+class Registry:
+	"""メトリクスをまとめてPrometheusのテキスト形式で出力"""
+
+	def __init__(self):
+		self._metrics: dict[str, _Metric] = {}
+
+	def register(self, metric: _Metric) -> _Metric:
+		if metric.name in self._metrics:
+			raise ValueError(f"メトリクス名が重複しています: {metric.name}")
+		self._metrics[metric.name] = metric
+		return metric
+
+	def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+		return self.register(Counter(name, documentation, labelnames))
+
+	def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+		return self.register(Gauge(name, documentation, labelnames))
+
+	def histogram(
+		self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+	) -> Histogram:
+		return self.register(Histogram(name, documentation, labelnames, buckets))
+
+	def callback(
+		self,
+		name: str,
+		documentation: str,
+		callback: Callable[[], float],
+		type_name: str = "gauge",
+	) -> CallbackGauge:
+		return self.register(CallbackGauge(name, documentation, callback, type_name))
+
+	def render(self) -> str:
+		lines = []
+		for metric in self._metrics.values():
+			lines.extend(metric.render())
+		return "\n".join(lines) + "\n"
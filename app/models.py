@@ -1,8 +1,11 @@
 # app/models.py
 
 from dataclasses import dataclass
+from typing import Literal
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
+
+from app.serialization import columns_to_debug_info, columns_to_mapping
 
 
 class EnhancedMaskingRequest(BaseModel):
@@ -21,6 +24,27 @@ class EnhancedMaskingRequest(BaseModel):
 	values_to_mask: list[str] | None = Field(
 		None, description="UUIDでマスキングする値のリスト"
 	)
+	store_mapping: bool = Field(
+		False, description="マッピングをサーバー側に保存してハンドルを返すかどうか"
+	)
+	mapping_ttl: int | None = Field(
+		None, gt=0, description="保存したマッピングの有効期間（秒）"
+	)
+	session_id: str | None = Field(
+		None,
+		description="トークン表を共有するセッションID（指定時は新しいマッピングのみ返す）",
+	)
+	include_timing: bool = Field(
+		False,
+		description="処理段階ごとの所要時間をレスポンスとServer-Timingヘッダーに含める",
+	)
+	response_format: Literal["full", "compact"] = Field(
+		"full",
+		description='"compact"ではエンティティを列形式で返し、debug_infoを省略する',
+	)
+	include_debug_info: bool = Field(
+		False, description="compact形式でもdebug_infoを含めるかどうか"
+	)
 
 
 class Position(BaseModel):
@@ -46,21 +70,156 @@ class DebugInfo(BaseModel):
 	detected_entities: list[DetectedEntity]
 
 
+class TimingInfo(BaseModel):
+	"""処理時間の内訳のモデル（ミリ秒）"""
+
+	stages_ms: dict[str, float]
+	queue_ms: float
+	total_ms: float
+
+
 class MaskingResponse(BaseModel):
 	"""マスキングレスポンスのモデル"""
 
 	masked_text: str
 	entity_mapping: dict[str, dict[str, str]]
 	debug_info: DebugInfo
+	mapping_handle: str | None = None
+	timing: TimingInfo | None = None
+
 
+class RemaskRequest(EnhancedMaskingRequest):
+	"""前回の結果を再利用する再マスキングリクエストのモデル"""
+
+	previous_text: str = Field(
+		..., max_length=5000, description="前回マスキングしたテキスト"
+	)
+	previous_result: MaskingResponse = Field(
+		...,
+		description=(
+			"前回のマスキングレスポンス（compact形式の場合はinclude_debug_infoで"
+			"debug_infoを含めたもの）"
+		),
+	)
 
-class DecodeRequest(BaseModel):
+	@model_validator(mode="before")
+	@classmethod
+	def _expand_compact_result(cls, data):
+		"""compact形式のprevious_resultをfull形式に展開"""
+		previous = data.get("previous_result") if isinstance(data, dict) else None
+		if not isinstance(previous, dict) or "entities" not in previous:
+			return data
+		if "debug_info" not in previous:
+			raise ValueError(
+				"compact形式のprevious_resultにはdebug_infoが必要です"
+				"（include_debug_info=trueでマスキングしてください）。"
+			)
+		try:
+			expanded = {
+				**previous,
+				"entity_mapping": columns_to_mapping(previous["entities"]),
+				"debug_info": {
+					"detected_entities": columns_to_debug_info(previous["debug_info"])
+				},
+			}
+		except (KeyError, IndexError, TypeError, ValueError) as e:
+			raise ValueError("compact形式のprevious_resultが不正です。") from e
+		return {**data, "previous_result": expanded}
+
+
+class MappingSource(BaseModel):
+	"""デコードに使うマッピングの指定（直接指定・ハンドル・セッションのいずれか）"""
+
+	entity_mapping: dict[str, dict[str, str]] | None = Field(
+		None, description="マスキングトークンと元のテキストのマッピング"
+	)
+	mapping_handle: str | None = Field(
+		None, description="サーバー側に保存したマッピングのハンドル"
+	)
+	session_id: str | None = Field(
+		None, description="累積マッピングを使用するセッションID"
+	)
+
+	@model_validator(mode="after")
+	def _require_mapping_source(self):
+		if (
+			self.entity_mapping is None
+			and self.mapping_handle is None
+			and self.session_id is None
+		):
+			raise ValueError(
+				"entity_mapping、mapping_handle、session_idのいずれかを"
+				"指定してください。"
+			)
+		return self
+
+
+class DecodeRequest(MappingSource):
 	"""デコードリクエストのモデル"""
 
 	masked_text: str = Field(..., description="マスキングされたテキスト")
-	entity_mapping: dict[str, dict[str, str]] = Field(
-		..., description="マスキングトークンと元のテキストのマッピング"
+
+
+class BatchDecodeItem(BaseModel):
+	"""一括デコードの各項目のモデル"""
+
+	masked_text: str = Field(..., description="マスキングされたテキスト")
+	entity_mapping: dict[str, dict[str, str]] | None = Field(
+		None, description="この項目のみに使うマッピング（省略時は共通のマッピング）"
+	)
+
+
+class BatchDecodeRequest(BaseModel):
+	"""一括デコードリクエストのモデル"""
+
+	items: list[BatchDecodeItem] = Field(..., description="デコードする項目のリスト")
+	entity_mapping: dict[str, dict[str, str]] | None = Field(
+		None, description="全項目で共通のマッピング"
+	)
+	mapping_handle: str | None = Field(
+		None, description="全項目で共通に使う保存済みマッピングのハンドル"
 	)
+	session_id: str | None = Field(None, description="全項目で共通に使うセッションID")
+
+	@model_validator(mode="after")
+	def _require_mapping_per_item(self):
+		if (
+			self.entity_mapping is None
+			and self.mapping_handle is None
+			and self.session_id is None
+			and any(item.entity_mapping is None for item in self.items)
+		):
+			raise ValueError(
+				"共通のマッピングを指定しない場合は全項目にentity_mappingが必要です。"
+			)
+		return self
+
+	def shared_source(self) -> MappingSource | None:
+		"""共通のマッピングの指定（なければNone）"""
+		if (
+			self.entity_mapping is None
+			and self.mapping_handle is None
+			and self.session_id is None
+		):
+			return None
+		return MappingSource(
+			entity_mapping=self.entity_mapping,
+			mapping_handle=self.mapping_handle,
+			session_id=self.session_id,
+		)
+
+
+class BatchDecodeResponse(BaseModel):
+	"""一括デコードレスポンスのモデル"""
+
+	decoded_texts: list[str]
+
+
+class SessionResponse(BaseModel):
+	"""セッション作成レスポンスのモデル"""
+
+	session_id: str
+	ttl: float
 
 
 class DecodeResponse(BaseModel):
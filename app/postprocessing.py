@@ -0,0 +1,105 @@
+# app/postprocessing.py
+
+import re
+from collections import defaultdict
+
+from app.models import Entity
+
+
+def merge_adjacent_entities(entities: list[Entity], text: str) -> list[Entity]:
+	"""隣接するエンティティを結合"""
+	if not entities:
+		return []
+
+	# カテゴリごとにグループ化
+	category_groups = defaultdict(list)
+	for entity in sorted(entities, key=lambda x: x.start):
+		category_groups[entity.category].append(entity)
+
+	merged = []
+	for category, group in category_groups.items():
+		i = 0
+		while i < len(group):
+			current = group[i]
+			start_pos = current.start
+			end_pos = current.end
+			current_priority = current.priority
+			current_source = current.source
+
+			# 隣接エンティティとの結合チェック
+			while i + 1 < len(group):
+				next_entity = group[i + 1]
+				between_text = text[end_pos : next_entity.start]
+
+				# 結合条件チェック
+				if len(between_text.strip()) <= 2 and re.match(
+					r"^[・\s]*$", between_text
+				):
+					end_pos = next_entity.end
+					# ルールベースの優先度を保持
+					if current_source == "rule" or next_entity.source == "rule":
+						current_priority = min(current_priority, next_entity.priority)
+						current_source = "rule"
+					i += 1
+				else:
+					break
+
+			# 新しいエンティティを作成
+			merged_entity = Entity(
+				text=text[start_pos:end_pos],
+				category=category,
+				start=start_pos,
+				end=end_pos,
+				priority=current_priority,
+				source=current_source,
+			)
+			merged.append(merged_entity)
+			i += 1
+
+	return sorted(merged, key=lambda x: x.start)
+
+
+def remove_overlapping_entities(entities: list[Entity]) -> list[Entity]:
+	"""重複するエンティティを削除"""
+	if not entities:
+		return []
+
+	# 優先順位とカバー範囲でソート（ルールベースを優先）
+	sorted_entities = sorted(
+		entities,
+		key=lambda x: (x.source != "rule", x.priority, -len(x.text), x.start),
+	)
+
+	result = []
+	covered_ranges = set()
+
+	for entity in sorted_entities:
+		entity_range = set(range(entity.start, entity.end))
+		overlap = entity_range & covered_ranges
+		if not overlap:  # 重複なし
+			result.append(entity)
+			covered_ranges.update(entity_range)
+		else:
+			# 既存のエンティティとの優先順位比較
+			overlapping_entities = [
+				e for e in result if set(range(e.start, e.end)) & entity_range
+			]
+			# ルールベースのエンティティを優先
+			if entity.source == "rule" and all(
+				e.source != "rule" for e in overlapping_entities
+			):
+				# 既存エンティティを削除
+				for e in overlapping_entities:
+					covered_ranges.difference_update(range(e.start, e.end))
+					result.remove(e)
+				result.append(entity)
+				covered_ranges.update(entity_range)
+			elif entity.priority < min(e.priority for e in overlapping_entities):
+				# 優先順位が高い場合も同様に処理
+				for e in overlapping_entities:
+					covered_ranges.difference_update(range(e.start, e.end))
+					result.remove(e)
+				result.append(entity)
+				covered_ranges.update(entity_range)
+
+	return sorted(result, key=lambda x: x.start)
@@ -0,0 +1,130 @@
+# app/prefilter.py
+
+import re
+
+from app.regex_safety import sre_constants, sre_parse
+
+
+_CATEGORY_CLASSES = {
+	sre_constants.CATEGORY_DIGIT: r"\d",
+	sre_constants.CATEGORY_NOT_DIGIT: r"\D",
+	sre_constants.CATEGORY_SPACE: r"\s",
+	sre_constants.CATEGORY_NOT_SPACE: r"\S",
+	sre_constants.CATEGORY_WORD: r"\w",
+	sre_constants.CATEGORY_NOT_WORD: r"\W",
+}
+
+
+class Prefilter:
+	"""
+	パターンがマッチするために必須の文字列または文字クラス
+
+	本体の正規表現を実行する前に安価な検査で「マッチし得ない」テキストを
+	除外するために使用します。may_matchがFalseを返す場合、元のパターンは
+	必ずマッチしません。
+	"""
+
+	__slots__ = ("source", "flags", "_literal", "_regex")
+
+	def __init__(self, source: str, flags: int, literal: str | None = None):
+		self.source = source
+		self.flags = flags
+		# 大文字小文字を区別せずに済むリテラルは部分文字列検索で判定
+		self._literal = literal
+		self._regex = None if literal is not None else re.compile(source, flags)
+
+	def may_match(self, text: str) -> bool:
+		if self._literal is not None:
+			return self._literal in text
+		return self._regex.search(text) is not None
+
+	def __repr__(self) -> str:
+		return f"Prefilter({self.source!r})"
+
+
+def _is_caseless(text: str) -> bool:
+	"""大文字小文字の区別がない文字のみで構成されているか"""
+	return all(c.lower() == c and c.upper() == c for c in text)
+
+
+def _class_source(items) -> str | None:
+	"""パース済みの文字クラスを正規表現の文字クラスに戻す"""
+	parts = []
+	for op, av in items:
+		if op == sre_constants.NEGATE:
+			parts.append("^")
+		elif op == sre_constants.LITERAL:
+			parts.append(re.escape(chr(av)))
+		elif op == sre_constants.RANGE:
+			parts.append(f"{re.escape(chr(av[0]))}-{re.escape(chr(av[1]))}")
+		elif op == sre_constants.CATEGORY and av in _CATEGORY_CLASSES:
+			parts.append(_CATEGORY_CLASSES[av])
+		else:
+			return None
+	return f"[{''.join(parts)}]"
+
+
+def _collect(items, flags: int, runs: list, classes: list) -> None:
+	"""必ず通過する要素からリテラル列と文字クラスを収集"""
+	run: list[str] = []
+
+	def flush():
+		if run:
+			runs.append(("".join(run), flags))
+			run.clear()
+
+	for op, av in items:
+		if op == sre_constants.LITERAL:
+			run.append(chr(av))
+			continue
+		flush()
+		if op == sre_constants.SUBPATTERN:
+			add_flags, del_flags = av[1], av[2]
+			_collect(av[-1], (flags | add_flags) & ~del_flags, runs, classes)
+		elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+			if av[0] >= 1:
+				_collect(av[2], flags, runs, classes)
+		elif op == sre_constants.IN:
+			source = _class_source(av)
+			if source is not None:
+				classes.append((source, flags))
+	flush()
+
+
+def derive_prefilter(pattern: str, flags: int = 0) -> Prefilter | None:
+	"""
+	正規表現から必須の部分文字列（なければ必須の文字クラス）を導出します。
+
+	導出できない場合（選択肢のみで構成される場合など）はNoneを返します。
+	"""
+	parsed = sre_parse.parse(pattern, flags)
+	base_flags = parsed.state.flags & (re.IGNORECASE | re.UNICODE | re.ASCII)
+	runs: list[tuple[str, int]] = []
+	classes: list[tuple[str, int]] = []
+	_collect(list(parsed), base_flags, runs, classes)
+
+	if runs:
+		literal, run_flags = max(runs, key=lambda r: len(r[0]))
+		if not run_flags & re.IGNORECASE or _is_caseless(literal):
+			return Prefilter(re.escape(literal), run_flags, literal=literal)
+		return Prefilter(re.escape(literal), run_flags)
+	if classes:
+		source, class_flags = classes[0]
+		return Prefilter(source, class_flags)
+	return None
+
+
+def combine_prefilters(prefilters: list[Prefilter | None]) -> Prefilter | None:
+	"""
+	パターン群のいずれかがマッチし得るかを1回の走査で判定する
+	プレフィルタを作成します。1つでも導出できないパターンがあればNoneを返します。
+	"""
+	if not prefilters or any(p is None for p in prefilters):
+		return None
+	if len(prefilters) == 1:
+		return prefilters[0]
+	sources = {
+		f"(?i:{p.source})" if p.flags & re.IGNORECASE else f"(?-i:{p.source})"
+		for p in prefilters
+	}
+	return Prefilter("|".join(sorted(sources, key=len, reverse=True)), 0)
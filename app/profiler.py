@@ -0,0 +1,147 @@
+# app/profiler.py
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import structlog
+
+
+logger = structlog.get_logger(__name__)
+
+
+def _frame_label(code) -> str:
+	"""関数名とファイル位置（site-packages以下またはカレントディレクトリからの相対）"""
+	filename = code.co_filename
+	_, sep, rest = filename.rpartition("site-packages" + os.sep)
+	if sep:
+		filename = rest
+	elif filename.startswith(os.getcwd() + os.sep):
+		filename = os.path.relpath(filename)
+	return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+	"""
+	全スレッドのスタックを一定間隔で採取するサンプリングプロファイラー
+
+	結果はflamegraph.plやspeedscopeで読み込める折り畳みスタック形式
+	（「フレーム;フレーム;... 件数」）で出力します。C拡張（正規表現エンジンや
+	spaCyのCython部分）の時間は、それを呼び出したPythonの関数に計上されます。
+
+	採取スレッドは他スレッドがGILを手放した時点でしか動けないため、GILを
+	解放する処理に偏ることがあります。switch_intervalを指定すると採取中だけ
+	sys.setswitchintervalで切り替え間隔を短くして偏りを抑えますが、
+	プロセス全体の処理が遅くなります。
+	"""
+
+	def __init__(self, interval: float = 0.01, switch_interval: float | None = None):
+		self.interval = interval
+		self.switch_interval = switch_interval
+		self._saved_switch_interval: float | None = None
+		self.stacks: Counter[str] = Counter()
+		self.samples = 0
+		self._stop = threading.Event()
+		self._thread: threading.Thread | None = None
+
+	def _sample(self) -> None:
+		own = threading.get_ident()
+		names = {t.ident: t.name for t in threading.enumerate()}
+		for thread_id, frame in sys._current_frames().items():
+			if thread_id == own:
+				continue
+			labels = []
+			while frame is not None:
+				labels.append(_frame_label(frame.f_code))
+				frame = frame.f_back
+			labels.append(f"thread:{names.get(thread_id, thread_id)}")
+			self.stacks[";".join(reversed(labels))] += 1
+		self.samples += 1
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			self._sample()
+
+	def start(self) -> None:
+		if self.switch_interval is not None:
+			self._saved_switch_interval = sys.getswitchinterval()
+			sys.setswitchinterval(
+				min(self._saved_switch_interval, self.switch_interval)
+			)
+		self._thread = threading.Thread(
+			target=self._run, name="sampling-profiler", daemon=True
+		)
+		self._thread.start()
+
+	def stop(self) -> None:
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+		if self._saved_switch_interval is not None:
+			sys.setswitchinterval(self._saved_switch_interval)
+			self._saved_switch_interval = None
+
+	def write_collapsed(self, path: str) -> None:
+		"""折り畳みスタック形式でファイルに書き出す"""
+		with open(path, "w", encoding="utf-8") as f:
+			for stack, count in self.stacks.most_common():
+				f.write(f"{stack} {count}\n")
+
+
+_active_lock = threading.Lock()
+
+
+def profile_for(seconds: float, path: str, interval: float = 0.01) -> dict:
+	"""
+	seconds秒間プロファイルを採取してpathに書き出す（ブロッキング）
+
+	同時に実行できるプロファイルは1つだけで、実行中の場合はRuntimeErrorを送出します。
+	"""
+	if not _active_lock.acquire(blocking=False):
+		raise RuntimeError("プロファイルは既に実行中です。")
+	try:
+		profiler = SamplingProfiler(interval)
+		logger.info("プロファイルを開始します", seconds=seconds, path=path)
+		profiler.start()
+		try:
+			time.sleep(seconds)
+		finally:
+			profiler.stop()
+		profiler.write_collapsed(path)
+		logger.info("プロファイルを書き出しました", path=path, samples=profiler.samples)
+		return {
+			"path": path,
+			"samples": profiler.samples,
+			"stacks": len(profiler.stacks),
+		}
+	finally:
+		_active_lock.release()
+
+
+def install_signal_handler(directory: str, seconds: float, signum=None) -> None:
+	"""
+	シグナル（既定はSIGUSR1）を受けるとバックグラウンドでプロファイルを採取する
+
+	出力先はdirectory/profile-<pid>-<時刻>.txtです。
+	"""
+	import signal
+
+	signum = signum or signal.SIGUSR1
+
+	def handler(_signum, _frame):
+		path = os.path.join(
+			directory, f"profile-{os.getpid()}-{time.strftime('%Y%m%d_%H%M%S')}.txt"
+		)
+
+		def run():
+			try:
+				profile_for(seconds, path)
+			except RuntimeError as e:
+				logger.warning("プロファイルを開始できません", error=str(e))
+
+		threading.Thread(target=run, name="profile-signal", daemon=True).start()
+
+	signal.signal(signum, handler)
+	logger.info("プロファイル用のシグナルハンドラーを登録しました", signal=signum)
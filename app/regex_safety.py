@@ -0,0 +1,183 @@
+# app/regex_safety.py
+
+from dataclasses import dataclass
+
+
+try:
+	# Python 3.11以降
+	from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python 3.10
+	import sre_constants
+	import sre_parse
+
+
+_REPEAT_OPS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, "POSSESSIVE_REPEAT"):
+	_REPEAT_OPS.add(sre_constants.POSSESSIVE_REPEAT)
+
+# 任意の1文字にマッチし得ることを表す番兵
+_ANY_CHAR = object()
+
+
+@dataclass
+class PatternRisk:
+	"""正規表現のバックトラッキングリスクを保持するデータクラス"""
+
+	pattern: str
+	severity: str  # "exponential" または "polynomial"
+	reason: str
+
+
+def _is_unbounded(op, av) -> bool:
+	"""上限のない繰り返しかどうかを判定"""
+	return op in _REPEAT_OPS and av[1] == sre_constants.MAXREPEAT
+
+
+def _first_chars(items) -> set:
+	"""サブパターンの先頭に現れ得る文字の集合を概算"""
+	for op, av in items:
+		if op == sre_constants.LITERAL:
+			return {av}
+		if op == sre_constants.IN:
+			chars = set()
+			for in_op, in_av in av:
+				if in_op == sre_constants.LITERAL:
+					chars.add(in_av)
+				elif in_op == sre_constants.RANGE and in_av[1] - in_av[0] < 256:
+					chars.update(range(in_av[0], in_av[1] + 1))
+				else:
+					return {_ANY_CHAR}
+			return chars
+		if op == sre_constants.SUBPATTERN:
+			return _first_chars(av[-1])
+		if op == sre_constants.BRANCH:
+			return set().union(*(_first_chars(branch) for branch in av[1]))
+		if op in _REPEAT_OPS:
+			chars = _first_chars(av[2])
+			if av[0] == 0:
+				# 0回の繰り返しでは後続も先頭になり得るため保守的に扱う
+				chars = chars | {_ANY_CHAR}
+			return chars
+		if op == sre_constants.AT:
+			continue
+		return {_ANY_CHAR}
+	return set()
+
+
+def _overlaps(a: set, b: set) -> bool:
+	"""先頭文字集合が重なるかどうか"""
+	return _ANY_CHAR in a or _ANY_CHAR in b or bool(a & b)
+
+
+def _contains_unbounded(items) -> bool:
+	"""サブパターン内に上限のない繰り返しが含まれるか"""
+	for op, av in items:
+		if _is_unbounded(op, av):
+			return True
+		if op in _REPEAT_OPS and _contains_unbounded(av[2]):
+			return True
+		if op == sre_constants.SUBPATTERN and _contains_unbounded(av[-1]):
+			return True
+		if op == sre_constants.BRANCH and any(
+			_contains_unbounded(branch) for branch in av[1]
+		):
+			return True
+	return False
+
+
+def _unwrap(items):
+	"""キャプチャ・非キャプチャグループを展開した要素列を返す"""
+	for op, av in items:
+		if op == sre_constants.SUBPATTERN:
+			yield from _unwrap(av[-1])
+		else:
+			yield op, av
+
+
+def _walk(items, pattern: str, risks: list[PatternRisk]) -> None:
+	"""パース済みパターンを走査してリスクを収集"""
+	previous_unbounded = None
+	for op, av in items:
+		if op in _REPEAT_OPS:
+			body = av[2]
+			if _is_unbounded(op, av):
+				if _contains_unbounded(body):
+					risks.append(
+						PatternRisk(pattern, "exponential", "入れ子になった量指定子")
+					)
+				for sub_op, sub_av in _unwrap(body):
+					if sub_op == sre_constants.BRANCH:
+						firsts = [_first_chars(branch) for branch in sub_av[1]]
+						if any(
+							_overlaps(firsts[i], firsts[j])
+							for i in range(len(firsts))
+							for j in range(i + 1, len(firsts))
+						):
+							risks.append(
+								PatternRisk(
+									pattern,
+									"exponential",
+									"繰り返し内の選択肢が同じ文字で始まる",
+								)
+							)
+				if previous_unbounded is not None and _overlaps(
+					previous_unbounded, _first_chars(body)
+				):
+					risks.append(
+						PatternRisk(
+							pattern,
+							"polynomial",
+							"隣接する量指定子が同じ文字を消費する",
+						)
+					)
+				previous_unbounded = _first_chars(body)
+			else:
+				previous_unbounded = None
+			_walk(body, pattern, risks)
+		elif op == sre_constants.SUBPATTERN:
+			_walk(av[-1], pattern, risks)
+			previous_unbounded = None
+		elif op == sre_constants.BRANCH:
+			for branch in av[1]:
+				_walk(branch, pattern, risks)
+			previous_unbounded = None
+		elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+			_walk(av[1], pattern, risks)
+		else:
+			previous_unbounded = None
+
+
+def analyze_pattern(pattern: str, flags: int = 0) -> list[PatternRisk]:
+	"""
+	正規表現のバックトラッキングリスクを静的に解析します。
+
+	入れ子の量指定子や、繰り返し内で先頭文字が重なる選択肢は指数時間、
+	先頭が広い文字クラスの繰り返しで始まるパターンは検索時に二乗時間となるため、
+	それぞれ "exponential"、"polynomial" として報告します。
+	"""
+	parsed = sre_parse.parse(pattern, flags)
+	items = list(parsed)
+	risks: list[PatternRisk] = []
+	_walk(items, pattern, risks)
+
+	# 先頭が上限のない広い繰り返しの場合、各開始位置から末尾まで走査し得る
+	leading = [item for item in items if item[0] != sre_constants.AT]
+	anchored = (
+		bool(items)
+		and items[0][0] == sre_constants.AT
+		and items[0][1]
+		in (
+			sre_constants.AT_BEGINNING,
+			sre_constants.AT_BEGINNING_STRING,
+		)
+	)
+	if leading and not anchored:
+		op, av = leading[0]
+		if _is_unbounded(op, av) and len(leading) > 1:
+			if _ANY_CHAR in _first_chars(av[2]):
+				risks.append(
+					PatternRisk(
+						pattern, "polynomial", "先頭の広い文字クラスが繰り返されている"
+					)
+				)
+	return risks
@@ -1,24 +1,150 @@
 # app/rules_loader.py
 
+import hashlib
 import json
+import logging
 import os
 import re
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
 from re import Pattern
 
 import structlog
 
 from app.models import Entity
+from app.prefilter import Prefilter, combine_prefilters, derive_prefilter
+from app.regex_safety import analyze_pattern
+from app.tracing import span
 
 
 # ロガーの取得
 logger = structlog.get_logger(__name__)
 
+# 境界判定に使う文字集合（_compile_patternsの正規表現と同じ定義）
+_BOUNDARY_BEHIND = set("、。：:）」』】］｝).")
+_BOUNDARY_AHEAD = set("、。：:（「『【［｛(.")
+
+# バッチ走査でテキストを連結する区切り文字（境界条件では空白として扱われる）
+_BATCH_SEPARATOR = "\n"
+
+
+class UnsafePatternError(ValueError):
+	"""破滅的なバックトラッキングの恐れがあるパターンが含まれる場合の例外"""
+
+
+class RuleMatchTimeoutError(TimeoutError):
+	"""ルールマッチングが制限時間を超えた場合の例外"""
+
+
+class _BoundedMatch:
+	"""_Re2BoundedTermが返すre.Match互換のマッチ結果"""
+
+	def __init__(self, text: str, span_start: int, start: int, end: int):
+		self._text = text
+		self._span = (span_start, end)
+		self._group_span = (start, end)
+
+	def group(self, index: int = 0) -> str:
+		start, end = self._span if index == 0 else self._group_span
+		return self._text[start:end]
+
+	def span(self) -> tuple[int, int]:
+		return self._span
+
+	def start(self, index: int = 0) -> int:
+		return (self._span if index == 0 else self._group_span)[0]
+
+	def end(self, index: int = 0) -> int:
+		return (self._span if index == 0 else self._group_span)[1]
+
+
+class _Re2BoundedTerm:
+	"""
+	境界条件付きの語句パターンをRE2で実行するラッパー
+
+	RE2は先読み・後読みをサポートしないため、語句本体のみをRE2で検索し、
+	前後の境界条件はPythonで判定します。マッチ位置は_compile_patternsの
+	正規表現と同じ規則（先頭の空白を含む）で返します。
+	"""
+
+	def __init__(self, term: str, re2_module):
+		self.pattern = term
+		self._core = re2_module.compile("(?i)" + re2_module.escape(term))
+		# 自己重複する語句（例: "abab"）は候補が重なり得るため逐次検索する
+		folded = term.lower()
+		self._self_overlapping = any(
+			folded[:k] == folded[-k:] for k in range(1, len(folded))
+		)
+
+	def _bounded_span(self, text: str, start: int, end: int, floor: int):
+		"""境界条件を満たせばマッチ全体の開始位置を、満たさなければNoneを返す"""
+		if start - 1 >= floor and text[start - 1].isspace():
+			span_start = start - 1
+		elif start == 0 or text[start - 1] in _BOUNDARY_BEHIND:
+			span_start = start
+		else:
+			return None
+		if end < len(text) and not (
+			text[end].isspace() or text[end] in _BOUNDARY_AHEAD
+		):
+			return None
+		return span_start
+
+	def finditer(self, text: str):
+		if self._self_overlapping:
+			yield from self._finditer_overlapping(text)
+			return
+
+		# 候補同士が重ならないため、RE2のfinditerで1回だけ走査する
+		floor = 0
+		for match in self._core.finditer(text):
+			start, end = match.span()
+			span_start = self._bounded_span(text, start, end, floor)
+			if span_start is None:
+				floor = start + 1
+				continue
+			yield _BoundedMatch(text, span_start, start, end)
+			floor = end
+
+	def _finditer_overlapping(self, text: str):
+		pos = 0
+		while pos <= len(text):
+			match = self._core.search(text, pos)
+			if match is None:
+				return
+			start, end = match.span()
+			span_start = self._bounded_span(text, start, end, pos)
+			if span_start is None:
+				pos = start + 1
+				continue
+			yield _BoundedMatch(text, span_start, start, end)
+			pos = end if end > start else end + 1
+
 
 class RuleBasedMasker:
 	"""ルールベースのマスキング処理を行うクラス"""
 
-	def __init__(self, rules_file: str):
-		"""JSONファイルからルールを読み込む"""
+	def __init__(
+		self,
+		rules_file: str,
+		regex_engine: str = "re",
+		match_timeout: float | None = None,
+	):
+		"""
+		JSONファイルからルールを読み込む
+
+		Args:
+		rules_file: ルールファイルのパス
+		regex_engine: "re"（標準）または "re2"（線形時間、google-re2が必要）
+		match_timeout: 1テキストあたりのマッチング制限時間（秒）。Noneで無制限
+		"""
+		if regex_engine not in ("re", "re2"):
+			raise ValueError(f"未対応の正規表現エンジンです: {regex_engine}")
+		self.regex_engine = regex_engine
+		self.match_timeout = match_timeout
+
 		if not os.path.exists(rules_file):
 			logger.error("ルールファイルが見つかりません", rules_file=rules_file)
 			raise FileNotFoundError(f"ルールファイルが見つかりません: {rules_file}")
@@ -26,6 +152,11 @@ class RuleBasedMasker:
 		with open(rules_file, encoding="utf-8") as f:
 			self.rules = json.load(f)
 
+		# キャッシュの無効化に使うルールのバージョン（内容のハッシュ）
+		self.rules_version = hashlib.sha256(
+			json.dumps(self.rules, sort_keys=True, ensure_ascii=False).encode("utf-8")
+		).hexdigest()[:16]
+
 		# すべてのパターンを活用
 		self.category_patterns = {
 			"company": self.rules["rules"]["company_patterns"],
@@ -70,10 +201,74 @@ class RuleBasedMasker:
 
 		# パターンをコンパイル
 		self.compiled_patterns = self._compile_patterns()
-		logger.info("ルールベースマスカーを初期化しました")
+		self.safe_patterns = [
+			re.compile(pattern, re.UNICODE | re.IGNORECASE)
+			for pattern in self.rules["exclusions"]["safe_patterns"]
+		]
+		self._validate_patterns()
+
+		# カテゴリごとのプレフィルタ
+		self.pattern_prefilters, self.group_prefilters = self._build_prefilters()
+		# 複数スレッドから走査されるため、集計は走査ごとにまとめてロック下で加算
+		self.prefilter_stats: Counter[str] = Counter()
+		self._stats_lock = threading.Lock()
+		logger.info(
+			"ルールベースマスカーを初期化しました", regex_engine=self.regex_engine
+		)
+
+	def _load_re2(self):
+		"""RE2モジュールをロード"""
+		try:
+			import re2
+		except ImportError as e:
+			raise ImportError(
+				"regex_engine='re2' には google-re2 パッケージが必要です"
+			) from e
+		return re2
+
+	def _validate_patterns(self):
+		"""
+		ロード時にバックトラッキングリスクを検証
+
+		指数時間のリスクがあるパターンは "re" エンジンでは拒否し、
+		二乗時間のリスクは警告のみとします。"re2" エンジンでは
+		ルール本体は線形時間で実行されるため、除外パターンのみ検証します。
+		"""
+		patterns = [p.pattern for p in self.safe_patterns]
+		if self.regex_engine == "re":
+			patterns += [
+				p.pattern
+				for p_list in self.compiled_patterns.values()
+				for p in (
+					p_list
+					if isinstance(p_list, list)
+					else [item for sublist in p_list.values() for item in sublist]
+				)
+			]
+
+		for pattern in patterns:
+			for risk in analyze_pattern(pattern, re.UNICODE | re.IGNORECASE):
+				if risk.severity == "exponential":
+					logger.error(
+						"危険な正規表現パターンです",
+						pattern=pattern,
+						reason=risk.reason,
+					)
+					raise UnsafePatternError(
+						f"破滅的なバックトラッキングの恐れがあるパターンです: "
+						f"{pattern} ({risk.reason})"
+					)
+				logger.warning(
+					"低速になり得る正規表現パターンです",
+					pattern=pattern,
+					reason=risk.reason,
+				)
 
 	def _compile_patterns(self) -> dict[str, list[Pattern]]:
 		"""正規表現パターンをコンパイル"""
+		if self.regex_engine == "re2":
+			return self._compile_patterns_re2()
+
 		compiled = {}
 		for category, patterns in self.category_patterns.items():
 			if isinstance(patterns, list):
@@ -95,21 +290,101 @@ class RuleBasedMasker:
 					k: [re.compile(re.escape(p), re.UNICODE | re.IGNORECASE) for p in v]
 					for k, v in patterns.items()
 				}
-		# コンパイルされたパターンをログに記録
-		compiled_patterns_str = [
-			p.pattern
-			for p_list in compiled.values()
-			for p in (
-				p_list
-				if isinstance(p_list, list)
-				else [item for sublist in p_list.values() for item in sublist]
+		# コンパイルされたパターンをログに記録（DEBUG無効時は一覧を作らない）
+		if logger.is_enabled_for(logging.DEBUG):
+			compiled_patterns_str = [
+				p.pattern
+				for p_list in compiled.values()
+				for p in (
+					p_list
+					if isinstance(p_list, list)
+					else [item for sublist in p_list.values() for item in sublist]
+				)
+			]
+			logger.debug(
+				"コンパイルされたパターン", compiled_patterns=compiled_patterns_str
 			)
-		]
-		logger.debug(
-			"コンパイルされたパターン", compiled_patterns=compiled_patterns_str
-		)
 		return compiled
 
+	def _compile_patterns_re2(self) -> dict[str, list]:
+		"""RE2でパターンをコンパイル（境界条件はPython側で判定）"""
+		re2 = self._load_re2()
+		compiled = {}
+		for category, patterns in self.category_patterns.items():
+			if isinstance(patterns, list):
+				compiled[category] = [_Re2BoundedTerm(p, re2) for p in patterns]
+			elif isinstance(patterns, dict):
+				compiled[category] = {
+					k: [re2.compile("(?i)" + re2.escape(p)) for p in v]
+					for k, v in patterns.items()
+				}
+		return compiled
+
+	def _build_prefilters(self) -> tuple[dict, dict[str, Prefilter | None]]:
+		"""
+		各パターンの必須文字列からプレフィルタを導出
+
+		ルールの語句はエスケープしてコンパイルされるため、語句自体が
+		必須の部分文字列になります。パターン単位のプレフィルタは
+		compiled_patternsと同じ構造で、カテゴリ単位のプレフィルタは
+		それらを1つの正規表現にまとめたものです。
+		"""
+
+		def derive(term: str) -> Prefilter | None:
+			return derive_prefilter(re.escape(term), re.UNICODE | re.IGNORECASE)
+
+		pattern_prefilters = {}
+		group_prefilters = {}
+		for category, patterns in self.category_patterns.items():
+			if isinstance(patterns, list):
+				pattern_prefilters[category] = [derive(p) for p in patterns]
+				flat = pattern_prefilters[category]
+			elif isinstance(patterns, dict):
+				pattern_prefilters[category] = {
+					k: [derive(p) for p in v] for k, v in patterns.items()
+				}
+				flat = [
+					f
+					for sublist in pattern_prefilters[category].values()
+					for f in sublist
+				]
+			else:
+				continue
+			group_prefilters[category] = combine_prefilters(flat)
+		if logger.is_enabled_for(logging.DEBUG):
+			logger.debug(
+				"プレフィルタを導出しました",
+				group_prefilters={k: repr(v) for k, v in group_prefilters.items()},
+			)
+		return pattern_prefilters, group_prefilters
+
+	@staticmethod
+	def _may_match(prefilter: Prefilter | None, text: str, stats: Counter) -> bool:
+		"""プレフィルタを評価し、スキップしたスキャン数をstatsに記録"""
+		if prefilter is None or prefilter.may_match(text):
+			stats["scans_run"] += 1
+			return True
+		stats["scans_skipped"] += 1
+		return False
+
+	def prefilter_counts(self) -> dict[str, int]:
+		"""プレフィルタの集計のコピー"""
+		with self._stats_lock:
+			return dict(self.prefilter_stats)
+
+	def _check_deadline(self, deadline: float | None, category: str):
+		"""制限時間を超えていれば例外を送出"""
+		if deadline is not None and time.perf_counter() > deadline:
+			logger.warning(
+				"ルールマッチングが制限時間を超えました",
+				category=category,
+				match_timeout=self.match_timeout,
+			)
+			raise RuleMatchTimeoutError(
+				f"ルールマッチングが制限時間({self.match_timeout}秒)を超えました: "
+				f"category={category}"
+			)
+
 	def _is_excluded(self, text: str) -> bool:
 		"""除外パターンに該当するかチェック"""
 		exclusions = self.rules["exclusions"]
@@ -120,86 +395,186 @@ class RuleBasedMasker:
 			return True
 
 		# 安全なパターンチェック
-		for pattern in exclusions["safe_patterns"]:
-			if re.search(pattern, text, re.UNICODE | re.IGNORECASE):
-				logger.debug("除外対象の安全パターンに一致", text=text, pattern=pattern)
+		for pattern in self.safe_patterns:
+			if pattern.search(text):
+				logger.debug(
+					"除外対象の安全パターンに一致", text=text, pattern=pattern.pattern
+				)
 				return True
 
 		return False
 
+	def _deadline(self, text_count: int = 1) -> float | None:
+		"""マッチングの期限を計算（制限時間はテキスト数に比例）"""
+		if self.match_timeout is None:
+			return None
+		return time.perf_counter() + self.match_timeout * max(1, text_count)
+
+	def _iter_scans(self, text: str, deadline: float | None):
+		"""
+		プレフィルタを通過したパターンを列挙
+
+		Yields:
+		(カテゴリ, コンパイル済みパターン, 一致部分のグループ番号)
+		"""
+		stats: Counter[str] = Counter()
+		try:
+			yield from self._scan_patterns(text, deadline, stats)
+		finally:
+			with self._stats_lock:
+				self.prefilter_stats.update(stats)
+
+	def _scan_patterns(self, text: str, deadline: float | None, stats: Counter):
+		for category, patterns in self.compiled_patterns.items():
+			self._check_deadline(deadline, category)
+
+			# カテゴリ単位のプレフィルタでマッチし得ないグループをスキップ
+			group_prefilter = self.group_prefilters.get(category)
+			stats["groups_checked"] += 1
+			if group_prefilter is not None and not group_prefilter.may_match(text):
+				stats["groups_skipped"] += 1
+				stats["scans_skipped"] += (
+					len(patterns)
+					if isinstance(patterns, list)
+					else sum(len(v) for v in patterns.values())
+				)
+				continue
+
+			prefilters = self.pattern_prefilters[category]
+			if isinstance(patterns, list):
+				# group(1)を使用して実際のパターン一致部分のみを取得
+				for pattern, prefilter in zip(patterns, prefilters, strict=True):
+					self._check_deadline(deadline, category)
+					if self._may_match(prefilter, text, stats):
+						yield category, pattern, 1
+
+			elif isinstance(patterns, dict):
+				for sub_category, sub_patterns in patterns.items():
+					for pattern, prefilter in zip(
+						sub_patterns, prefilters[sub_category], strict=True
+					):
+						self._check_deadline(deadline, category)
+						if self._may_match(prefilter, text, stats):
+							yield category, pattern, 0
+
+	def _add_match(
+		self,
+		matches: list[Entity],
+		processed_spans: set[tuple[int, int]],
+		category: str,
+		matched_text: str,
+		start: int,
+		end: int,
+	):
+		"""重複・除外チェックを行い、マッチをエンティティとして追加"""
+		# 重複チェック
+		if any((s <= start < e or s < end <= e) for s, e in processed_spans):
+			return
+		if self._is_excluded(matched_text):
+			return
+
+		priority = self.priority_map.get(category, 99)
+		matches.append(
+			Entity(
+				text=matched_text,
+				category=self.category_map.get(category, category.upper()),
+				start=start,
+				end=end,
+				priority=priority,
+				source="rule",
+			)
+		)
+		processed_spans.add((start, end))
+		logger.debug(
+			"マッチ検出",
+			text=matched_text,
+			category=category,
+			start=start,
+			end=end,
+		)
+
 	def _find_matches(self, text: str) -> list[Entity]:
 		"""テキスト内のすべてのパターンマッチを検出"""
 		matches = []
 		processed_spans: set[tuple[int, int]] = set()
+		deadline = self._deadline()
 
-		# 各カテゴリのパターンでマッチング
-		for category, patterns in self.compiled_patterns.items():
-			if isinstance(patterns, list):
-				for pattern in patterns:
-					for match in pattern.finditer(text):
-						# group(1)を使用して実際のパターン一致部分のみを取得
-						matched_text = match.group(1)
-						# マッチング位置は全体マッチを基準に
-						start, end = match.span()
-						# 重複チェック
-						if not any(
-							(s <= start < e or s < end <= e) for s, e in processed_spans
-						):
-							if not self._is_excluded(matched_text):
-								priority = self.priority_map.get(category, 99)
-								matches.append(
-									Entity(
-										text=matched_text,
-										category=self.category_map.get(
-											category, category.upper()
-										),
-										start=start,
-										end=end,
-										priority=priority,
-										source="rule",
-									)
-								)
-								processed_spans.add((start, end))
-								logger.debug(
-									"マッチ検出",
-									text=match.group(),
-									category=category,
-									start=start,
-									end=end,
-								)
+		with span("rules.scan", text_length=len(text)) as scan_span:
+			# 各カテゴリのパターンでマッチング
+			for category, pattern, group in self._iter_scans(text, deadline):
+				for match in pattern.finditer(text):
+					self._check_deadline(deadline, category)
+					# マッチング位置は全体マッチを基準に
+					start, end = match.span()
+					self._add_match(
+						matches,
+						processed_spans,
+						category,
+						match.group(group),
+						start,
+						end,
+					)
+			if scan_span is not None:
+				scan_span.set_attribute("matches", len(matches))
 
-			elif isinstance(patterns, dict):
-				for _sub_category, sub_patterns in patterns.items():
-					for pattern in sub_patterns:
-						for match in pattern.finditer(text):
-							start, end = match.span()
-							# 重複チェック
-							if not any(
-								(s <= start < e or s < end <= e)
-								for s, e in processed_spans
-							):
-								if not self._is_excluded(match.group()):
-									priority = self.priority_map.get(category, 99)
-									matches.append(
-										Entity(
-											text=match.group(),
-											category=self.category_map.get(
-												category, category.upper()
-											),
-											start=start,
-											end=end,
-											priority=priority,
-											source="rule",
-										)
-									)
-									processed_spans.add((start, end))
-									logger.debug(
-										"マッチ検出",
-										text=match.group(),
-										category=category,
-										start=start,
-										end=end,
-									)
-
-		logger.debug("マッチ検出結果", matches=[e.__dict__ for e in matches])
+		if logger.is_enabled_for(logging.DEBUG):
+			logger.debug("マッチ検出結果", matches=[e.__dict__ for e in matches])
 		return sorted(matches, key=lambda x: x.start)
+
+	def find_matches_batch(self, texts: list[str]) -> list[list[Entity]]:
+		"""
+		複数テキストのパターンマッチをまとめて検出
+
+		テキストを区切り文字で連結したバッファを各パターンで1回だけ走査し、
+		マッチを各テキストの位置に振り分けます。結果は_find_matchesを
+		テキストごとに呼び出した場合と同じです。区切り文字をまたぐマッチが
+		あったテキストのみ、個別に再走査します。
+		"""
+		if not texts:
+			return []
+
+		separator = _BATCH_SEPARATOR
+		buffer = separator.join(texts)
+		starts = []
+		position = 0
+		for text in texts:
+			starts.append(position)
+			position += len(text) + len(separator)
+
+		results: list[list[Entity]] = [[] for _ in texts]
+		spans: list[set[tuple[int, int]]] = [set() for _ in texts]
+		fallback: set[int] = set()
+		deadline = self._deadline(len(texts))
+
+		for category, pattern, group in self._iter_scans(buffer, deadline):
+			for match in pattern.finditer(buffer):
+				self._check_deadline(deadline, category)
+				start, end = match.span()
+				index = bisect_right(starts, start) - 1
+				doc_start = starts[index]
+				doc_end = doc_start + len(texts[index])
+				if start == doc_end and index + 1 < len(texts):
+					# 区切り文字を先頭の空白として消費したマッチは、
+					# 単独走査では文頭(^)からのマッチになる
+					index += 1
+					doc_start = starts[index]
+					doc_end = doc_start + len(texts[index])
+					start = doc_start
+				if end > doc_end or match.start(group) < doc_start:
+					# 区切り文字をまたぐマッチは後で個別に再走査
+					last = bisect_right(starts, max(end - 1, start)) - 1
+					fallback.update(range(index, last + 1))
+					continue
+				self._add_match(
+					results[index],
+					spans[index],
+					category,
+					match.group(group),
+					start - doc_start,
+					end - doc_start,
+				)
+
+		for index in fallback:
+			results[index] = self._find_matches(texts[index])
+
+		return [sorted(matches, key=lambda x: x.start) for matches in results]
@@ -0,0 +1,196 @@
+# app/sentence_cache.py
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import structlog
+
+
+logger = structlog.get_logger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+	key TEXT PRIMARY KEY,
+	spans TEXT NOT NULL,
+	size INTEGER NOT NULL,
+	last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS meta (
+	name TEXT PRIMARY KEY,
+	value TEXT NOT NULL
+);
+INSERT OR IGNORE INTO meta (name, value) VALUES ('total_size', '0');
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+	UPDATE meta SET value = CAST(value AS INTEGER) + NEW.size
+	WHERE name = 'total_size';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+	UPDATE meta SET value = CAST(value AS INTEGER) + NEW.size - OLD.size
+	WHERE name = 'total_size';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+	UPDATE meta SET value = CAST(value AS INTEGER) - OLD.size
+	WHERE name = 'total_size';
+END;
+"""
+
+
+class SentenceEntityCache:
+	"""
+	文単位のエンティティ検出結果をSQLiteに保存する永続キャッシュ
+
+	同じファイルを複数のワーカープロセスから共有できます。キーは
+	fingerprint（モデルとルールのバージョン）と文のハッシュで、
+	fingerprintが変わった場合は開いた時点で全エントリを破棄します。
+	保存サイズがmax_bytesを超えると、最終アクセスが古い順に削除します。
+	"""
+
+	def __init__(self, path: str, fingerprint: str, max_bytes: int = 64 * 2**20):
+		self.path = path
+		self.fingerprint = fingerprint
+		self.max_bytes = max_bytes
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(
+			path, timeout=30, check_same_thread=False, isolation_level=None
+		)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("PRAGMA synchronous=NORMAL")
+		with self._lock:
+			self._conn.executescript(_SCHEMA)
+			self._invalidate_if_changed()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def _invalidate_if_changed(self):
+		"""モデルまたはルールが変わっていればキャッシュを破棄"""
+		self._conn.execute("BEGIN IMMEDIATE")
+		try:
+			row = self._conn.execute(
+				"SELECT value FROM meta WHERE name = 'fingerprint'"
+			).fetchone()
+			if row is None or row[0] != self.fingerprint:
+				self._conn.execute("DELETE FROM entries")
+				self._conn.execute(
+					"INSERT INTO meta (name, value) VALUES ('fingerprint', ?) "
+					"ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+					(self.fingerprint,),
+				)
+				if row is not None:
+					logger.info(
+						"文キャッシュを無効化しました",
+						path=self.path,
+						fingerprint=self.fingerprint,
+					)
+			self._conn.execute("COMMIT")
+		except Exception:
+			self._conn.execute("ROLLBACK")
+			raise
+
+	def _key(self, sentence: str) -> str:
+		return hashlib.sha256(f"{self.fingerprint}\0{sentence}".encode()).hexdigest()
+
+	def get_many(self, sentences: list[str]) -> dict[str, list[tuple]]:
+		"""キャッシュ済みの文の検出結果（文内の位置）を返す"""
+		keys = {self._key(s): s for s in set(sentences)}
+		if not keys:
+			return {}
+
+		found = {}
+		with self._lock:
+			key_list = list(keys)
+			# SQLiteの変数上限を避けるため分割して検索
+			for i in range(0, len(key_list), 500):
+				chunk = key_list[i : i + 500]
+				placeholders = ",".join("?" * len(chunk))
+				rows = self._conn.execute(
+					f"SELECT key, spans FROM entries WHERE key IN ({placeholders})",
+					chunk,
+				).fetchall()
+				for key, spans in rows:
+					found[keys[key]] = [tuple(span) for span in json.loads(spans)]
+			if found:
+				now = time.time()
+				self._conn.executemany(
+					"UPDATE entries SET last_access = ? WHERE key = ?",
+					[(now, self._key(s)) for s in found],
+				)
+		self.hits += len(found)
+		self.misses += len(keys) - len(found)
+		return found
+
+	def put_many(self, results: dict[str, list[tuple]]) -> None:
+		"""文ごとの検出結果を保存し、上限を超えた分を追い出す"""
+		if not results:
+			return
+		now = time.time()
+		rows = []
+		for sentence, spans in results.items():
+			payload = json.dumps(spans, ensure_ascii=False)
+			rows.append(
+				(self._key(sentence), payload, len(payload.encode("utf-8")), now)
+			)
+
+		with self._lock:
+			self._conn.execute("BEGIN IMMEDIATE")
+			try:
+				self._conn.executemany(
+					"INSERT INTO entries (key, spans, size, last_access) "
+					"VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+					"spans = excluded.spans, size = excluded.size, "
+					"last_access = excluded.last_access",
+					rows,
+				)
+				self._evict()
+				self._conn.execute("COMMIT")
+			except Exception:
+				self._conn.execute("ROLLBACK")
+				raise
+
+	def _evict(self):
+		"""合計サイズが上限を超えていれば古いエントリから削除"""
+		total = self.total_size()
+		if total <= self.max_bytes:
+			return
+		# 毎回の削除を避けるため上限の90%まで減らす
+		target = int(self.max_bytes * 0.9)
+		cursor = self._conn.execute(
+			"SELECT key, size FROM entries ORDER BY last_access"
+		)
+		victims = []
+		for key, size in cursor:
+			if total <= target:
+				break
+			victims.append((key,))
+			total -= size
+		cursor.close()
+		self._conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+		self.evictions += len(victims)
+
+	def total_size(self) -> int:
+		"""保存されている検出結果の合計バイト数"""
+		row = self._conn.execute(
+			"SELECT value FROM meta WHERE name = 'total_size'"
+		).fetchone()
+		return int(row[0])
+
+	def stats(self) -> dict[str, int]:
+		"""キャッシュの統計情報"""
+		with self._lock:
+			entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+			total = self.total_size()
+		return {
+			"entries": entries,
+			"bytes": total,
+			"max_bytes": self.max_bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+		}
+
+	def close(self) -> None:
+		self._conn.close()
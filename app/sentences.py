@@ -0,0 +1,24 @@
+# app/sentences.py
+
+import re
+
+
+# 文末記号（後続の閉じ括弧を含む）または改行の連続
+_SENTENCE_END = re.compile(r"[。！？!?]+[」』）)]*|\n+")
+
+
+def split_sentences(text: str) -> list[tuple[int, int]]:
+	"""
+	テキストを文単位に分割し、各文の(開始位置, 終了位置)を返します。
+
+	返される範囲はテキスト全体を隙間なく覆うため、文ごとの位置に
+	開始位置を足せば元のテキストでの位置に戻せます。
+	"""
+	spans = []
+	start = 0
+	for match in _SENTENCE_END.finditer(text):
+		spans.append((start, match.end()))
+		start = match.end()
+	if start < len(text):
+		spans.append((start, len(text)))
+	return spans
@@ -0,0 +1,169 @@
+# app/serialization.py
+
+import json
+
+
+try:
+	import orjson
+except ImportError:  # orjsonは任意の依存関係（未インストール時は標準のjson）
+	orjson = None
+
+try:
+	import msgpack
+except ImportError:  # msgpackは任意の依存関係（未インストール時はJSONのみ）
+	msgpack = None
+
+
+# コンパクト形式でentity_mappingの各列に含めるフィールド
+MAPPING_COLUMNS = ("masked_text", "original_text", "category", "source")
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# 他の実装で使われている別名も受け付ける
+MSGPACK_MEDIA_TYPES = frozenset(
+	(MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+)
+
+
+def dumps(obj) -> bytes:
+	"""UTF-8のJSONバイト列に変換（orjsonがあれば使用）"""
+	if orjson is not None:
+		return orjson.dumps(obj)
+	return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes):
+	"""JSONバイト列を読み込む（orjsonがあれば使用）"""
+	if orjson is not None:
+		return orjson.loads(data)
+	return json.loads(data)
+
+
+def packb(obj) -> bytes:
+	"""msgpackのバイト列に変換"""
+	return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpackb(data: bytes):
+	"""msgpackのバイト列を読み込む"""
+	return msgpack.unpackb(data, raw=False)
+
+
+def _media_type(value: str) -> str:
+	return value.split(";", 1)[0].strip().lower()
+
+
+def header_weights(value: str) -> dict[str, float]:
+	"""AcceptやAccept-Encodingの値を{値: q値}に変換（q値の省略時は1）"""
+	weights = {}
+	for item in value.split(","):
+		token, *params = item.split(";")
+		quality = 1.0
+		for param in params:
+			name, _, number = param.partition("=")
+			if name.strip().lower() == "q":
+				try:
+					quality = float(number)
+				except ValueError:
+					quality = 0.0
+		token = token.strip().lower()
+		if token:
+			weights[token] = max(weights.get(token, 0.0), quality)
+	return weights
+
+
+def is_msgpack(content_type: str | None) -> bool:
+	"""Content-Typeがmsgpackかどうか"""
+	return bool(content_type) and _media_type(content_type) in MSGPACK_MEDIA_TYPES
+
+
+def accepts_msgpack(accept: str | None) -> bool:
+	"""
+	Acceptヘッダーがmsgpackのレスポンスを求めているか
+
+	msgpackのq値が0より大きく、JSONのq値以上の場合にTrueを返します。
+	msgpackが未インストールの場合は常にFalseです。
+	"""
+	if msgpack is None or not accept:
+		return False
+	weights = header_weights(accept)
+	msgpack_weight = max(
+		weights.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES
+	)
+	return msgpack_weight > 0 and msgpack_weight >= weights.get(JSON_MEDIA_TYPE, 0.0)
+
+
+def mapping_to_columns(entity_mapping: dict[str, dict[str, str]]) -> dict[str, list]:
+	"""entity_mappingをマスクトークン（token列）をキーとする列形式に変換"""
+	columns = {"token": list(entity_mapping)}
+	for name in MAPPING_COLUMNS:
+		columns[name] = [entity.get(name) for entity in entity_mapping.values()]
+	return columns
+
+
+def columns_to_mapping(columns: dict[str, list]) -> dict[str, dict[str, str]]:
+	"""列形式のエンティティをentity_mappingに戻す"""
+	return {
+		token: {name: columns[name][i] for name in MAPPING_COLUMNS}
+		for i, token in enumerate(columns["token"])
+	}
+
+
+def debug_info_to_columns(debug_info: list[dict]) -> dict[str, list]:
+	"""検出エンティティの一覧を列形式に変換（positionはstart・end列に分割）"""
+	return {
+		"original": [e["original"] for e in debug_info],
+		"category": [e["category"] for e in debug_info],
+		"mask_token": [e["mask_token"] for e in debug_info],
+		"start": [e["position"]["start"] for e in debug_info],
+		"end": [e["position"]["end"] for e in debug_info],
+		"source": [e["source"] for e in debug_info],
+	}
+
+
+def columns_to_debug_info(columns: dict[str, list]) -> list[dict]:
+	"""列形式の検出エンティティを一覧に戻す"""
+	return [
+		{
+			"original": original,
+			"category": category,
+			"mask_token": mask_token,
+			"position": {"start": start, "end": end},
+			"source": source,
+		}
+		for original, category, mask_token, start, end, source in zip(
+			columns["original"],
+			columns["category"],
+			columns["mask_token"],
+			columns["start"],
+			columns["end"],
+			columns["source"],
+			strict=True,
+		)
+	]
+
+
+def compact_masking_payload(
+	masked_text: str,
+	entity_mapping: dict[str, dict[str, str]],
+	debug_info: list[dict] | None = None,
+	mapping_handle: str | None = None,
+	timing: dict | None = None,
+) -> dict:
+	"""
+	コンパクト形式のマスキングレスポンス
+
+	エンティティは列形式のentitiesで返し、debug_infoは指定時のみ含めます。
+	値がないフィールドは省略します。
+	"""
+	payload = {
+		"masked_text": masked_text,
+		"entities": mapping_to_columns(entity_mapping),
+	}
+	if debug_info is not None:
+		payload["debug_info"] = debug_info_to_columns(debug_info)
+	if mapping_handle is not None:
+		payload["mapping_handle"] = mapping_handle
+	if timing is not None:
+		payload["timing"] = timing
+	return payload
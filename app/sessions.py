@@ -0,0 +1,138 @@
+# app/sessions.py
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import structlog
+
+
+logger = structlog.get_logger(__name__)
+
+
+class SessionNotFoundError(KeyError):
+	"""セッションが存在しないか有効期限切れの場合の例外"""
+
+
+class SessionLimitError(ValueError):
+	"""セッションのトークン表が上限に達した場合の例外"""
+
+
+class MaskingSession:
+	"""
+	1つのセッションで共有するトークン表と累積マッピング
+
+	lockはマスキング中に保持し、同じセッションへの同時呼び出しで
+	トークン表が競合しないようにします。
+	"""
+
+	def __init__(self, session_id: str, max_entries: int):
+		self.session_id = session_id
+		self.max_entries = max_entries
+		self.token_table: dict[str, str] = {}
+		self.entity_mapping: dict[str, dict[str, str]] = {}
+		self.lock = threading.Lock()
+		self.last_access = time.monotonic()
+
+	def mask(self, mask_fn, **kwargs) -> tuple[str, dict, list[dict]]:
+		"""
+		セッションのトークン表を使ってmask_fn（mask_textまたはremask_text）を実行し、
+		(マスク済みテキスト, 今回新しく追加されたマッピング, デバッグ情報)を返す
+		"""
+		with self.lock:
+			snapshot = dict(self.token_table)
+			try:
+				masked_text, entity_mapping, debug_info = mask_fn(
+					token_table=self.token_table, **kwargs
+				)
+				new_entries = {
+					token: entry
+					for token, entry in entity_mapping.items()
+					if token not in self.entity_mapping
+				}
+				if len(self.entity_mapping) + len(new_entries) > self.max_entries:
+					raise SessionLimitError(
+						f"セッションのマッピングが上限({self.max_entries}件)を超えます。"
+					)
+			except Exception:
+				# 失敗した場合は今回の割り当てを取り消す
+				self.token_table.clear()
+				self.token_table.update(snapshot)
+				raise
+			self.entity_mapping.update(new_entries)
+		return masked_text, new_entries, debug_info
+
+	def mapping_snapshot(self) -> dict[str, dict[str, str]]:
+		"""累積マッピングのコピー（マスキング中の場合は完了を待つ）"""
+		with self.lock:
+			return dict(self.entity_mapping)
+
+
+class SessionStore:
+	"""
+	マスキングセッションをメモリ上で管理するストア
+
+	最後のアクセスからttl秒経過したセッションは失効し、max_sessionsを
+	超えた場合は最も長く使われていないセッションから破棄します。
+	"""
+
+	def __init__(
+		self, ttl: float = 1800, max_sessions: int = 1000, max_entries: int = 10000
+	):
+		self.ttl = ttl
+		self.max_sessions = max_sessions
+		self.max_entries = max_entries
+		self._sessions: OrderedDict[str, MaskingSession] = OrderedDict()
+		self._lock = threading.Lock()
+		self.expired = 0
+		self.evicted = 0
+
+	def _purge_expired(self, now: float) -> None:
+		while self._sessions:
+			session = next(iter(self._sessions.values()))
+			if now - session.last_access < self.ttl:
+				break
+			self._sessions.popitem(last=False)
+			self.expired += 1
+
+	def create(self) -> MaskingSession:
+		"""新しいセッションを作成"""
+		session = MaskingSession(secrets.token_urlsafe(16), self.max_entries)
+		with self._lock:
+			self._purge_expired(session.last_access)
+			self._sessions[session.session_id] = session
+			while len(self._sessions) > self.max_sessions:
+				_, evicted = self._sessions.popitem(last=False)
+				self.evicted += 1
+				logger.info(
+					"セッション数の上限により破棄しました",
+					session_id=evicted.session_id,
+				)
+		return session
+
+	def get(self, session_id: str) -> MaskingSession:
+		"""セッションを取得し、最終アクセス時刻を更新"""
+		now = time.monotonic()
+		with self._lock:
+			self._purge_expired(now)
+			session = self._sessions.get(session_id)
+			if session is None:
+				raise SessionNotFoundError(session_id)
+			session.last_access = now
+			self._sessions.move_to_end(session_id)
+		return session
+
+	def delete(self, session_id: str) -> bool:
+		"""セッションを削除（存在した場合はTrue）"""
+		with self._lock:
+			return self._sessions.pop(session_id, None) is not None
+
+	def stats(self) -> dict[str, int]:
+		"""セッションの統計情報"""
+		return {
+			"size": len(self._sessions),
+			"max_sessions": self.max_sessions,
+			"expired": self.expired,
+			"evicted": self.evicted,
+		}
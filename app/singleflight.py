@@ -0,0 +1,75 @@
+# app/singleflight.py
+
+import threading
+from collections.abc import Callable, Hashable
+from typing import Any
+
+
+class _Call:
+	__slots__ = ("done", "result", "error", "waiters")
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error: BaseException | None = None
+		self.waiters = 0
+
+
+class SingleFlight:
+	"""
+	同じキーに対する同時実行中の処理を1回にまとめる
+
+	最初の呼び出しだけが関数を実行し、実行中に届いた同じキーの呼び出しは
+	その結果（または例外）を共有します。完了後の呼び出しは新たに実行されます。
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._calls: dict[Hashable, _Call] = {}
+		self.executed = 0
+		self.coalesced = 0
+
+	def do(self, key: Hashable, fn: Callable[[], Any]) -> tuple[Any, bool]:
+		"""
+		関数を実行して(結果, 他の呼び出しの結果を共有したか)を返します。
+		"""
+		with self._lock:
+			call = self._calls.get(key)
+			leader = call is None
+			if leader:
+				call = self._calls[key] = _Call()
+				self.executed += 1
+			else:
+				call.waiters += 1
+				self.coalesced += 1
+
+		if not leader:
+			call.done.wait()
+			if call.error is not None:
+				raise call.error
+			return call.result, True
+
+		try:
+			call.result = fn()
+		except BaseException as e:
+			call.error = e
+			raise
+		finally:
+			with self._lock:
+				del self._calls[key]
+			call.done.set()
+		return call.result, False
+
+	def in_flight(self) -> int:
+		"""実行中のキーの数"""
+		return len(self._calls)
+
+	def stats(self) -> dict[str, float]:
+		"""実行回数と合流回数の統計情報"""
+		total = self.executed + self.coalesced
+		return {
+			"in_flight": len(self._calls),
+			"executed": self.executed,
+			"coalesced": self.coalesced,
+			"coalesce_rate": self.coalesced / total if total else 0.0,
+		}
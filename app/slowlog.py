@@ -0,0 +1,107 @@
+# app/slowlog.py
+
+import hashlib
+import json
+import logging
+import queue
+import time
+from collections import Counter
+from logging.handlers import QueueListener, RotatingFileHandler
+
+from app.timing import StageTimer
+
+
+class SlowRequestLog:
+	"""
+	処理時間がしきい値を超えたリクエストを別ファイルに記録するログ
+
+	テキスト本文は保存せず、長さ・エンティティ数・カテゴリ・処理段階ごとの
+	時間をJSON Linesで書き出します。hash_keyを指定した場合のみ、同じ入力の
+	再発を照合するための本文の鍵付きハッシュも記録します（鍵のないハッシュは
+	辞書攻撃で本文を推測できるため記録しません）。失敗したリクエストは
+	処理時間にかかわらず記録します。
+
+	ファイルへの書き込みはキュー経由でバックグラウンドスレッドが行います。
+	ファイルはmax_bytes×backup_countで上限を設けます。
+	"""
+
+	def __init__(
+		self,
+		path: str,
+		threshold_ms: float = 1000,
+		max_bytes: int = 5 * 2**20,
+		backup_count: int = 3,
+		hash_key: bytes | None = None,
+	):
+		self.threshold_ms = threshold_ms
+		self.hash_key = hash_key or None
+		self.recorded = 0
+		handler = RotatingFileHandler(
+			path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+		)
+		handler.setFormatter(logging.Formatter("%(message)s"))
+		self._queue: queue.SimpleQueue = queue.SimpleQueue()
+		self._listener = QueueListener(self._queue, handler)
+		self._listener.start()
+
+	def close(self) -> None:
+		"""キューに残っている記録を書き出して書き込みスレッドを停止"""
+		if self._listener is not None:
+			self._listener.stop()
+			for handler in self._listener.handlers:
+				handler.close()
+			self._listener = None
+
+	def content_hash(self, text: str) -> str | None:
+		"""本文の代わりに記録する鍵付きハッシュ（hash_keyがなければNone）"""
+		if self.hash_key is None:
+			return None
+		return hashlib.blake2b(
+			text.encode("utf-8"), key=self.hash_key[:64], digest_size=16
+		).hexdigest()
+
+	def maybe_record(
+		self,
+		endpoint: str,
+		latency_ms: float,
+		text: str,
+		debug_info: list[dict],
+		categories: list[str] | None,
+		mask_style: str | None,
+		timer: StageTimer,
+		error: str | None = None,
+	) -> bool:
+		"""
+		しきい値を超えたか失敗していれば記録し、記録した場合はTrueを返す
+
+		errorには失敗した場合の例外の種類を指定します。
+		"""
+		if latency_ms < self.threshold_ms and error is None:
+			return False
+		record = {
+			"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+			"endpoint": endpoint,
+			"latency_ms": round(latency_ms, 2),
+			"queue_ms": round(timer.queue_wait * 1000, 2),
+			"stages_ms": {
+				stage: round(seconds * 1000, 2)
+				for stage, seconds in timer.durations.items()
+			},
+			"text_length": len(text),
+			"entity_count": len(debug_info),
+			"entities_by_category": dict(Counter(e["category"] for e in debug_info)),
+			"entities_by_source": dict(Counter(e["source"] for e in debug_info)),
+			"counts": timer.counts,
+			"categories": categories,
+			"mask_style": mask_style,
+		}
+		if (content_hash := self.content_hash(text)) is not None:
+			record["content_hash"] = content_hash
+		if error is not None:
+			record["error"] = error
+		# 整形だけをここで行い、ディスクへの書き込みは書き込みスレッドに任せる
+		self._queue.put_nowait(
+			logging.makeLogRecord({"msg": json.dumps(record, ensure_ascii=False)})
+		)
+		self.recorded += 1
+		return True
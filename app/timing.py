@@ -0,0 +1,36 @@
+# app/timing.py
+
+import time
+from contextlib import contextmanager
+
+from app.tracing import span
+
+
+# mask_textの処理段階（計測・レスポンス・メトリクスで共通の名前）
+STAGES = ("preprocess", "rules", "ner", "merge", "overlap", "assemble")
+
+
+class StageTimer:
+	"""処理段階ごとの所要時間（秒）を記録するタイマー"""
+
+	def __init__(self):
+		self.durations: dict[str, float] = {}
+		# 段階ごとの入力件数など、処理時間の原因調査に使う件数
+		self.counts: dict[str, int] = {}
+		# ワーカースレッドの空きを待った時間（サーバーが設定）
+		self.queue_wait = 0.0
+
+	@contextmanager
+	def stage(self, name: str):
+		"""with文で囲んだ処理の時間をnameに加算（トレース有効時はスパンも記録）"""
+		start = time.perf_counter()
+		try:
+			with span(name):
+				yield
+		finally:
+			elapsed = time.perf_counter() - start
+			self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+	def count(self, name: str, value: int) -> None:
+		"""件数を加算"""
+		self.counts[name] = self.counts.get(name, 0) + value
@@ -0,0 +1,181 @@
+# app/tracing.py
+
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import re
+import secrets
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueListener
+
+import structlog
+
+
+logger = structlog.get_logger(__name__)
+
+# W3C Trace Contextのtraceparentヘッダー
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+	"""1つの処理区間（トレースIDと親スパンで他の区間と結び付く）"""
+
+	__slots__ = (
+		"name",
+		"trace_id",
+		"span_id",
+		"parent_id",
+		"start_ns",
+		"end_ns",
+		"attributes",
+		"status",
+	)
+
+	def __init__(self, name: str, trace_id: str, parent_id: str | None, attributes):
+		self.name = name
+		self.trace_id = trace_id
+		self.span_id = secrets.token_hex(8)
+		self.parent_id = parent_id
+		self.start_ns = time.time_ns()
+		self.end_ns = None
+		self.attributes = dict(attributes)
+		self.status = "ok"
+
+	def set_attribute(self, key: str, value) -> None:
+		self.attributes[key] = value
+
+	def traceparent(self) -> str:
+		return f"00-{self.trace_id}-{self.span_id}-01"
+
+	def to_dict(self) -> dict:
+		return {
+			"name": self.name,
+			"trace_id": self.trace_id,
+			"span_id": self.span_id,
+			"parent_span_id": self.parent_id,
+			"start_time_unix_nano": self.start_ns,
+			"end_time_unix_nano": self.end_ns,
+			"attributes": self.attributes,
+			"status": self.status,
+		}
+
+
+class JsonlSpanExporter:
+	"""
+	終了したスパンを1行1スパンのJSONとしてファイルに追記するエクスポーター
+
+	ファイルへの書き込みはキュー経由でバックグラウンドスレッドが行います。
+	"""
+
+	def __init__(self, path: str):
+		self.path = path
+		handler = logging.FileHandler(path, encoding="utf-8")
+		handler.setFormatter(logging.Formatter("%(message)s"))
+		self._queue: queue.SimpleQueue = queue.SimpleQueue()
+		self._listener = QueueListener(self._queue, handler)
+		self._listener.start()
+
+	def export(self, span: Span) -> None:
+		line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+		self._queue.put_nowait(logging.makeLogRecord({"msg": line}))
+
+	def close(self) -> None:
+		"""キューに残っているスパンを書き出して書き込みスレッドを停止"""
+		if self._listener is not None:
+			self._listener.stop()
+			for handler in self._listener.handlers:
+				handler.close()
+			self._listener = None
+
+
+_exporter: JsonlSpanExporter | None = None
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+	"current_span", default=None
+)
+# 受信したtraceparent（トレースIDと呼び出し元のスパンID）
+_remote_parent: contextvars.ContextVar[tuple[str, str] | None] = contextvars.ContextVar(
+	"remote_parent", default=None
+)
+
+
+def configure_tracing(path: str | None) -> None:
+	"""pathを指定するとトレースを有効にし、JSONLファイルに出力"""
+	global _exporter
+	if _exporter is not None:
+		_exporter.close()
+	_exporter = JsonlSpanExporter(path) if path else None
+	if _exporter is not None:
+		atexit.register(_exporter.close)
+		logger.info("トレースを有効にしました", path=path)
+
+
+def tracing_enabled() -> bool:
+	return _exporter is not None
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str] | None:
+	"""traceparentヘッダーから(トレースID, 親スパンID)を取得"""
+	if not header:
+		return None
+	match = _TRACEPARENT.match(header.strip().lower())
+	if match is None or set(match.group(1)) == {"0"} or set(match.group(2)) == {"0"}:
+		return None
+	return match.group(1), match.group(2)
+
+
+def set_remote_parent(traceparent: str | None) -> contextvars.Token:
+	"""受信したtraceparentを現在のコンテキストの親として設定"""
+	return _remote_parent.set(parse_traceparent(traceparent))
+
+
+def current_span() -> Span | None:
+	return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+	"""
+	with文で囲んだ処理をスパンとして記録
+
+	トレースが無効な場合は何も記録せずNoneを渡します。
+	"""
+	exporter = _exporter
+	if exporter is None:
+		yield None
+		return
+
+	parent = _current_span.get()
+	if parent is not None:
+		trace_id, parent_id = parent.trace_id, parent.span_id
+	elif (remote := _remote_parent.get()) is not None:
+		trace_id, parent_id = remote
+	else:
+		trace_id, parent_id = secrets.token_hex(16), None
+
+	current = Span(name, trace_id, parent_id, attributes)
+	token = _current_span.set(current)
+	try:
+		yield current
+	except BaseException as e:
+		current.status = "error"
+		current.attributes["error"] = repr(e)
+		raise
+	finally:
+		_current_span.reset(token)
+		current.end_ns = time.time_ns()
+		exporter.export(current)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attributes) -> None:
+	"""開始・終了時刻が既に分かっている区間（待ち時間など）をスパンとして記録"""
+	exporter = _exporter
+	parent = _current_span.get()
+	if exporter is None or parent is None:
+		return
+	recorded = Span(name, parent.trace_id, parent.span_id, attributes)
+	recorded.start_ns = start_ns
+	recorded.end_ns = end_ns
+	exporter.export(recorded)
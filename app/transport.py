@@ -0,0 +1,183 @@
+# app/transport.py
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers, MutableHeaders
+
+from app import serialization
+from app.compression import (
+	DecompressedSizeError,
+	Decompressor,
+	UnsupportedEncodingError,
+	choose_encoding,
+	compress,
+)
+
+
+class MsgpackRequest(Request):
+	"""
+	msgpackの本文をJSONの本文と同じように読み込むリクエスト
+
+	FastAPIはContent-TypeがJSONの場合のみ本文を辞書として検証するため、
+	Content-TypeをJSONとして見せ、json()でmsgpackを読み込みます。
+	"""
+
+	def __init__(self, scope, receive):
+		super().__init__(scope, receive)
+		raw = [(k, v) for k, v in scope["headers"] if k != b"content-type"]
+		raw.append((b"content-type", serialization.JSON_MEDIA_TYPE.encode()))
+		self._headers = Headers(raw=raw)
+
+	async def json(self):
+		if not hasattr(self, "_json"):
+			self._json = serialization.unpackb(await self.body())
+		return self._json
+
+
+class NegotiatedRoute(APIRoute):
+	"""Content-Type: application/msgpackのリクエスト本文を受け付けるルート"""
+
+	def get_route_handler(self):
+		handler = super().get_route_handler()
+
+		async def route_handler(request: Request) -> Response:
+			if serialization.is_msgpack(request.headers.get("content-type")):
+				if serialization.msgpack is None:
+					raise HTTPException(
+						status_code=415, detail="msgpackはサポートされていません。"
+					)
+				request = MsgpackRequest(request.scope, request.receive)
+			return await handler(request)
+
+		return route_handler
+
+
+def encode_response(
+	payload: dict, accept: str | None, headers: dict | None = None
+) -> Response:
+	"""Acceptヘッダーに応じてmsgpackまたはJSONのレスポンスを作成"""
+	if serialization.accepts_msgpack(accept):
+		return Response(
+			content=serialization.packb(payload),
+			media_type=serialization.MSGPACK_MEDIA_TYPE,
+			headers=headers,
+		)
+	return Response(
+		content=serialization.dumps(payload),
+		media_type=serialization.JSON_MEDIA_TYPE,
+		headers=headers,
+	)
+
+
+class CompressionMiddleware:
+	"""
+	リクエスト本文の展開とレスポンスの圧縮を行うASGIミドルウェア
+
+	Content-Encoding（gzip・zstd）付きのリクエスト本文は展開してから
+	アプリケーションに渡します。レスポンスはAccept-Encodingで対応する方式が
+	指定され、minimum_sizeバイト以上の場合に圧縮します。ストリーミング
+	レスポンスは圧縮しません。
+	"""
+
+	def __init__(self, app, minimum_size: int = 1024, max_body_size: int = 64 * 2**20):
+		self.app = app
+		self.minimum_size = minimum_size
+		self.max_body_size = max_body_size
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+
+		headers = Headers(scope=scope)
+		content_encoding = headers.get("content-encoding", "identity")
+		if content_encoding.strip().lower() != "identity":
+			try:
+				body = await self._read_body(receive, content_encoding)
+			except UnsupportedEncodingError:
+				response = JSONResponse(
+					{"detail": f"未対応のContent-Encodingです: {content_encoding}"},
+					status_code=415,
+				)
+				await response(scope, receive, send)
+				return
+			except DecompressedSizeError as e:
+				response = JSONResponse({"detail": str(e)}, status_code=413)
+				await response(scope, receive, send)
+				return
+			except Exception:
+				# 壊れた圧縮データ（zlib.error、zstandard.ZstdErrorなど）
+				response = JSONResponse(
+					{"detail": "リクエスト本文を展開できません。"}, status_code=400
+				)
+				await response(scope, receive, send)
+				return
+			scope = dict(scope)
+			scope["headers"] = [
+				(k, v)
+				for k, v in scope["headers"]
+				if k not in (b"content-encoding", b"content-length")
+			] + [(b"content-length", str(len(body)).encode())]
+			receive = _replay(body, receive)
+
+		encoding = choose_encoding(headers.get("accept-encoding"))
+		if encoding is None:
+			await self.app(scope, receive, send)
+			return
+		await self.app(scope, receive, self._compressing_send(send, encoding))
+
+	async def _read_body(self, receive, content_encoding: str) -> bytes:
+		decompressor = Decompressor(content_encoding, self.max_body_size)
+		parts = []
+		more_body = True
+		while more_body:
+			message = await receive()
+			if message["type"] != "http.request":
+				break
+			parts.append(decompressor.decompress(message.get("body", b"")))
+			more_body = message.get("more_body", False)
+		decompressor.finish()
+		return b"".join(parts)
+
+	def _compressing_send(self, send, encoding: str):
+		start = None
+
+		async def wrapped(message):
+			nonlocal start
+			if message["type"] == "http.response.start":
+				# 本文の大きさが分かるまでヘッダーの送信を遅らせる
+				start = message
+				return
+			if message["type"] == "http.response.body" and start is not None:
+				headers = MutableHeaders(raw=list(start["headers"]))
+				body = message.get("body", b"")
+				if (
+					not message.get("more_body", False)
+					and len(body) >= self.minimum_size
+					and "content-encoding" not in headers
+				):
+					body = compress(body, encoding)
+					headers["Content-Encoding"] = encoding
+					headers["Content-Length"] = str(len(body))
+					headers.add_vary_header("Accept-Encoding")
+					message = {**message, "body": body}
+				await send({**start, "headers": headers.raw})
+				start = None
+			await send(message)
+
+		return wrapped
+
+
+def _replay(body: bytes, receive):
+	"""展開済みの本文を1回で返し、以降は元のreceive（切断の通知など）に委ねる"""
+	sent = False
+
+	async def wrapped():
+		nonlocal sent
+		if not sent:
+			sent = True
+			return {"type": "http.request", "body": body, "more_body": False}
+		return await receive()
+
+	return wrapped
@@ -2,6 +2,7 @@
 
 
 from app.models import DecodeRequest, MaskingResponse
+from app.serialization import columns_to_mapping
 
 
 def convert_masking_response_to_decode_request(
@@ -38,9 +39,14 @@ def convert_masking_response_to_decode_request(
 	"""
 	# 入力が辞書の場合（APIレスポンスなど）
 	if isinstance(masking_response, dict):
+		entity_mapping = masking_response.get("entity_mapping")
+		# compact形式のレスポンスは列形式のentitiesから復元
+		if entity_mapping is None and "entities" in masking_response:
+			entity_mapping = columns_to_mapping(masking_response["entities"])
 		return DecodeRequest(
 			masked_text=masking_response["masked_text"],
-			entity_mapping=masking_response["entity_mapping"],
+			entity_mapping=entity_mapping,
+			mapping_handle=masking_response.get("mapping_handle"),
 		)
 
 	# 入力がMaskingResponseオブジェクトの場合
@@ -48,6 +54,7 @@ def convert_masking_response_to_decode_request(
 		return DecodeRequest(
 			masked_text=masking_response.masked_text,
 			entity_mapping=masking_response.entity_mapping,
+			mapping_handle=masking_response.mapping_handle,
 		)
 
 	else:
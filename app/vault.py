@@ -0,0 +1,145 @@
+# app/vault.py
+
+import json
+import secrets
+import sqlite3
+import threading
+import time
+
+import structlog
+
+
+logger = structlog.get_logger(__name__)
+
+EntityMapping = dict[str, dict[str, str]]
+
+
+class MemoryVaultBackend:
+	"""プロセス内のメモリにマッピングを保持するバックエンド"""
+
+	def __init__(self):
+		self._data: dict[str, tuple[float, EntityMapping]] = {}
+		self._lock = threading.Lock()
+
+	def put(self, handle: str, mapping: EntityMapping, expires_at: float) -> None:
+		with self._lock:
+			self._data[handle] = (expires_at, mapping)
+
+	def get(self, handle: str, now: float) -> EntityMapping | None:
+		with self._lock:
+			item = self._data.get(handle)
+			if item is None:
+				return None
+			if item[0] <= now:
+				del self._data[handle]
+				return None
+			return item[1]
+
+	def purge(self, now: float) -> int:
+		with self._lock:
+			expired = [h for h, (exp, _) in self._data.items() if exp <= now]
+			for handle in expired:
+				del self._data[handle]
+		return len(expired)
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+
+class SQLiteVaultBackend:
+	"""SQLiteファイルにマッピングを保持するバックエンド（再起動やワーカー間で共有）"""
+
+	def __init__(self, path: str):
+		self.path = path
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(
+			path, timeout=30, check_same_thread=False, isolation_level=None
+		)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS mappings ("
+			"handle TEXT PRIMARY KEY, mapping TEXT NOT NULL, expires_at REAL NOT NULL)"
+		)
+		self._conn.execute(
+			"CREATE INDEX IF NOT EXISTS mappings_expires_at ON mappings (expires_at)"
+		)
+
+	def put(self, handle: str, mapping: EntityMapping, expires_at: float) -> None:
+		with self._lock:
+			self._conn.execute(
+				"INSERT OR REPLACE INTO mappings VALUES (?, ?, ?)",
+				(handle, json.dumps(mapping, ensure_ascii=False), expires_at),
+			)
+
+	def get(self, handle: str, now: float) -> EntityMapping | None:
+		with self._lock:
+			row = self._conn.execute(
+				"SELECT mapping FROM mappings WHERE handle = ? AND expires_at > ?",
+				(handle, now),
+			).fetchone()
+		return json.loads(row[0]) if row else None
+
+	def purge(self, now: float) -> int:
+		with self._lock:
+			return self._conn.execute(
+				"DELETE FROM mappings WHERE expires_at <= ?", (now,)
+			).rowcount
+
+	def __len__(self) -> int:
+		with self._lock:
+			return self._conn.execute("SELECT COUNT(*) FROM mappings").fetchone()[0]
+
+
+class MappingVault:
+	"""
+	entity_mappingをサーバー側に保存し、推測困難なハンドルで参照する保管庫
+
+	保存したマッピングはttl秒後に失効します。pathを指定するとSQLiteファイルに
+	保存し、指定しない場合はプロセス内のメモリに保持します。
+	"""
+
+	def __init__(
+		self,
+		ttl: float = 3600,
+		path: str | None = None,
+		purge_interval: float = 60,
+	):
+		self.ttl = ttl
+		self.backend = SQLiteVaultBackend(path) if path else MemoryVaultBackend()
+		self.purge_interval = purge_interval
+		self._next_purge = time.monotonic() + purge_interval
+		self.stored = 0
+		self.expired = 0
+
+	def _maybe_purge(self, now: float) -> None:
+		"""一定間隔で失効したマッピングを削除"""
+		if time.monotonic() < self._next_purge:
+			return
+		self._next_purge = time.monotonic() + self.purge_interval
+		removed = self.backend.purge(now)
+		self.expired += removed
+		if removed:
+			logger.debug("失効したマッピングを削除しました", count=removed)
+
+	def put(self, mapping: EntityMapping, ttl: float | None = None) -> str:
+		"""マッピングを保存してハンドルを返す"""
+		now = time.time()
+		self._maybe_purge(now)
+		handle = secrets.token_urlsafe(16)
+		self.backend.put(handle, mapping, now + (ttl or self.ttl))
+		self.stored += 1
+		return handle
+
+	def get(self, handle: str) -> EntityMapping | None:
+		"""ハンドルに対応するマッピングを取得（存在しないか失効済みならNone）"""
+		now = time.time()
+		self._maybe_purge(now)
+		return self.backend.get(handle, now)
+
+	def stats(self) -> dict[str, int]:
+		"""保管庫の統計情報"""
+		return {
+			"size": len(self.backend),
+			"stored": self.stored,
+			"expired": self.expired,
+		}
@@ -1,4 +1,9 @@
+import contextlib
+import multiprocessing
+import os
+import re
 import statistics
+import tempfile
 import time
 from enum import Enum
 from pathlib import Path
@@ -7,6 +12,10 @@ import pandas as pd
 import requests
 import typer
 
+from app.regex_safety import analyze_pattern
+from app.rules_loader import RuleBasedMasker, RuleMatchTimeoutError
+from app.timing import STAGES
+
 
 class Environment(str, Enum):
 	DOCKER = "docker"
@@ -62,15 +71,30 @@ def get_size_list(preset: TextSizePreset, custom_sizes: str | None = None) -> li
 	return preset_sizes[preset]
 
 
+def parse_server_timing(header: str) -> dict[str, float]:
+	"""Server-Timingヘッダーを{名前: ミリ秒}に変換"""
+	timings = {}
+	for entry in header.split(","):
+		name, *params = [part.strip() for part in entry.split(";")]
+		for param in params:
+			if param.startswith("dur="):
+				timings[name] = float(param[4:])
+	return timings
+
+
 def run_benchmark(
 	api_url: str, sizes: list[int], iterations: int, categories: list[str]
 ) -> dict:
 	"""ベンチマークの実行"""
 	results = {"text_sizes": [], "avg_times": [], "std_devs": [], "total_times": []}
+	# サーバーが返す処理段階ごとの所要時間（ミリ秒）
+	for stage in (*STAGES, "queue", "serialize"):
+		results[f"{stage}_ms"] = []
 
 	for size in sizes:
 		test_text = generate_test_data(size)
 		times = []
+		stage_times = {stage: [] for stage in (*STAGES, "queue", "serialize")}
 
 		typer.echo(f"\nテストサイズ: {size}x 基本テキスト")
 
@@ -80,7 +104,11 @@ def run_benchmark(
 
 				response = requests.post(
 					f"{api_url}/mask_text",
-					json={"text": test_text, "categories_to_mask": categories},
+					json={
+						"text": test_text,
+						"categories_to_mask": categories,
+						"include_timing": True,
+					},
 				)
 
 				if response.status_code != 200:
@@ -90,8 +118,13 @@ def run_benchmark(
 				end_time = time.time()
 				processing_time = end_time - start_time
 				times.append(processing_time)
+				for stage, ms in parse_server_timing(
+					response.headers.get("Server-Timing", "")
+				).items():
+					if stage in stage_times:
+						stage_times[stage].append(ms)
 
-				typer.echo(f"反復 {i+1}: {processing_time:.3f}秒")
+				typer.echo(f"反復 {i + 1}: {processing_time:.3f}秒")
 
 		avg_time = statistics.mean(times)
 		std_dev = statistics.stdev(times) if len(times) > 1 else 0
@@ -101,11 +134,19 @@ def run_benchmark(
 		results["avg_times"].append(avg_time)
 		results["std_devs"].append(std_dev)
 		results["total_times"].append(total_time)
+		for stage, values in stage_times.items():
+			results[f"{stage}_ms"].append(statistics.mean(values) if values else 0.0)
 
 		typer.echo(f"\nサイズ {size}x の結果:")
 		typer.echo(f"平均処理時間: {avg_time:.3f}秒")
 		typer.echo(f"標準偏差: {std_dev:.3f}秒")
 		typer.echo(f"合計処理時間: {total_time:.3f}秒")
+		typer.echo(
+			"処理段階ごとの平均: "
+			+ ", ".join(
+				f"{stage}={results[f'{stage}_ms'][-1]:.1f}ms" for stage in stage_times
+			)
+		)
 
 	return results
 
@@ -119,6 +160,7 @@ def save_results(results: dict, environment: str, output_dir: Path) -> Path:
 			"Average_Time": results["avg_times"],
 			"Standard_Deviation": results["std_devs"],
 			"Total_Time": results["total_times"],
+			**{key: values for key, values in results.items() if key.endswith("_ms")},
 		}
 	)
 
@@ -156,5 +198,388 @@ def run(
 		raise typer.Exit(code=1) from e
 
 
+def generate_adversarial_texts(length: int) -> dict[str, str]:
+	"""ルールマッチング向けの敵対的入力を生成"""
+	return {
+		# 単語文字と空白の長い連続（[\\w\\s]+ 系パターンの最悪ケース）
+		"word_space": ("abc def " * length)[:length],
+		# 境界文字と語句が密に並ぶ（マッチ数が最大になるケース）
+		"dense_matches": ("部長、" * length)[:length],
+		# 語句の接頭辞だけが繰り返される（照合の途中で失敗し続けるケース）
+		"near_miss": ("Lightblu株式会" * length)[:length],
+	}
+
+
+def _time_call(func, text, repeat: int) -> float:
+	"""関数の平均処理時間（秒）を計測"""
+	start_time = time.perf_counter()
+	for _ in range(repeat):
+		func(text)
+	return (time.perf_counter() - start_time) / repeat
+
+
+@app.command()
+def regex(
+	rules_file: Path = Path("masking_rules.json"),
+	lengths: str = "1000,10000,100000",
+	repeat: int = 3,
+	match_timeout: float | None = None,
+):
+	"""敵対的入力に対するルールマッチングの処理時間を計測します"""
+	engines = ["re"]
+	try:
+		import re2
+	except ImportError:
+		re2 = None
+		typer.secho(
+			"google-re2 が未インストールのため re2 エンジンは省略します",
+			fg=typer.colors.YELLOW,
+		)
+	else:
+		engines.append("re2")
+
+	maskers = {
+		engine: RuleBasedMasker(
+			str(rules_file), regex_engine=engine, match_timeout=match_timeout
+		)
+		for engine in engines
+	}
+
+	# ルールファイルの生パターンを正規表現として実行した場合の参考値
+	raw_pattern = r"[\w\s]+株式会社"
+	risks = analyze_pattern(raw_pattern, re.UNICODE)
+	typer.echo(
+		f"参考パターン {raw_pattern}: "
+		+ (", ".join(f"{r.severity}({r.reason})" for r in risks) or "リスクなし")
+	)
+	raw_compiled = {"re": re.compile(raw_pattern)}
+	if re2 is not None:
+		raw_compiled["re2"] = re2.compile(raw_pattern)
+
+	for length in [int(x.strip()) for x in lengths.split(",")]:
+		typer.echo(f"\n入力長: {length}")
+		for name, text in generate_adversarial_texts(length).items():
+			for engine, masker in maskers.items():
+				try:
+					elapsed = _time_call(masker._find_matches, text, repeat)
+					typer.echo(
+						f"  {name:<14} rules/{engine:<4} {elapsed * 1000:10.2f}ms"
+					)
+				except RuleMatchTimeoutError as e:
+					typer.secho(
+						f"  {name:<14} rules/{engine:<4} {e}", fg=typer.colors.RED
+					)
+
+		# 生パターンは二乗時間になるため入力を制限して計測
+		if length <= 10000:
+			text = generate_adversarial_texts(length)["word_space"]
+			for engine, pattern in raw_compiled.items():
+				elapsed = _time_call(lambda t, p=pattern: list(p.finditer(t)), text, 1)
+				typer.echo(
+					f"  {'word_space':<14} raw/{engine:<6} {elapsed * 1000:10.2f}ms"
+				)
+
+
+@app.command()
+def rules_batch(
+	rules_file: Path = Path("masking_rules.json"),
+	documents: int = 100000,
+	batch_size: int = 1000,
+	regex_engine: str = "re",
+):
+	"""短文を大量に処理する場合の個別走査とバッチ走査のスループットを比較します"""
+	masker = RuleBasedMasker(str(rules_file), regex_engine=regex_engine)
+	messages = [
+		f"{i}件目: 開発部の山田部長から連絡がありました。"
+		if i % 3 == 0
+		else f"了解です{i}"
+		for i in range(documents)
+	]
+
+	start_time = time.perf_counter()
+	for message in messages:
+		masker._find_matches(message)
+	single_time = time.perf_counter() - start_time
+
+	start_time = time.perf_counter()
+	for i in range(0, documents, batch_size):
+		masker.find_matches_batch(messages[i : i + batch_size])
+	batch_time = time.perf_counter() - start_time
+
+	typer.echo(f"個別走査:   {documents / single_time:12.0f} 件/秒")
+	typer.echo(f"バッチ走査: {documents / batch_time:12.0f} 件/秒")
+
+
+@app.command()
+def entity_ruler(
+	iterations: int = DEFAULT_ITERATIONS,
+	size: int = 5,
+):
+	"""custom_entitiesをentity_rulerに重複登録した場合との処理時間を比較します"""
+	from app.masking import EnhancedTextMasker
+
+	masker = EnhancedTextMasker()
+	text = generate_test_data(size)
+	custom_entities = masker.rule_masker.rules["rules"].get("custom_entities", {})
+	patterns = [
+		{"label": label, "pattern": term}
+		for label, terms in custom_entities.items()
+		for term in terms
+	]
+
+	def measure() -> float:
+		masker.mask_text(text)  # ウォームアップ
+		start_time = time.perf_counter()
+		for _ in range(iterations):
+			masker.mask_text(text)
+		return (time.perf_counter() - start_time) / iterations
+
+	single_pass = measure()
+	ruler = masker.nlp.add_pipe("entity_ruler", before="ner")
+	ruler.add_patterns(patterns)
+	duplicated = measure()
+
+	typer.echo(f"ルールのみで照合:         {single_pass * 1000:.2f}ms")
+	typer.echo(f"entity_rulerでも照合:     {duplicated * 1000:.2f}ms")
+	typer.echo(f"削減時間:                 {(duplicated - single_pass) * 1000:.2f}ms")
+
+
+@app.command()
+def response_format(
+	size: int = 20,
+	repeat: int = 200,
+):
+	"""従来のレスポンスとcompact形式のサイズとシリアライズ時間を比較します"""
+	import json
+
+	from app import serialization
+	from app.masking import EnhancedTextMasker
+	from app.models import DebugInfo, MaskingResponse
+
+	masker = EnhancedTextMasker(enable_ner=False)
+	masked_text, entity_mapping, debug_info = masker.mask_text(generate_test_data(size))
+
+	def full() -> bytes:
+		return (
+			MaskingResponse(
+				masked_text=masked_text,
+				entity_mapping=entity_mapping,
+				debug_info=DebugInfo(detected_entities=debug_info),
+			)
+			.model_dump_json()
+			.encode("utf-8")
+		)
+
+	def compact(include_debug_info: bool):
+		def encode() -> bytes:
+			return serialization.dumps(
+				serialization.compact_masking_payload(
+					masked_text,
+					entity_mapping,
+					debug_info if include_debug_info else None,
+				)
+			)
+
+		return encode
+
+	encoders = {
+		"full": full,
+		"compact": compact(False),
+		"compact+debug_info": compact(True),
+	}
+	if serialization.orjson is not None:
+		# 比較のため標準のjsonでのcompact形式も計測
+		def compact_json() -> bytes:
+			payload = serialization.compact_masking_payload(masked_text, entity_mapping)
+			return json.dumps(
+				payload, ensure_ascii=False, separators=(",", ":")
+			).encode("utf-8")
+
+		encoders["compact (json)"] = compact_json
+
+	typer.echo(
+		f"テキスト長: {len(masked_text)}文字, エンティティ: {len(debug_info)}件, "
+		f"JSONエンコーダー: {'orjson' if serialization.orjson else 'json'}"
+	)
+	for name, encode in encoders.items():
+		size_bytes = len(encode())
+		elapsed = _time_call(lambda _, f=encode: f(), "", repeat)
+		typer.echo(f"  {name:<20} {size_bytes:8d} bytes {elapsed * 1e6:10.1f}µs/件")
+
+
+@app.command()
+def transport(
+	size: int = 20,
+	batch_items: int = 1000,
+	repeat: int = 200,
+):
+	"""リクエスト・レスポンスのエンコードとデコードの時間をJSONとmsgpackで比較します"""
+	import json
+
+	from app import serialization
+	from app.masking import EnhancedTextMasker
+	from app.models import DebugInfo, MaskingResponse
+
+	if serialization.msgpack is None:
+		typer.secho("msgpack が未インストールです", fg=typer.colors.RED)
+		raise typer.Exit(code=1)
+
+	masker = EnhancedTextMasker(enable_ner=False)
+	text = generate_test_data(size)
+	masked_text, entity_mapping, debug_info = masker.mask_text(text)
+	payloads = {
+		"mask request": {"text": text, "categories_to_mask": DEFAULT_CATEGORIES},
+		"mask response": MaskingResponse(
+			masked_text=masked_text,
+			entity_mapping=entity_mapping,
+			debug_info=DebugInfo(detected_entities=debug_info),
+		).model_dump(),
+		"decode_batch request": {
+			"entity_mapping": entity_mapping,
+			"items": [
+				{"masked_text": line}
+				for line in (masked_text.splitlines() * batch_items)[:batch_items]
+			],
+		},
+	}
+	codecs = {
+		"json": (
+			lambda obj: json.dumps(obj, ensure_ascii=False).encode("utf-8"),
+			json.loads,
+		),
+		"msgpack": (serialization.packb, serialization.unpackb),
+	}
+	if serialization.orjson is not None:
+		codecs["orjson"] = (serialization.orjson.dumps, serialization.orjson.loads)
+
+	for name, payload in payloads.items():
+		typer.echo(f"\n{name}")
+		for codec, (encode, decode) in codecs.items():
+			data = encode(payload)
+			encode_time = _time_call(lambda obj, f=encode: f(obj), payload, repeat)
+			decode_time = _time_call(lambda d, f=decode: f(d), data, repeat)
+			typer.echo(
+				f"  {codec:<8} {len(data):9d} bytes"
+				f"  エンコード {encode_time * 1e6:9.1f}µs"
+				f"  デコード {decode_time * 1e6:9.1f}µs"
+			)
+
+
+@app.command()
+def socket_latency(
+	socket_path: Path,
+	api_url: str = DEFAULT_API_URL,
+	requests_count: int = 1000,
+):
+	"""小さなリクエストのレイテンシをTCPとUnixドメインソケットで比較します"""
+	from app.api_client import MaskingClient
+
+	clients = {
+		"TCP": MaskingClient(api_url),
+		"UDS": MaskingClient(socket_path=str(socket_path)),
+	}
+	calls = {
+		"mask_text": lambda c: c.mask_text(
+			"代表取締役、山田", response_format="compact"
+		),
+		"decode_text": lambda c: c.decode_text(
+			"X", entity_mapping={"X": {"original_text": "山田", "masked_text": "X"}}
+		),
+	}
+
+	for call_name, call in calls.items():
+		typer.echo(f"\n{call_name}")
+		for name, client in clients.items():
+			call(client)  # 接続の確立とウォームアップ
+			latencies = []
+			for _ in range(requests_count):
+				start_time = time.perf_counter()
+				call(client)
+				latencies.append((time.perf_counter() - start_time) * 1e6)
+			latencies.sort()
+			typer.echo(
+				f"  {name}  平均 {statistics.mean(latencies):8.1f}µs"
+				f"  p50 {latencies[len(latencies) // 2]:8.1f}µs"
+				f"  p99 {latencies[int(len(latencies) * 0.99)]:8.1f}µs"
+			)
+
+
+def _logging_overhead(
+	env: dict[str, str], text: str, requests_count: int
+) -> tuple[float, float]:
+	"""
+	envのログ設定で、ルールのみのマスキングとリクエストログ1件を繰り返した
+	平均時間（秒）と、ファイルへの書き出し完了までを含めた平均時間を計測
+
+	ロガーは初回使用時に設定をキャッシュするため、設定ごとに別プロセスで実行します。
+	"""
+	os.environ.update(env)
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		import structlog
+
+		from app.logger_config import flush_logging
+		from app.masking import EnhancedTextMasker
+
+		logger = structlog.get_logger("benchmark")
+		masker = EnhancedTextMasker(enable_ner=False)
+		masker.mask_text(text)  # ウォームアップ
+
+		start_time = time.perf_counter()
+		for _ in range(requests_count):
+			masked_text, _, _ = masker.mask_text(text)
+			logger.info(
+				"mask_text",
+				original_text=text,
+				masked_text=masked_text,
+				categories=None,
+				mask_style="descriptive",
+			)
+		elapsed = time.perf_counter() - start_time
+		flush_logging()
+		drained = time.perf_counter() - start_time
+	return elapsed / requests_count, drained / requests_count
+
+
+@app.command()
+def logging_overhead(
+	requests_count: int = 2000,
+	size: int = 5,
+):
+	"""ログ設定ごとに1リクエストあたりのロギングのオーバーヘッドを計測します"""
+	text = generate_test_data(size)
+	variants = {
+		"WARNING（ログなし）": {"MASKING_LOG_LEVEL": "WARNING"},
+		"INFO": {"MASKING_LOG_LEVEL": "INFO"},
+		"INFO 切り詰めなし": {
+			"MASKING_LOG_LEVEL": "INFO",
+			"MASKING_LOG_MAX_FIELD_CHARS": "0",
+		},
+		"INFO 10%サンプリング": {
+			"MASKING_LOG_LEVEL": "INFO",
+			"MASKING_LOG_SAMPLE_RATE": "0.1",
+		},
+		"DEBUG": {"MASKING_LOG_LEVEL": "DEBUG"},
+	}
+
+	typer.echo(f"テキスト長: {len(text)}文字, {requests_count}リクエスト")
+	results = {}
+	context = multiprocessing.get_context("spawn")
+	with tempfile.TemporaryDirectory() as log_dir:
+		for name, env in variants.items():
+			env = {**env, "MASKING_LOG_FILE": os.path.join(log_dir, "app.log")}
+			with context.Pool(1) as pool:
+				results[name] = pool.apply(
+					_logging_overhead, (env, text, requests_count)
+				)
+
+	baseline = results["WARNING（ログなし）"][0]
+	for name, (elapsed, drained) in results.items():
+		typer.echo(
+			f"{name:<16} {elapsed * 1e6:9.1f}µs/件"
+			f"（ログ処理 {(elapsed - baseline) * 1e6:+8.1f}µs,"
+			f" 書き出し完了まで {drained * 1e6:9.1f}µs/件）"
+		)
+
+
 if __name__ == "__main__":
 	app()
@@ -4,10 +4,10 @@ import json
 import os
 import sys
 
-import requests
 import typer
 from dotenv import load_dotenv
 
+from app.api_client import MaskingAPIError, MaskingClient
 from app.utils import convert_masking_response_to_decode_request
 from gpt_handler import GPTHandler
 
@@ -42,6 +42,10 @@ AVAILABLE_CATEGORIES = [
 # .envファイルから環境変数を読み込み
 load_dotenv()
 
+# 接続を再利用し、大きな本文は圧縮して送受信するAPIクライアント
+# （MASKING_SOCKET_PATHを指定するとUnixドメインソケットで接続）
+client = MaskingClient(socket_path=os.getenv("MASKING_SOCKET_PATH"))
+
 
 def mask_text(
 	text: str,
@@ -52,22 +56,16 @@ def mask_text(
 	"""
 	テキストをマスキング処理します（指定されたカテゴリに基づく）。
 	"""
-	response = requests.post(
-		"http://localhost:8000/mask_text",
-		headers={"Content-Type": "application/json"},
-		json={
-			"text": text,
-			"categories_to_mask": categories or [],
-			"mask_style": "descriptive",
-			"key_values_to_mask": key_values_to_mask or {},
-			"values_to_mask": values_to_mask or [],
-		},
-	)
-
-	if response.status_code == 200:
-		return response.json()
-	else:
-		raise typer.Exit(f"マスキングエラー: {response.status_code} - {response.text}")
+	try:
+		return client.mask_text(
+			text,
+			categories_to_mask=categories or [],
+			mask_style="descriptive",
+			key_values_to_mask=key_values_to_mask or {},
+			values_to_mask=values_to_mask or [],
+		)
+	except MaskingAPIError as e:
+		raise typer.Exit(f"マスキングエラー: {e.status_code} - {e.detail}") from None
 
 
 def decode_text(masking_result: dict) -> str:
@@ -77,19 +75,12 @@ def decode_text(masking_result: dict) -> str:
 	# マスキング結果をデコードリクエスト形式に変換
 	decode_request = convert_masking_response_to_decode_request(masking_result)
 
-	response = requests.post(
-		"http://localhost:8000/decode_text",
-		headers={"Content-Type": "application/json"},
-		json={
-			"masked_text": decode_request.masked_text,
-			"entity_mapping": decode_request.entity_mapping,
-		},
-	)
-
-	if response.status_code == 200:
-		return response.json()["decoded_text"]
-	else:
-		raise typer.Exit(f"デコードエラー: {response.status_code} - {response.text}")
+	try:
+		return client.decode_text(
+			decode_request.masked_text, entity_mapping=decode_request.entity_mapping
+		)
+	except MaskingAPIError as e:
+		raise typer.Exit(f"デコードエラー: {e.status_code} - {e.detail}") from None
 
 
 @app.command()
@@ -2,15 +2,19 @@
 
 import os
 
-import requests
 from dotenv import load_dotenv
 
+from app.api_client import MaskingAPIError, MaskingClient
 from app.utils import convert_masking_response_to_decode_request
 from gpt_handler import GPTHandler
 
 
 load_dotenv()
 
+# 接続を再利用し、大きな本文は圧縮して送受信するAPIクライアント
+# （MASKING_SOCKET_PATHを指定するとUnixドメインソケットで接続）
+client = MaskingClient(socket_path=os.getenv("MASKING_SOCKET_PATH"))
+
 
 def mask_text(
 	text: str,
@@ -19,22 +23,16 @@ def mask_text(
 	values_to_mask: list[str] | None = None,
 ) -> dict:
 	"""テキストをマスキング処理"""
-	response = requests.post(
-		"http://localhost:8000/mask_text",
-		headers={"Content-Type": "application/json"},
-		json={
-			"text": text,
-			"categories_to_mask": categories or [],
-			"mask_style": "descriptive",
-			"key_values_to_mask": key_values_to_mask or {},
-			"values_to_mask": values_to_mask or [],
-		},
-	)
-
-	if response.status_code == 200:
-		return response.json()
-	else:
-		raise Exception(f"Masking Error: {response.status_code} - {response.text}")
+	try:
+		return client.mask_text(
+			text,
+			categories_to_mask=categories or [],
+			mask_style="descriptive",
+			key_values_to_mask=key_values_to_mask or {},
+			values_to_mask=values_to_mask or [],
+		)
+	except MaskingAPIError as e:
+		raise Exception(f"Masking Error: {e.status_code} - {e.detail}") from None
 
 
 def decode_text(masking_result: dict) -> str:
@@ -42,19 +40,12 @@ def decode_text(masking_result: dict) -> str:
 	# マスキング結果からデコードリクエストを生成
 	decode_request = convert_masking_response_to_decode_request(masking_result)
 
-	response = requests.post(
-		"http://localhost:8000/decode_text",
-		headers={"Content-Type": "application/json"},
-		json={
-			"masked_text": decode_request.masked_text,
-			"entity_mapping": decode_request.entity_mapping,
-		},
-	)
-
-	if response.status_code == 200:
-		return response.json()["decoded_text"]
-	else:
-		raise Exception(f"Decoding Error: {response.status_code} - {response.text}")
+	try:
+		return client.decode_text(
+			decode_request.masked_text, entity_mapping=decode_request.entity_mapping
+		)
+	except MaskingAPIError as e:
+		raise Exception(f"Decoding Error: {e.status_code} - {e.detail}") from None
 
 
 if __name__ == "__main__":
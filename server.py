@@ -1,23 +1,63 @@
 # server.py
 
+import atexit
+import hashlib
+import hmac
+import json
 import os
+import threading
+import time
 import warnings
+from functools import lru_cache, partial
 
 import structlog
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import ValidationError
+from starlette.datastructures import Headers, MutableHeaders
 
 # ロギング設定をインポート（設定スクリプトを実行）
 import app.logger_config  # この行でロギング設定が適用されます
 from app.decoding import EnhancedTextDecoder
 from app.masking import EnhancedTextMasker
+from app.metrics import Registry
 from app.models import (
+	BatchDecodeRequest,
+	BatchDecodeResponse,
 	DebugInfo,
 	DecodeRequest,
 	DecodeResponse,
 	EnhancedMaskingRequest,
+	MappingSource,
 	MaskingResponse,
+	RemaskRequest,
+	SessionResponse,
+	TimingInfo,
 )
+from app.profiler import install_signal_handler, profile_for
+from app.rules_loader import RuleMatchTimeoutError
+from app.serialization import (
+	JSON_MEDIA_TYPE,
+	MSGPACK_MEDIA_TYPE,
+	accepts_msgpack,
+	compact_masking_payload,
+	dumps,
+	packb,
+)
+from app.sessions import SessionLimitError, SessionNotFoundError, SessionStore
+from app.slowlog import SlowRequestLog
+from app.timing import StageTimer
+from app.tracing import (
+	configure_tracing,
+	record_span,
+	set_remote_parent,
+	span,
+	tracing_enabled,
+)
+from app.transport import CompressionMiddleware, NegotiatedRoute, encode_response
+from app.vault import MappingVault
 
 
 # PyTorch 関連の警告を無視
@@ -27,36 +67,463 @@ warnings.filterwarnings("ignore", category=UserWarning)
 # ロガーの取得
 logger = structlog.get_logger(__name__)
 
+# ルールのみで動作させる場合はspaCy/torchを読み込まない（サイドカー用途）
+RULES_ONLY = os.getenv("MASKING_RULES_ONLY", "").lower() in ("1", "true")
+
+# 本文をログに残すのは明示的に有効にした場合のみ（DEBUGレベルで出力）
+LOG_RAW_TEXT = os.getenv("MASKING_LOG_RAW_TEXT", "").lower() in ("1", "true")
+
 app = FastAPI(title="高度なテキストマスキングAPI")
+# Content-Type: application/msgpackのリクエスト本文も受け付ける
+app.router.route_class = NegotiatedRoute
+# 圧縮されたリクエスト本文の展開と、しきい値以上のレスポンスの圧縮
+app.add_middleware(
+	CompressionMiddleware,
+	minimum_size=int(os.getenv("MASKING_COMPRESS_MIN_BYTES", "1024")),
+	max_body_size=int(os.getenv("MASKING_MAX_BODY_BYTES", str(64 * 2**20))),
+)
 
+# MASKING_TRACE_PATHを指定するとスパンをJSONLファイルに出力
+configure_tracing(os.getenv("MASKING_TRACE_PATH"))
 
-@app.post("/mask_text", response_model=MaskingResponse)
-async def mask_text_endpoint(request: EnhancedMaskingRequest):
-	"""テキストマスキングエンドポイント"""
-	try:
-		masker = EnhancedTextMasker()
-		masked_text, entity_mapping, debug_info = masker.mask_text(
-			text=request.text,
-			categories=request.categories_to_mask,
-			mask_style=request.mask_style,
-			key_values_to_mask=request.key_values_to_mask,
-			values_to_mask=request.values_to_mask,
+# MASKING_PROFILE_DIRを指定した場合のみプロファイラーを有効にする
+PROFILE_DIR = os.getenv("MASKING_PROFILE_DIR")
+if PROFILE_DIR and threading.current_thread() is threading.main_thread():
+	install_signal_handler(
+		PROFILE_DIR, float(os.getenv("MASKING_PROFILE_SIGNAL_SECONDS", "30"))
+	)
+
+# /metricsで公開するメトリクス
+metrics = Registry()
+REQUESTS = metrics.counter(
+	"masking_http_requests_total", "HTTPリクエスト数", ("method", "path", "status")
+)
+ERRORS = metrics.counter(
+	"masking_http_errors_total", "5xxまたは例外で終了したリクエスト数", ("path",)
+)
+IN_FLIGHT = metrics.gauge("masking_http_in_flight_requests", "処理中のリクエスト数")
+REQUEST_LATENCY = metrics.histogram(
+	"masking_http_request_duration_seconds", "リクエストの処理時間", ("path",)
+)
+QUEUE_DEPTH = metrics.gauge(
+	"masking_queue_depth", "ワーカースレッドの空きを待っているマスキング処理の数"
+)
+STAGE_LATENCY = metrics.histogram(
+	"masking_stage_duration_seconds", "mask_textの処理段階ごとの所要時間", ("stage",)
+)
+TEXT_LENGTH = metrics.histogram(
+	"masking_text_length_chars",
+	"マスキング対象テキストの文字数",
+	buckets=(50, 100, 250, 500, 1000, 2000, 3000, 5000),
+)
+QUEUE_WAIT = metrics.histogram(
+	"masking_queue_wait_seconds", "マスキング処理がワーカースレッドを待った時間"
+)
+ENTITY_COUNT = metrics.histogram(
+	"masking_entities_per_request",
+	"1リクエストで検出されたエンティティ数",
+	buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+
+
+@lru_cache(maxsize=1)
+def get_masker() -> EnhancedTextMasker:
+	"""プロセス内で共有するマスカーを取得（モデルとキャッシュを再利用）"""
+	return EnhancedTextMasker(
+		enable_ner=not RULES_ONLY,
+		sentence_cache_path=os.getenv("MASKING_SENTENCE_CACHE_PATH"),
+		# 設定すると同じエンティティがリクエストやワーカーをまたいで同じトークンになる
+		token_secret=os.getenv("MASKING_TOKEN_SECRET"),
+	)
+
+
+def _read_masker_stat(read) -> float:
+	"""マスカーが構築済みの場合のみ統計値を読み出す（収集でモデルを読み込まない）"""
+	if get_masker.cache_info().currsize == 0:
+		return 0
+	return read(get_masker())
+
+
+def _register_component_metrics() -> None:
+	"""キャッシュや合流の統計値を収集時に読み出すメトリクスを登録"""
+	for name, documentation, read in [
+		(
+			"masking_ner_singleflight_executed_total",
+			"実行されたNER推論の数",
+			lambda masker: masker.ner_flight.executed,
+		),
+		(
+			"masking_ner_singleflight_coalesced_total",
+			"実行中の同一リクエストに合流したNER呼び出しの数",
+			lambda masker: masker.ner_flight.coalesced,
+		),
+		(
+			"masking_ner_cache_hits_total",
+			"NERキャッシュのヒット数",
+			lambda masker: masker.ner_cache.hits,
+		),
+		(
+			"masking_ner_cache_misses_total",
+			"NERキャッシュのミス数",
+			lambda masker: masker.ner_cache.misses,
+		),
+	]:
+		metrics.callback(
+			name, documentation, partial(_read_masker_stat, read), type_name="counter"
 		)
 
-		logger.info(
-			"mask_text",
+
+_register_component_metrics()
+
+
+class MetricsMiddleware:
+	"""
+	リクエスト数・エラー数・処理中の数・処理時間を記録
+
+	BaseHTTPMiddlewareはアプリケーションの例外時にもストリーミング
+	レスポンスを正常に完了させてしまうため、ASGIミドルウェアとして実装します。
+	"""
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+
+		IN_FLIGHT.inc()
+		start = time.perf_counter()
+		status = 500
+
+		async def send_with_status(message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_with_status)
+		except Exception:
+			status = 500
+			raise
+		finally:
+			IN_FLIGHT.dec()
+			path = getattr(scope.get("route"), "path", "unmatched")
+			REQUESTS.inc(method=scope["method"], path=path, status=status)
+			REQUEST_LATENCY.observe(time.perf_counter() - start, path=path)
+			if status >= 500:
+				ERRORS.inc(path=path)
+
+
+class TracingMiddleware:
+	"""リクエスト全体をルートスパンとして記録（traceparentヘッダーを引き継ぐ）"""
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http" or not tracing_enabled():
+			await self.app(scope, receive, send)
+			return
+
+		headers = Headers(scope=scope)
+		set_remote_parent(headers.get("traceparent"))
+		with span(f"{scope['method']} {scope['path']}") as root:
+
+			async def send_with_traceparent(message):
+				if message["type"] == "http.response.start":
+					route = scope.get("route")
+					if route is not None:
+						root.name = f"{scope['method']} {route.path}"
+					root.set_attribute("http.status_code", message["status"])
+					response_headers = MutableHeaders(scope=message)
+					response_headers["traceparent"] = root.traceparent()
+				await send(message)
+
+			await self.app(scope, receive, send_with_traceparent)
+
+
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+	"""Prometheus形式のメトリクスエンドポイント"""
+	return PlainTextResponse(
+		metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+	)
+
+
+class _QueuedCall:
+	"""
+	スレッドプールで実行を待つ呼び出し（作成時に待ち行列の数を増やす）
+
+	ワーカースレッドで実行が始まった時点で待ち行列の数を減らし、待ち時間を
+	記録します。待機中にキャンセルされた場合に備え、呼び出し側でも
+	release()を呼びます（減らすのは1回だけ）。
+	"""
+
+	def __init__(self, fn, timer: StageTimer):
+		self.fn = fn
+		self.timer = timer
+		self._queued_at = time.perf_counter()
+		self._queued_ns = time.time_ns()
+		self._released = False
+		self._lock = threading.Lock()
+		QUEUE_DEPTH.inc()
+
+	def release(self) -> bool:
+		"""待ち行列の数を減らす（既に減らしていればFalse）"""
+		with self._lock:
+			if self._released:
+				return False
+			self._released = True
+		QUEUE_DEPTH.dec()
+		return True
+
+	def __call__(self, **kwargs):
+		if self.release():
+			self.timer.queue_wait = time.perf_counter() - self._queued_at
+			record_span("queue", self._queued_ns, time.time_ns())
+		return self.fn(**kwargs)
+
+
+def _server_timing(timing: TimingInfo, serialize_ms: float) -> str:
+	"""Server-Timingヘッダーの値を作成"""
+	entries = [f"{stage};dur={ms:.2f}" for stage, ms in timing.stages_ms.items()]
+	entries.append(f"queue;dur={timing.queue_ms:.2f}")
+	entries.append(f"serialize;dur={serialize_ms:.2f}")
+	entries.append(f"total;dur={timing.total_ms + serialize_ms:.2f}")
+	return ", ".join(entries)
+
+
+@lru_cache(maxsize=1)
+def get_slow_log() -> SlowRequestLog | None:
+	"""
+	遅いリクエストのログ（MASKING_SLOW_LOG_MSにしきい値を指定した場合のみ有効）
+
+	本文のハッシュの鍵はMASKING_TOKEN_SECRETから導出し（トークン生成とは別の鍵）、
+	未設定の場合は記録しません。
+	"""
+	threshold_ms = float(os.getenv("MASKING_SLOW_LOG_MS", "0"))
+	if threshold_ms <= 0:
+		return None
+	hash_key = None
+	if secret := os.getenv("MASKING_TOKEN_SECRET"):
+		hash_key = hmac.new(secret.encode("utf-8"), b"slowlog", hashlib.sha256).digest()
+	slow_log = SlowRequestLog(
+		os.getenv("MASKING_SLOW_LOG_PATH", "log/slow.log"),
+		threshold_ms=threshold_ms,
+		hash_key=hash_key,
+	)
+	atexit.register(slow_log.close)
+	return slow_log
+
+
+def _record_slow_request(
+	method: str,
+	started: float,
+	request: EnhancedMaskingRequest,
+	debug_info: list[dict],
+	timer: StageTimer,
+	error: str | None = None,
+):
+	"""遅いリクエストと失敗したリクエストをスローログに記録"""
+	if (slow_log := get_slow_log()) is not None:
+		slow_log.maybe_record(
+			method,
+			(time.perf_counter() - started) * 1000,
+			request.text,
+			debug_info,
+			request.categories_to_mask,
+			request.mask_style,
+			timer,
+			error=error,
+		)
+
+
+def _log_texts(event: str, **fields):
+	"""
+	本文を含まない形でリクエストをログに記録
+
+	文字列の値は文字数と鍵付きハッシュ（スローログと同じ鍵）に置き換えます。
+	MASKING_LOG_RAW_TEXTを有効にした場合のみ、本文をDEBUGレベルで別途記録します。
+	"""
+	slow_log = get_slow_log()
+	summary = {}
+	for name, value in fields.items():
+		if not isinstance(value, str):
+			summary[name] = value
+			continue
+		summary[f"{name}_length"] = len(value)
+		if slow_log is not None and (digest := slow_log.content_hash(value)):
+			summary[f"{name}_hash"] = digest
+	logger.info(event, **summary)
+	if LOG_RAW_TEXT:
+		logger.debug(event, **fields)
+
+
+@lru_cache(maxsize=1)
+def get_decoder() -> EnhancedTextDecoder:
+	"""プロセス内で共有するデコーダーを取得（コンパイル済みマッピングを再利用）"""
+	return EnhancedTextDecoder()
+
+
+@lru_cache(maxsize=1)
+def get_vault() -> MappingVault:
+	"""マッピング保管庫を取得（MASKING_VAULT_PATHを指定するとSQLiteに保存）"""
+	return MappingVault(
+		ttl=float(os.getenv("MASKING_VAULT_TTL", "3600")),
+		path=os.getenv("MASKING_VAULT_PATH"),
+	)
+
+
+@lru_cache(maxsize=1)
+def get_session_store() -> SessionStore:
+	"""マスキングセッションのストアを取得"""
+	return SessionStore(
+		ttl=float(os.getenv("MASKING_SESSION_TTL", "1800")),
+		max_sessions=int(os.getenv("MASKING_SESSION_MAX", "1000")),
+		max_entries=int(os.getenv("MASKING_SESSION_MAX_ENTRIES", "10000")),
+	)
+
+
+def _get_session(session_id: str):
+	try:
+		return get_session_store().get(session_id)
+	except SessionNotFoundError:
+		raise HTTPException(
+			status_code=404, detail="セッションが見つからないか有効期限切れです。"
+		) from None
+
+
+@app.post("/sessions", response_model=SessionResponse)
+async def create_session_endpoint():
+	"""トークン表を共有するマスキングセッションを作成"""
+	store = get_session_store()
+	session = store.create()
+	return SessionResponse(session_id=session.session_id, ttl=store.ttl)
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session_endpoint(session_id: str):
+	"""マスキングセッションを削除"""
+	if not get_session_store().delete(session_id):
+		raise HTTPException(status_code=404, detail="セッションが見つかりません。")
+	return {"deleted": session_id}
+
+
+async def _run_masking(
+	request: EnhancedMaskingRequest, method: str, accept: str | None, **kwargs
+) -> MaskingResponse:
+	"""
+	マスカーのmethodを実行してレスポンスを作成（セッションと保管庫に対応）
+
+	Acceptヘッダーがmsgpackを求めている場合はmsgpackで返します。
+	"""
+	started = time.perf_counter()
+	session = _get_session(request.session_id) if request.session_id else None
+	try:
+		mask = getattr(get_masker(), method)
+		# セッション指定時はトークン表を共有し、新しいマッピングのみ返す
+		if session is not None:
+			mask = partial(session.mask, mask)
+		timer = StageTimer()
+		# 推論中もイベントループを止めず、同一テキストの同時リクエストを合流させる
+		queued = _QueuedCall(mask, timer)
+		try:
+			masked_text, entity_mapping, debug_info = await run_in_threadpool(
+				queued,
+				text=request.text,
+				categories=request.categories_to_mask,
+				mask_style=request.mask_style,
+				key_values_to_mask=request.key_values_to_mask,
+				values_to_mask=request.values_to_mask,
+				timer=timer,
+				**kwargs,
+			)
+		except Exception as e:
+			# タイムアウトなどで失敗したリクエストもスローログに残す
+			_record_slow_request(method, started, request, [], timer, type(e).__name__)
+			raise
+		finally:
+			# 待機中にキャンセルされた場合はワーカーで減らされないため、ここで減らす
+			queued.release()
+		for stage, seconds in timer.durations.items():
+			STAGE_LATENCY.observe(seconds, stage=stage)
+		QUEUE_WAIT.observe(timer.queue_wait)
+		TEXT_LENGTH.observe(len(request.text))
+		ENTITY_COUNT.observe(len(debug_info))
+		_record_slow_request(method, started, request, debug_info, timer)
+
+		_log_texts(
+			method,
 			original_text=request.text,
 			masked_text=masked_text,
+			entity_count=len(debug_info),
 			categories=request.categories_to_mask,
 			mask_style=request.mask_style,
 		)
 
-		return MaskingResponse(
-			masked_text=masked_text,
-			entity_mapping=entity_mapping,
-			debug_info=DebugInfo(detected_entities=debug_info),
+		mapping_handle = None
+		if request.store_mapping:
+			mapping_handle = get_vault().put(entity_mapping, ttl=request.mapping_ttl)
+
+		timing = None
+		if request.include_timing:
+			timing = TimingInfo(
+				stages_ms={
+					stage: seconds * 1000 for stage, seconds in timer.durations.items()
+				},
+				queue_ms=timer.queue_wait * 1000,
+				total_ms=(time.perf_counter() - started) * 1000,
+			)
+
+		# シリアライズの時間を計測・トレースできるよう、ここでエンコードして返す
+		as_msgpack = accepts_msgpack(accept)
+		with span("serialize"):
+			serialize_start = time.perf_counter()
+			if request.response_format == "compact":
+				# pydanticのモデルを経由せず、列形式の辞書を直接エンコード
+				payload = compact_masking_payload(
+					masked_text,
+					entity_mapping,
+					debug_info if request.include_debug_info else None,
+					mapping_handle,
+					timing.model_dump() if timing is not None else None,
+				)
+				body = packb(payload) if as_msgpack else dumps(payload)
+			else:
+				response = MaskingResponse(
+					masked_text=masked_text,
+					entity_mapping=entity_mapping,
+					debug_info=DebugInfo(detected_entities=debug_info),
+					mapping_handle=mapping_handle,
+					timing=timing,
+				)
+				body = (
+					packb(response.model_dump())
+					if as_msgpack
+					else response.model_dump_json()
+				)
+			serialize_ms = (time.perf_counter() - serialize_start) * 1000
+		headers = {}
+		if timing is not None:
+			headers["Server-Timing"] = _server_timing(timing, serialize_ms)
+		return Response(
+			content=body,
+			media_type=MSGPACK_MEDIA_TYPE if as_msgpack else JSON_MEDIA_TYPE,
+			headers=headers,
 		)
 
+	except RuleMatchTimeoutError as e:
+		logger.error("ルールマッチングがタイムアウトしました", error=str(e))
+		raise HTTPException(status_code=422, detail=str(e)) from None
+	except SessionLimitError as e:
+		logger.warning("セッションの上限に達しました", session_id=request.session_id)
+		raise HTTPException(status_code=409, detail=str(e)) from None
 	except FileNotFoundError:
 		logger.error("ルールファイルが見つかりません", rules_file=request.text)
 		raise HTTPException(
@@ -69,21 +536,69 @@ async def mask_text_endpoint(request: EnhancedMaskingRequest):
 		) from e
 
 
+@app.post("/mask_text", response_model=MaskingResponse)
+async def mask_text_endpoint(
+	request: EnhancedMaskingRequest, accept: str | None = Header(None)
+):
+	"""テキストマスキングエンドポイント"""
+	return await _run_masking(request, "mask_text", accept)
+
+
+@app.post("/remask_text", response_model=MaskingResponse)
+async def remask_text_endpoint(
+	request: RemaskRequest, accept: str | None = Header(None)
+):
+	"""編集後のテキストを前回の結果を再利用してマスキングするエンドポイント"""
+	previous = request.previous_result
+	return await _run_masking(
+		request,
+		"remask_text",
+		accept,
+		previous_text=request.previous_text,
+		previous_entities=[
+			e.model_dump() for e in previous.debug_info.detected_entities
+		],
+		previous_mapping=previous.entity_mapping,
+	)
+
+
+async def _resolve_mapping(source: MappingSource) -> dict[str, dict[str, str]]:
+	"""リクエストで指定されたマッピングを取得"""
+	if source.entity_mapping is not None:
+		return source.entity_mapping
+	if source.session_id is not None:
+		# セッションのロックはマスキング中も保持されるため、スレッドプールで待つ
+		session = _get_session(source.session_id)
+		return await run_in_threadpool(session.mapping_snapshot)
+	entity_mapping = get_vault().get(source.mapping_handle)
+	if entity_mapping is None:
+		raise HTTPException(
+			status_code=404, detail="マッピングが見つからないか有効期限切れです。"
+		)
+	return entity_mapping
+
+
 @app.post("/decode_text", response_model=DecodeResponse)
-async def decode_text_endpoint(request: DecodeRequest):
+async def decode_text_endpoint(
+	request: DecodeRequest, accept: str | None = Header(None)
+):
 	"""テキストデコードエンドポイント"""
-	print("####")
-	print(request)
-	print("####")
+	entity_mapping = await _resolve_mapping(request)
 	try:
-		decoder = EnhancedTextDecoder()
-		decoded_text = decoder.decode_text(request.masked_text, request.entity_mapping)
+		decoder = get_decoder()
+		decoded_text = decoder.decode_text(request.masked_text, entity_mapping)
 
-		logger.info(
-			"decode_text", masked_text=request.masked_text, decoded_text=decoded_text
+		_log_texts(
+			"decode_text",
+			masked_text=request.masked_text,
+			decoded_text=decoded_text,
+			entity_count=len(entity_mapping),
 		)
 
-		return DecodeResponse(decoded_text=decoded_text)
+		response = DecodeResponse(decoded_text=decoded_text)
+		if accepts_msgpack(accept):
+			return encode_response(response.model_dump(), accept)
+		return response
 
 	except Exception as e:
 		logger.error("デコード処理中にエラーが発生しました", error=str(e))
@@ -92,10 +607,139 @@ async def decode_text_endpoint(request: DecodeRequest):
 		) from e
 
 
+@app.post("/decode_batch", response_model=BatchDecodeResponse)
+async def decode_batch_endpoint(
+	request: BatchDecodeRequest, accept: str | None = Header(None)
+):
+	"""複数のテキストをまとめてデコードするエンドポイント（結果は入力順）"""
+	shared = request.shared_source()
+	shared_mapping = await _resolve_mapping(shared) if shared is not None else None
+	decoder = get_decoder()
+
+	def decode_all() -> list[str]:
+		# 同じ内容のマッピングはデコーダーのキャッシュで1回だけコンパイルされる
+		shared_compiled = (
+			decoder.compile(shared_mapping) if shared_mapping is not None else None
+		)
+		return [
+			(
+				decoder.compile(item.entity_mapping)
+				if item.entity_mapping is not None
+				else shared_compiled
+			).decode(item.masked_text)
+			for item in request.items
+		]
+
+	try:
+		decoded_texts = await run_in_threadpool(decode_all)
+	except Exception as e:
+		logger.error("一括デコード処理中にエラーが発生しました", error=str(e))
+		raise HTTPException(
+			status_code=500, detail="デコード処理中に予期しないエラーが発生しました。"
+		) from e
+
+	logger.info("decode_batch", items=len(request.items))
+	response = BatchDecodeResponse(decoded_texts=decoded_texts)
+	if accepts_msgpack(accept):
+		return encode_response(response.model_dump(), accept)
+	return response
+
+
+async def _iter_ndjson_lines(chunks):
+	"""バイト列のストリームをNDJSONの行単位に分割"""
+	buffer = b""
+	async for chunk in chunks:
+		buffer += chunk
+		*lines, buffer = buffer.split(b"\n")
+		for line in lines:
+			if line.strip():
+				yield line
+	if buffer.strip():
+		yield buffer
+
+
+@app.post("/decode_stream")
+async def decode_stream_endpoint(request: Request):
+	"""
+	ストリーミングデコードエンドポイント
+
+	リクエストボディはNDJSONで、1行目にマッピングの指定
+	（entity_mapping、mapping_handle、session_idのいずれか）、
+	2行目以降に{"text": "..."}形式のチャンクを送ります。
+	デコード済みのテキストは確定した時点から順次返されます。
+	不正なチャンクを受け取った場合は、切り詰めた結果が正常な応答と
+	区別できるよう、レスポンスを完了させずに打ち切ります。
+	"""
+	lines = _iter_ndjson_lines(request.stream())
+	try:
+		source = MappingSource.model_validate_json(await anext(lines))
+	except (StopAsyncIteration, ValidationError) as e:
+		raise HTTPException(
+			status_code=422, detail="1行目にマッピングを指定してください。"
+		) from e
+	decoder = get_decoder().compile(await _resolve_mapping(source)).streaming()
+
+	async def decoded_chunks():
+		async for line in lines:
+			try:
+				text = json.loads(line)["text"]
+			except (ValueError, KeyError, TypeError) as e:
+				logger.error("ストリーミングデコードのチャンクが不正です")
+				raise ValueError("ストリーミングデコードのチャンクが不正です。") from e
+			decoded = decoder.feed(text)
+			if decoded:
+				yield decoded
+		yield decoder.flush()
+
+	return StreamingResponse(decoded_chunks(), media_type="text/plain; charset=utf-8")
+
+
+@app.post("/admin/profile")
+async def profile_endpoint(seconds: float = Query(10, gt=0, le=300)):
+	"""
+	このワーカーでseconds秒間サンプリングプロファイルを採取するエンドポイント
+
+	MASKING_PROFILE_DIRが設定されている場合のみ有効です。結果は
+	折り畳みスタック形式（flamegraph.pl、speedscope対応）で保存されます。
+	"""
+	if not PROFILE_DIR:
+		raise HTTPException(status_code=404, detail="Not Found")
+	path = os.path.join(
+		PROFILE_DIR, f"profile-{os.getpid()}-{time.strftime('%Y%m%d_%H%M%S')}.txt"
+	)
+	try:
+		return await run_in_threadpool(profile_for, seconds, path)
+	except RuntimeError as e:
+		raise HTTPException(status_code=409, detail=str(e)) from None
+
+
+@app.get("/cache_stats")
+async def cache_stats_endpoint():
+	"""キャッシュとプレフィルタの統計情報エンドポイント"""
+	masker = get_masker()
+	return {
+		"ner_cache": masker.ner_cache.stats(),
+		"sentence_cache": (
+			masker.sentence_cache.stats() if masker.sentence_cache else None
+		),
+		"rule_prefilter": masker.rule_masker.prefilter_counts(),
+		"ner_singleflight": masker.ner_flight.stats(),
+		"decoder": get_decoder().compiled_cache.stats(),
+		"mapping_vault": get_vault().stats(),
+		"sessions": get_session_store().stats(),
+	}
+
+
 if __name__ == "__main__":
 	# APIサーバー起動
 	rules_file_path = "masking_rules.json"
 	if not os.path.exists(rules_file_path):
 		logger.error("ルールファイルが見つかりません", rules_file=rules_file_path)
 		exit(1)
-	uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
+	# MASKING_SOCKET_PATHを指定すると同じホストのクライアント向けに
+	# TCPの代わりにUnixドメインソケットで待ち受ける
+	socket_path = os.getenv("MASKING_SOCKET_PATH")
+	if socket_path:
+		uvicorn.run("server:app", uds=socket_path, reload=True)
+	else:
+		uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
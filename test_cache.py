@@ -0,0 +1,172 @@
+import threading
+import time
+
+from app.cache import LRUCache
+from app.masking import EnhancedTextMasker
+from app.sentence_cache import SentenceEntityCache
+from app.sentences import split_sentences
+from app.vault import MappingVault
+
+
+def test_lru_cache_counters():
+	cache = LRUCache(maxsize=2)
+	cache.put("a", 1)
+	cache.put("b", 2)
+	assert cache.get("a") == 1
+	cache.put("c", 3)  # "b" が追い出される
+	assert cache.get("b") is None
+	assert cache.stats() == {
+		"size": 2,
+		"maxsize": 2,
+		"hits": 1,
+		"misses": 1,
+		"evictions": 1,
+	}
+
+
+def test_ner_cache_shared_across_options(monkeypatch):
+	masker = EnhancedTextMasker(enable_ner=False)
+	calls = []
+
+	def fake_run_ner(processed_text):
+		calls.append(processed_text)
+		return (("山田太郎", "Person", 0, 4),)
+
+	masker.nlp = object()  # NERが有効な状態を模擬
+	monkeypatch.setattr(masker, "_run_ner", fake_run_ner)
+
+	masked, _, _ = masker.mask_text("山田太郎です", mask_style="descriptive")
+	assert masked.startswith("人物_")
+	masked, _, _ = masker.mask_text("山田太郎です", mask_style="simple")
+	assert masked.startswith("PERSON_")
+	masker.mask_text("山田太郎です", categories=["ORG"])
+
+	assert len(calls) == 1
+	assert masker.ner_cache.hits == 2
+
+
+def test_sentence_cache_roundtrip_and_invalidation(tmp_path):
+	path = str(tmp_path / "ner.sqlite")
+	cache = SentenceEntityCache(path, fingerprint="v1")
+	cache.put_many({"山田です。": [("山田", "Person", 0, 2)]})
+	assert cache.get_many(["山田です。", "未登録"]) == {
+		"山田です。": [("山田", "Person", 0, 2)]
+	}
+	cache.close()
+
+	# 別プロセスを模擬して同じファイルを開き直す
+	assert SentenceEntityCache(path, fingerprint="v1").get_many(["山田です。"])
+	assert SentenceEntityCache(path, fingerprint="v2").get_many(["山田です。"]) == {}
+
+
+def test_sentence_cache_evicts_by_size(tmp_path):
+	cache = SentenceEntityCache(str(tmp_path / "ner.sqlite"), "v1", max_bytes=200)
+	for i in range(20):
+		cache.put_many({f"文{i}。": [("山田", "Person", 0, 2)]})
+	assert cache.total_size() <= 200
+	assert cache.evictions > 0
+	assert cache.get_many(["文19。"])
+
+
+def test_ner_by_sentence_only_runs_uncached(tmp_path):
+	class FakeEnt:
+		def __init__(self, text, start):
+			self.text, self.label_ = text, "Person"
+			self.start_char, self.end_char = start, start + len(text)
+
+	class FakeDoc:
+		def __init__(self, text):
+			start = text.find("山田")
+			self.ents = [FakeEnt("山田", start)] if start >= 0 else []
+
+	class FakeNlp:
+		def __init__(self):
+			self.seen = []
+
+		def pipe(self, texts):
+			self.seen.extend(texts)
+			return [FakeDoc(t) for t in texts]
+
+	masker = EnhancedTextMasker(enable_ner=False)
+	masker.nlp = FakeNlp()
+	masker.sentence_cache = SentenceEntityCache(str(tmp_path / "ner.sqlite"), "v1")
+
+	text = "こんにちは。山田です。\n明日は山田と会議。"
+	spans = masker._run_ner_by_sentence(text)
+	assert [text[s:e] for _, _, s, e in spans] == ["山田", "山田"]
+	assert len(split_sentences(text)) == 4
+
+	masker.nlp.seen.clear()
+	edited = "こんにちは。山田です。\n明後日は山田と会議。"
+	spans = masker._run_ner_by_sentence(edited)
+	assert masker.nlp.seen == ["明後日は山田と会議。"]
+	assert [edited[s:e] for _, _, s, e in spans] == ["山田", "山田"]
+
+
+def test_concurrent_identical_requests_share_inference(monkeypatch):
+	masker = EnhancedTextMasker(enable_ner=False)
+	calls = []
+
+	def slow_run_ner(processed_text):
+		calls.append(processed_text)
+		time.sleep(0.2)
+		return (("山田太郎", "Person", 0, 4),)
+
+	masker.nlp = object()
+	monkeypatch.setattr(masker, "_run_ner", slow_run_ner)
+
+	results = []
+
+	def worker():
+		results.append(masker.mask_text("山田太郎です")[:2])
+
+	threads = [threading.Thread(target=worker) for _ in range(4)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert len(calls) == 1
+	assert masker.ner_flight.stats()["coalesced"] == 3
+	# 検出結果は共有するがトークンは呼び出しごとに発行される
+	assert len({masked for masked, _ in results}) == 4
+	assert all(masked.endswith("です") for masked, _ in results)
+
+
+def test_mapping_vault_expires(tmp_path, monkeypatch):
+	for path in (None, str(tmp_path / "vault.sqlite")):
+		vault = MappingVault(ttl=10, path=path, purge_interval=0)
+		handle = vault.put({"<<人物_1>>": {"original_text": "山田"}})
+		assert vault.get(handle) == {"<<人物_1>>": {"original_text": "山田"}}
+
+		now = time.time()
+		monkeypatch.setattr(time, "time", lambda now=now: now + 11)
+		assert vault.get(handle) is None
+		assert vault.stats()["size"] == 0
+		monkeypatch.undo()
+
+
+def test_ner_inference_is_serialized():
+	class FakeNlp:
+		def __init__(self):
+			self.active = self.peak = 0
+
+		def __call__(self, text):
+			self.active += 1
+			self.peak = max(self.peak, self.active)
+			time.sleep(0.05)
+			self.active -= 1
+			return type("FakeDoc", (), {"ents": []})()
+
+	masker = EnhancedTextMasker(enable_ner=False)
+	masker.nlp = FakeNlp()
+
+	threads = [
+		threading.Thread(target=masker._run_ner, args=(f"文{i}",)) for i in range(4)
+	]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert masker.nlp.peak == 1
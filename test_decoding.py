@@ -0,0 +1,31 @@
+from app.decoding import EnhancedTextDecoder
+
+
+MAPPING = {
+	"人物_1": {"masked_text": "人物_1", "original_text": "山田"},
+	"人物_12": {"masked_text": "人物_12", "original_text": "佐藤"},
+	"組織_ab": {"masked_text": "組織_ab", "original_text": "株式会社A"},
+}
+
+
+def test_decode_prefers_longest_token():
+	decoder = EnhancedTextDecoder()
+	decoded = decoder.decode_text("人物_12と人物_1は組織_abの社員", MAPPING)
+	assert decoded == "佐藤と山田は株式会社Aの社員"
+
+
+def test_compiled_mapping_is_cached():
+	decoder = EnhancedTextDecoder()
+	for text in ["人物_1", "組織_ab", "なし"]:
+		decoder.decode_text(text, dict(MAPPING))
+	assert decoder.compiled_cache.stats()["misses"] == 1
+	assert decoder.compiled_cache.stats()["hits"] == 2
+
+
+def test_streaming_decoder_handles_split_tokens():
+	stream = EnhancedTextDecoder().compile(MAPPING).streaming()
+	chunks = ["人", "物_1", "2と人物_", "1は組", "織_abの", "社員"]
+	outputs = [stream.feed(chunk) for chunk in chunks]
+	# 「人物_1」は「人物_12」の接頭辞なので次のチャンクまで保留される
+	assert outputs[:2] == ["", ""]
+	assert "".join(outputs) + stream.flush() == "佐藤と山田は株式会社Aの社員"
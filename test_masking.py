@@ -1,5 +1,9 @@
+import subprocess
+import sys
+
 import pytest
 
+from app.decoding import EnhancedTextDecoder
 from app.masking import EnhancedTextMasker
 
 
@@ -41,3 +45,96 @@ def test_masking_case3(masker):
 	assert "<<役職_1>" in masked_text
 	assert "<<人物_2>" in masked_text
 	assert "<<組織_3>" in masked_text
+
+
+def test_rules_only_does_not_import_ner_stack():
+	code = (
+		"import sys\n"
+		"from app.decoding import EnhancedTextDecoder\n"
+		"from app.masking import EnhancedTextMasker\n"
+		"from app.postprocessing import remove_overlapping_entities\n"
+		"masker = EnhancedTextMasker(enable_ner=False)\n"
+		"masked, mapping, debug = masker.mask_text('代表取締役、山田')\n"
+		"assert '役職_' in masked, masked\n"
+		"assert 'spacy' not in sys.modules and 'torch' not in sys.modules\n"
+	)
+	subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def _detected_spans(debug: list[dict]) -> list[tuple]:
+	return [
+		(d["original"], d["category"], d["position"]["start"], d["source"])
+		for d in debug
+	]
+
+
+def test_custom_entities_single_pass_equivalent(masker):
+	# 以前のパイプライン（custom_entitiesをentity_rulerにも登録）を再現
+	legacy = EnhancedTextMasker()
+	ruler = legacy.nlp.add_pipe("entity_ruler", before="ner")
+	ruler.add_patterns(
+		[
+			{"label": label, "pattern": term}
+			for label, terms in legacy.rule_masker.rules["rules"][
+				"custom_entities"
+			].items()
+			for term in terms
+		]
+	)
+	assert len(ruler) > 0
+
+	cases = [
+		("株式会社テクノロジーズの山田太郎部長（メール：test@example.com）", None),
+		("東京都渋谷区の本社オフィス", ["ORG", "PERSON", "LOCATION", "POSITION"]),
+		(
+			"代表取締役の田中一郎氏は、Project-Xの成功を報告しました。",
+			["ORG", "PERSON", "LOCATION", "POSITION"],
+		),
+		("株式会社Lightblue(代表取締役:園田亜斗夢、本社:東京都千代田区)", None),
+	]
+	for text, categories in cases:
+		_, _, debug = masker.mask_text(text, categories=categories)
+		_, _, legacy_debug = legacy.mask_text(text, categories=categories)
+		assert _detected_spans(debug) == _detected_spans(legacy_debug)
+
+
+def test_keyed_tokens_are_deterministic():
+	text = "代表取締役、山田"
+	first = EnhancedTextMasker(enable_ner=False, token_secret="secret")
+	second = EnhancedTextMasker(enable_ner=False, token_secret="secret")
+	other = EnhancedTextMasker(enable_ner=False, token_secret="another")
+
+	masked, mapping, _ = first.mask_text(text)
+	assert mapping
+	assert all(len(token.rsplit("_", 1)[1]) == 16 for token in mapping)
+	assert second.mask_text(text)[0] == masked
+	assert first.mask_text(text)[0] == masked
+	assert other.mask_text(text)[0] != masked
+
+	random_masker = EnhancedTextMasker(enable_ner=False)
+	assert random_masker.mask_text(text)[0] != random_masker.mask_text(text)[0]
+
+
+def test_colliding_token_ids_are_reassigned(monkeypatch):
+	text = "代表取締役、部長"
+	keyed = EnhancedTextMasker(enable_ner=False, token_secret="secret")
+	digest = keyed._keyed_digest
+	# 先頭16文字が必ず衝突するHMACに差し替える
+	monkeypatch.setattr(
+		keyed,
+		"_keyed_digest",
+		lambda category, value: "0" * 16 + digest(category, value),
+	)
+	random_masker = EnhancedTextMasker(enable_ner=False)
+	monkeypatch.setattr(
+		random_masker, "generate_mask_token", iter(["a" * 8] * 2 + ["b" * 8]).__next__
+	)
+
+	for masker_ in (keyed, random_masker):
+		masked, mapping, _ = masker_.mask_text(text)
+		assert len(mapping) == 2
+		assert sorted(e["original_text"] for e in mapping.values()) == [
+			"代表取締役",
+			"部長",
+		]
+		assert EnhancedTextDecoder().decode_text(masked, mapping) == text
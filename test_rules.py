@@ -0,0 +1,107 @@
+import json
+import re
+import threading
+
+import pytest
+
+from app.prefilter import derive_prefilter
+from app.regex_safety import analyze_pattern
+from app.rules_loader import (
+	RuleBasedMasker,
+	RuleMatchTimeoutError,
+	UnsafePatternError,
+)
+
+
+@pytest.fixture(scope="module")
+def rule_masker():
+	return RuleBasedMasker("masking_rules.json")
+
+
+def _write_rules(tmp_path, safe_patterns):
+	with open("masking_rules.json", encoding="utf-8") as f:
+		rules = json.load(f)
+	rules["exclusions"]["safe_patterns"] = safe_patterns
+	rules_file = tmp_path / "rules.json"
+	rules_file.write_text(json.dumps(rules, ensure_ascii=False), encoding="utf-8")
+	return str(rules_file)
+
+
+def test_analyze_pattern_detects_backtracking():
+	assert analyze_pattern(r"(\w+\s?)*$")[0].severity == "exponential"
+	assert analyze_pattern(r"[\w\s]+株式会社")[0].severity == "polynomial"
+	assert analyze_pattern(r"\d{2,4}-\d{2,4}-\d{4}") == []
+
+
+def test_unsafe_pattern_rejected_at_load(tmp_path):
+	with pytest.raises(UnsafePatternError):
+		RuleBasedMasker(_write_rules(tmp_path, [r"(a+)+$"]))
+
+
+def test_match_timeout(rule_masker):
+	masker = RuleBasedMasker("masking_rules.json", match_timeout=0)
+	with pytest.raises(RuleMatchTimeoutError):
+		masker._find_matches("代表取締役の山田部長")
+
+
+def test_re2_engine_matches_re(rule_masker):
+	pytest.importorskip("re2")
+	re2_masker = RuleBasedMasker("masking_rules.json", regex_engine="re2")
+	texts = [
+		"代表取締役の山田部長（開発部）",
+		"株式会社Lightblue、園田亜斗夢。部長 課長",
+		"部長部長 LIGHTBLUE:Lightblue",
+	]
+	for text in texts:
+		expected = [e.__dict__ for e in rule_masker._find_matches(text)]
+		assert [e.__dict__ for e in re2_masker._find_matches(text)] == expected
+
+
+def test_derive_prefilter():
+	assert derive_prefilter(r"\d{2,4}-\d{4}").may_match("03-1234")
+	assert not derive_prefilter(r"[\w.]+@[\w.]+").may_match("メールなし")
+	assert derive_prefilter(r"Lightblue", re.IGNORECASE).may_match("LIGHTBLUE")
+	assert derive_prefilter(r"(?:ab|cd)") is None
+
+
+def test_prefilter_skips_groups(rule_masker):
+	rule_masker.prefilter_stats.clear()
+	matches = rule_masker._find_matches("本日は晴天なり")
+	assert matches == []
+	stats = rule_masker.prefilter_stats
+	assert stats["groups_skipped"] == stats["groups_checked"]
+	assert stats["scans_run"] == 0
+	assert stats["scans_skipped"] > 0
+
+
+def test_prefilter_counts_under_concurrency(rule_masker):
+	text = "代表取締役の山田部長（開発部）"
+	rule_masker.prefilter_stats.clear()
+	rule_masker._find_matches(text)
+	single = rule_masker.prefilter_counts()
+
+	rule_masker.prefilter_stats.clear()
+	threads = [
+		threading.Thread(
+			target=lambda: [rule_masker._find_matches(text) for _ in range(50)]
+		)
+		for _ in range(8)
+	]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert rule_masker.prefilter_counts() == {k: v * 400 for k, v in single.items()}
+
+
+def test_find_matches_batch_matches_single(rule_masker):
+	texts = [
+		"代表取締役の山田部長（開発部）",
+		"",
+		"部長",
+		"株式会社Lightblue、園田亜斗夢。\n部長 課長",
+		"特になし",
+	]
+	expected = [[e.__dict__ for e in rule_masker._find_matches(text)] for text in texts]
+	batch = rule_masker.find_matches_batch(texts)
+	assert [[e.__dict__ for e in matches] for matches in batch] == expected
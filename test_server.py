@@ -0,0 +1,529 @@
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+
+
+os.environ.setdefault("MASKING_RULES_ONLY", "1")
+
+import server  # noqa: E402
+from app import compression, serialization  # noqa: E402
+from app.api_client import MaskingClient  # noqa: E402
+from app.logger_config import truncate_fields  # noqa: E402
+from app.rules_loader import RuleMatchTimeoutError  # noqa: E402
+from app.slowlog import SlowRequestLog  # noqa: E402
+from app.timing import StageTimer  # noqa: E402
+from app.tracing import configure_tracing  # noqa: E402
+from app.transport import CompressionMiddleware  # noqa: E402
+from app.utils import convert_masking_response_to_decode_request  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def client():
+	return TestClient(server.app)
+
+
+def test_decode_with_mapping_handle(client):
+	masked = client.post(
+		"/mask_text", json={"text": "代表取締役、山田", "store_mapping": True}
+	).json()
+	handle = masked["mapping_handle"]
+	assert handle
+
+	response = client.post(
+		"/decode_text",
+		json={"masked_text": masked["masked_text"], "mapping_handle": handle},
+	)
+	assert response.status_code == 200
+	assert response.json()["decoded_text"] == "代表取締役、山田"
+
+	response = client.post(
+		"/decode_text", json={"masked_text": "x", "mapping_handle": "unknown"}
+	)
+	assert response.status_code == 404
+
+
+def test_session_reuses_tokens(client):
+	session_id = client.post("/sessions").json()["session_id"]
+
+	first = client.post(
+		"/mask_text", json={"text": "代表取締役、山田", "session_id": session_id}
+	).json()
+	second = client.post(
+		"/mask_text",
+		json={"text": "本日、代表取締役、佐藤", "session_id": session_id},
+	).json()
+	(token,) = first["entity_mapping"]
+	assert token in second["masked_text"]
+	assert second["entity_mapping"] == {}
+
+	response = client.post(
+		"/decode_text",
+		json={"masked_text": second["masked_text"], "session_id": session_id},
+	)
+	assert response.json()["decoded_text"] == "本日、代表取締役、佐藤"
+
+	assert client.delete(f"/sessions/{session_id}").status_code == 200
+	response = client.post(
+		"/mask_text", json={"text": "代表取締役", "session_id": session_id}
+	)
+	assert response.status_code == 404
+
+
+def test_remask_reuses_unchanged_sentences(client, monkeypatch):
+	previous_text = "代表取締役、山田。\n部長、佐藤。"
+	previous = client.post("/mask_text", json={"text": previous_text}).json()
+
+	masker = server.get_masker()
+	detected = []
+	original = masker._detect_entities
+
+	def spy(processed_text, *args):
+		detected.append(processed_text)
+		return original(processed_text, *args)
+
+	monkeypatch.setattr(masker, "_detect_entities", spy)
+	response = client.post(
+		"/remask_text",
+		json={
+			"text": "代表取締役、山田。\n課長、佐藤。",
+			"previous_text": previous_text,
+			"previous_result": previous,
+		},
+	).json()
+
+	assert detected == ["課長、佐藤。"]
+	first_sentence = previous["masked_text"].split("。")[0]
+	assert response["masked_text"].startswith(first_sentence + "。")
+	assert "課長" not in response["masked_text"]
+
+
+def test_remask_reuses_match_after_newline(client, monkeypatch):
+	# ルールの一致範囲は直前の改行を含み、改行だけの文にまたがる
+	previous_text = "はじめに。\n課長、山田です。"
+	previous = client.post("/mask_text", json={"text": previous_text}).json()
+	assert previous["debug_info"]["detected_entities"][0]["original"] == "\n課長"
+
+	masker = server.get_masker()
+	detected = []
+	original = masker._detect_entities
+
+	def spy(processed_text, *args):
+		detected.append(processed_text)
+		return original(processed_text, *args)
+
+	monkeypatch.setattr(masker, "_detect_entities", spy)
+	text = "はじめに。\n\n課長、山田です。"
+	response = client.post(
+		"/remask_text",
+		json={
+			"text": text,
+			"previous_text": previous_text,
+			"previous_result": previous,
+		},
+	).json()
+
+	assert detected == ["\n\n"]
+	assert "課長" not in response["masked_text"]
+	decoded = client.post(
+		"/decode_text",
+		json={
+			"masked_text": response["masked_text"],
+			"entity_mapping": response["entity_mapping"],
+		},
+	).json()
+	assert decoded["decoded_text"] == text
+
+
+def test_decode_stream(client):
+	mapping = {"人物_1": {"masked_text": "人物_1", "original_text": "山田"}}
+	lines = [
+		{"entity_mapping": mapping},
+		{"text": "こんにちは人"},
+		{"text": "物_1さん"},
+	]
+	body = "\n".join(json.dumps(line, ensure_ascii=False) for line in lines)
+	response = client.post("/decode_stream", content=body.encode())
+	assert response.status_code == 200
+	assert response.text == "こんにちは山田さん"
+
+	# 不正なチャンクではレスポンスを正常に完了させない
+	with pytest.raises(ValueError):
+		client.post("/decode_stream", content=body.encode() + b"\nnot json")
+
+
+def test_decode_batch_shared_and_per_item(client):
+	shared = {"人物_1": {"masked_text": "人物_1", "original_text": "山田"}}
+	other = {"人物_1": {"masked_text": "人物_1", "original_text": "佐藤"}}
+	response = client.post(
+		"/decode_batch",
+		json={
+			"entity_mapping": shared,
+			"items": [
+				{"masked_text": "人物_1さん"},
+				{"masked_text": "人物_1さん", "entity_mapping": other},
+				{"masked_text": "こんにちは人物_1"},
+			],
+		},
+	)
+	assert response.json()["decoded_texts"] == [
+		"山田さん",
+		"佐藤さん",
+		"こんにちは山田",
+	]
+
+	response = client.post("/decode_batch", json={"items": [{"masked_text": "x"}]})
+	assert response.status_code == 422
+
+
+def test_decode_batch_with_empty_shared_mapping(client):
+	# エンティティのないテキストや新しいセッションのマッピングは空になる
+	response = client.post(
+		"/decode_batch",
+		json={"entity_mapping": {}, "items": [{"masked_text": "こんにちは"}]},
+	)
+	assert response.status_code == 200
+	assert response.json()["decoded_texts"] == ["こんにちは"]
+
+
+def test_metrics_endpoint(client):
+	client.post("/mask_text", json={"text": "代表取締役、山田"})
+	body = client.get("/metrics").text
+	assert (
+		'masking_http_requests_total{method="POST",path="/mask_text",status="200"}'
+		in body
+	)
+	for stage in ("preprocess", "rules", "ner", "merge", "overlap", "assemble"):
+		assert f'masking_stage_duration_seconds_count{{stage="{stage}"}}' in body
+	assert "masking_text_length_chars_bucket" in body
+	assert "masking_queue_depth 0" in body
+	assert "masking_ner_singleflight_coalesced_total" in body
+
+
+def test_metrics_scrape_does_not_build_masker(monkeypatch):
+	monkeypatch.setattr(server, "get_masker", lru_cache(maxsize=1)(pytest.fail))
+	body = TestClient(server.app).get("/metrics").text
+	assert "masking_ner_cache_hits_total 0" in body
+
+
+def test_queue_depth_released_once():
+	depth = server.QUEUE_DEPTH.value()
+	cancelled = server._QueuedCall(lambda: "実行", StageTimer())
+	assert server.QUEUE_DEPTH.value() == depth + 1
+	# 待機中にキャンセルされた場合は呼び出し側で減らす
+	assert cancelled.release()
+	assert not cancelled.release()
+	assert server.QUEUE_DEPTH.value() == depth
+
+	queued = server._QueuedCall(lambda: "実行", StageTimer())
+	assert queued() == "実行"
+	assert not queued.release()
+	assert server.QUEUE_DEPTH.value() == depth
+
+
+def test_timing_breakdown(client):
+	response = client.post(
+		"/mask_text", json={"text": "代表取締役、山田", "include_timing": True}
+	)
+	timing = response.json()["timing"]
+	assert set(timing["stages_ms"]) == {
+		"preprocess",
+		"rules",
+		"ner",
+		"merge",
+		"overlap",
+		"assemble",
+	}
+	assert "serialize;dur=" in response.headers["Server-Timing"]
+
+	response = client.post("/mask_text", json={"text": "代表取締役、山田"})
+	assert response.json()["timing"] is None
+	assert "Server-Timing" not in response.headers
+
+
+def test_trace_spans_follow_incoming_traceparent(client, tmp_path):
+	trace_path = tmp_path / "trace.jsonl"
+	configure_tracing(str(trace_path))
+	trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+	try:
+		response = client.post(
+			"/mask_text",
+			json={"text": "代表取締役、山田"},
+			headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+		)
+	finally:
+		configure_tracing(None)
+
+	assert response.headers["traceparent"].startswith(f"00-{trace_id}-")
+	spans = [json.loads(line) for line in trace_path.read_text().splitlines()]
+	assert {s["trace_id"] for s in spans} == {trace_id}
+	names = {s["name"] for s in spans}
+	assert {"POST /mask_text", "queue", "mask_text", "rules.scan", "serialize"} <= names
+	root = next(s for s in spans if s["name"] == "POST /mask_text")
+	assert root["parent_span_id"] == "00f067aa0ba902b7"
+
+
+def test_profile_endpoint_disabled_by_default(client):
+	assert client.post("/admin/profile?seconds=1").status_code == 404
+
+
+def test_profile_endpoint_writes_collapsed_stacks(client, tmp_path, monkeypatch):
+	monkeypatch.setattr(server, "PROFILE_DIR", str(tmp_path))
+	result = client.post("/admin/profile?seconds=0.2").json()
+	assert result["samples"] > 0
+	lines = open(result["path"], encoding="utf-8").read().splitlines()
+	assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_slow_requests_logged_without_text(client, tmp_path, monkeypatch):
+	path = tmp_path / "slow.log"
+	slow_log = SlowRequestLog(str(path), threshold_ms=0)
+	monkeypatch.setattr(server, "get_slow_log", lambda: slow_log)
+
+	client.post(
+		"/mask_text", json={"text": "代表取締役、山田", "categories_to_mask": None}
+	)
+
+	# 失敗したリクエストもしきい値にかかわらず記録する
+	slow_log.threshold_ms = float("inf")
+
+	def timeout(*args, **kwargs):
+		raise RuleMatchTimeoutError("制限時間を超えました")
+
+	monkeypatch.setattr(server.get_masker(), "mask_text", timeout)
+	response = client.post("/mask_text", json={"text": "代表取締役、山田"})
+	assert response.status_code == 422
+	slow_log.close()
+
+	record, failed = map(json.loads, path.read_text(encoding="utf-8").splitlines())
+	assert record["text_length"] == len("代表取締役、山田")
+	assert record["entities_by_category"] == {"POSITION": 1}
+	assert "overlap" in record["stages_ms"]
+	assert "error" not in record
+	# 鍵がない場合は辞書攻撃できるハッシュを記録しない
+	assert "content_hash" not in record
+	assert failed["error"] == "RuleMatchTimeoutError"
+	assert "山田" not in path.read_text(encoding="utf-8")
+
+	keyed = SlowRequestLog(str(tmp_path / "keyed.log"), hash_key=b"secret")
+	other = SlowRequestLog(str(tmp_path / "other.log"), hash_key=b"other")
+	assert keyed.content_hash("山田") != other.content_hash("山田")
+	keyed.close()
+	other.close()
+
+
+def test_slow_log_key_derived_from_token_secret(tmp_path, monkeypatch):
+	monkeypatch.setenv("MASKING_SLOW_LOG_MS", "1")
+	monkeypatch.setenv("MASKING_SLOW_LOG_PATH", str(tmp_path / "slow.log"))
+	monkeypatch.setenv("MASKING_TOKEN_SECRET", "secret")
+	server.get_slow_log.cache_clear()
+	try:
+		slow_log = server.get_slow_log()
+		# トークン生成と同じ鍵をそのまま使わない
+		assert slow_log.hash_key not in (None, b"secret")
+		slow_log.close()
+	finally:
+		server.get_slow_log.cache_clear()
+
+
+def test_request_text_not_logged_by_default(client, monkeypatch):
+	events = []
+
+	class Recorder:
+		def info(self, event, **fields):
+			events.append(("info", event, fields))
+
+		def debug(self, event, **fields):
+			events.append(("debug", event, fields))
+
+	monkeypatch.setattr(server, "logger", Recorder())
+	client.post("/mask_text", json={"text": "代表取締役、山田"})
+	(_, event, fields), *_ = events
+	assert event == "mask_text"
+	assert fields["original_text_length"] == len("代表取締役、山田")
+	assert "山田" not in repr(events)
+
+	# 明示的に有効にした場合のみ本文をDEBUGで残す
+	monkeypatch.setattr(server, "LOG_RAW_TEXT", True)
+	events.clear()
+	client.post("/mask_text", json={"text": "代表取締役、山田"})
+	assert [level for level, *_ in events] == ["info", "debug"]
+	assert events[1][2]["original_text"] == "代表取締役、山田"
+
+
+def test_debug_payloads_skipped_at_info_level():
+	logger = server.logger.bind()
+	assert logger.is_enabled_for(logging.INFO)
+	assert not logger.is_enabled_for(logging.DEBUG)
+
+
+def test_truncate_fields():
+	event = truncate_fields(5)(
+		None, "info", {"event": "長いイベント名", "text": "a" * 8}
+	)
+	assert event == {"event": "長いイベント名", "text": "aaaaa...(+3文字)"}
+
+
+def test_compact_response_format(client):
+	text = "代表取締役、山田"
+	compact = client.post(
+		"/mask_text", json={"text": text, "response_format": "compact"}
+	).json()
+	assert "debug_info" not in compact
+	assert compact["entities"]["original_text"] == ["代表取締役"]
+
+	decode_request = convert_masking_response_to_decode_request(compact)
+	response = client.post("/decode_text", json=decode_request.model_dump())
+	assert response.json()["decoded_text"] == text
+
+	compact = client.post(
+		"/mask_text",
+		json={"text": text, "response_format": "compact", "include_debug_info": True},
+	).json()
+	assert compact["debug_info"]["start"] == [0]
+	assert compact["debug_info"]["mask_token"] == compact["entities"]["token"]
+
+	# compact形式の結果もdebug_infoを含めれば再マスキングに使える
+	remask = {"text": text + "。", "previous_text": text, "previous_result": compact}
+	response = client.post("/remask_text", json=remask)
+	assert response.status_code == 200
+	assert response.json()["masked_text"] == compact["masked_text"] + "。"
+
+	del compact["debug_info"]
+	response = client.post("/remask_text", json=remask)
+	assert response.status_code == 422
+	assert "debug_info" in response.text
+
+
+def test_msgpack_transport(client):
+	headers = {"Content-Type": "application/msgpack", "Accept": "application/msgpack"}
+	response = client.post(
+		"/mask_text",
+		content=serialization.packb({"text": "代表取締役、山田"}),
+		headers=headers,
+	)
+	assert response.headers["content-type"] == "application/msgpack"
+	masked = serialization.unpackb(response.content)
+
+	response = client.post(
+		"/decode_batch",
+		content=serialization.packb(
+			{
+				"entity_mapping": masked["entity_mapping"],
+				"items": [{"masked_text": masked["masked_text"]}],
+			}
+		),
+		headers=headers,
+	)
+	assert serialization.unpackb(response.content) == {
+		"decoded_texts": ["代表取締役、山田"]
+	}
+
+	# Acceptを指定しなければJSONで返す
+	response = client.post(
+		"/decode_text",
+		content=serialization.packb(
+			{"masked_text": "x", "entity_mapping": masked["entity_mapping"]}
+		),
+		headers={"Content-Type": "application/msgpack"},
+	)
+	assert response.json() == {"decoded_text": "x"}
+
+
+def test_accepts_msgpack():
+	assert serialization.accepts_msgpack("application/x-msgpack")
+	assert not serialization.accepts_msgpack("application/json")
+	assert not serialization.accepts_msgpack(
+		"application/json, application/msgpack;q=0.5"
+	)
+	assert not serialization.accepts_msgpack("application/msgpack;q=0")
+
+
+def test_compressed_request_and_response(client):
+	mapping = {"X": {"original_text": "元", "masked_text": "X", "category": "c"}}
+	mapping["X"]["source"] = "rule"
+	body = json.dumps(
+		{"entity_mapping": mapping, "items": [{"masked_text": "X" * 100}] * 50}
+	).encode()
+	response = client.post(
+		"/decode_batch",
+		content=compression.compress(body, "gzip"),
+		headers={
+			"Content-Type": "application/json",
+			"Content-Encoding": "gzip",
+			"Accept-Encoding": "gzip",
+		},
+	)
+	assert response.headers["content-encoding"] == "gzip"
+	assert response.json()["decoded_texts"] == ["元" * 100] * 50
+
+	# しきい値未満のレスポンスは圧縮しない
+	response = client.post(
+		"/decode_text",
+		json={"masked_text": "X", "entity_mapping": mapping},
+		headers={"Accept-Encoding": "gzip"},
+	)
+	assert "content-encoding" not in response.headers
+
+	headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+	assert client.post("/decode_text", content=b"x", headers=headers).status_code == 400
+	headers["Content-Encoding"] = "br"
+	assert client.post("/decode_text", content=b"x", headers=headers).status_code == 415
+
+
+def test_zstd_request_and_bomb():
+	pytest.importorskip("zstandard")
+	body = json.dumps({"masked_text": "X" * 2000, "entity_mapping": {}}).encode()
+	assert compression.decompress(compression.compress(body, "zstd"), "zstd") == body
+
+	limited = TestClient(CompressionMiddleware(server.app, max_body_size=4096))
+	headers = {
+		"Content-Type": "application/json",
+		"Content-Encoding": "zstd",
+		"Accept-Encoding": "zstd",
+	}
+	response = limited.post(
+		"/decode_text", content=compression.compress(body, "zstd"), headers=headers
+	)
+	assert response.status_code == 200
+	assert response.headers["content-encoding"] == "zstd"
+	assert response.json()["decoded_text"] == "X" * 2000
+
+	# 展開すると上限を大きく超える本文は展開しきる前に拒否する
+	bomb = compression.compress(b" " * 2**24, "zstd")
+	response = limited.post("/decode_text", content=bomb, headers=headers)
+	assert response.status_code == 413
+	decompressor = compression.Decompressor("zstd", max_size=4096)
+	with pytest.raises(compression.DecompressedSizeError):
+		decompressor.decompress(bomb)
+	assert decompressor.size <= 4096
+
+
+def test_client_over_unix_socket(tmp_path):
+	socket_path = str(tmp_path / "masking.sock")
+	uds_server = uvicorn.Server(
+		uvicorn.Config(server.app, uds=socket_path, log_level="warning")
+	)
+	thread = threading.Thread(target=uds_server.run, daemon=True)
+	thread.start()
+	try:
+		deadline = time.monotonic() + 10
+		while not uds_server.started:
+			assert thread.is_alive(), "サーバーが起動前に終了しました"
+			assert time.monotonic() < deadline, "サーバーが起動しませんでした"
+			time.sleep(0.01)
+		api = MaskingClient(socket_path=socket_path)
+		masked = api.mask_text("代表取締役、山田")
+		decoded = api.decode_text(
+			masked["masked_text"], entity_mapping=masked["entity_mapping"]
+		)
+		assert decoded == "代表取締役、山田"
+	finally:
+		uds_server.should_exit = True
+		thread.join(timeout=10)